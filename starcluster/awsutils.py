@@ -21,10 +21,12 @@ EC2/S3 Utility Classes
 
 import os
 import re
+import copy
 import time
 import base64
 import string
 import tempfile
+import threading
 
 import boto
 import boto.ec2
@@ -38,6 +40,7 @@ from starcluster import static
 from starcluster import spinner
 from starcluster import sshutils
 from starcluster import webtools
+from starcluster import threadpool
 from starcluster import exception
 from starcluster import progressbar
 from starcluster.utils import print_timing
@@ -97,6 +100,15 @@ class EasyAWS(object):
 
 
 class EasyEC2(EasyAWS):
+    # fields printed for each row when listing in json/tsv format
+    INSTANCE_FIELDS = ['id', 'state', 'type', 'zone', 'ami', 'keypair',
+                       'public_ip', 'private_ip', 'dns_name', 'vpc', 'subnet',
+                       'groups', 'launch_time', 'tags']
+    VOLUME_FIELDS = ['id', 'size', 'status', 'attach_status', 'zone',
+                     'snapshot_id', 'snapshots', 'create_time', 'tags']
+    IMAGE_FIELDS = ['id', 'region', 'name', 'arch', 'root_device_type',
+                    'virtualization_type', 'is_public', 'location', 'tags']
+
     def __init__(self, aws_access_key_id, aws_secret_access_key,
                  aws_ec2_path='/', aws_s3_host=None, aws_s3_path='/',
                  aws_port=None, aws_region_name=None, aws_is_secure=True,
@@ -164,6 +176,22 @@ class EasyEC2(EasyAWS):
         self.reload()
         return self
 
+    def get_region_conn(self, region_name):
+        """
+        Returns a new EasyEC2 object connected to region_name leaving this
+        object's region untouched. This is useful for operating on several
+        regions concurrently.
+        """
+        region = self.get_region(region_name)
+        ec2 = copy.copy(self)
+        ec2._kwargs = dict(self._kwargs, region=region)
+        ec2._conn = None
+        ec2._platforms = None
+        ec2._default_vpc = None
+        ec2._account_attrs = None
+        ec2._account_attrs_region = None
+        return ec2
+
     @property
     def region(self):
         """
@@ -848,17 +876,93 @@ class EasyEC2(EasyAWS):
         print "tags: %s" % tags
         print
 
-    def list_all_instances(self, show_terminated=False):
-        tstates = ['shutting-down', 'terminated']
-        insts = self.get_all_instances()
-        if not show_terminated:
-            insts = [i for i in insts if i.state not in tstates]
-        if not insts:
-            log.info("No instances found")
+    def iter_all_instances(self, filters=None, page_size=500):
+        """
+        Generator that yields all instances matching filters. Instances are
+        fetched page_size at a time using DescribeInstances pagination so that
+        results can be processed as they arrive.
+        """
+        params = {}
+        if filters:
+            self.conn.build_filter_params(params, filters)
+        if page_size:
+            params['MaxResults'] = page_size
+        while True:
+            reservations = self.conn.get_list(
+                'DescribeInstances', params,
+                [('item', boto.ec2.instance.Reservation)], verb='POST')
+            for res in reservations:
+                for inst in res.instances:
+                    yield inst
+            if not reservations.next_token:
+                break
+            params['NextToken'] = reservations.next_token
+
+    def get_tag_filters(self, tags):
+        """
+        Returns EC2 API filters matching a dictionary of tags. Tags with a
+        value are matched on key and value, tags without a value are only
+        matched on key.
+        """
+        filters = {}
+        tagkeys = []
+        for tag in tags:
+            val = tags.get(tag)
+            if val:
+                filters["tag:%s" % tag] = val
+            elif tag:
+                tagkeys.append(tag)
+        if tagkeys:
+            filters['tag-key'] = tagkeys
+        return filters
+
+    def _get_instance_row(self, instance):
+        return dict(id=instance.id, state=instance.state,
+                    type=instance.instance_type, zone=instance.placement,
+                    ami=instance.image_id, keypair=instance.key_name,
+                    public_ip=instance.ip_address,
+                    private_ip=instance.private_ip_address,
+                    dns_name=instance.dns_name, vpc=instance.vpc_id,
+                    subnet=instance.subnet_id,
+                    groups=[g.name for g in instance.groups],
+                    launch_time=instance.launch_time, tags=instance.tags)
+
+    def list_all_instances(self, show_terminated=False, state=None,
+                           zone=None, image_id=None, instance_type=None,
+                           group=None, tags=None, output='text'):
+        """
+        Print instances to the screen as they are fetched from EC2
+
+        state, zone, image_id, instance_type, group, and tags are passed to
+        EC2 as filters. output can be one of static.LIST_OUTPUT_FORMATS.
+        """
+        filters = self.get_tag_filters(tags or {})
+        if state:
+            filters['instance-state-name'] = state
+        elif not show_terminated:
+            filters['instance-state-name'] = ['pending', 'running',
+                                              'stopping', 'stopped']
+        if zone:
+            filters['availability-zone'] = zone
+        if image_id:
+            filters['image-id'] = image_id
+        if instance_type:
+            filters['instance-type'] = instance_type
+        if group:
+            filters['instance.group-name'] = group
+        insts = self.iter_all_instances(filters=filters)
+        if output != 'text':
+            rows = (self._get_instance_row(i) for i in insts)
+            utils.print_rows(rows, self.INSTANCE_FIELDS, output=output)
             return
+        count = 0
         for instance in insts:
             self.show_instance(instance)
-        print 'Total: %s' % len(insts)
+            count += 1
+        if not count:
+            log.info("No instances found")
+            return
+        print 'Total: %s' % count
 
     def list_images(self, images, sort_key=None, reverse=False):
         def get_key(obj):
@@ -875,15 +979,41 @@ class EasyEC2(EasyAWS):
         print "\ntotal images: %d" % len(images)
         print
 
-    def list_registered_images(self):
-        images = self.registered_images
-        log.info("Your registered images:")
-        self.list_images(images)
+    def _get_image_row(self, img):
+        return dict(id=img.id, region=img.region.name,
+                    name=self.get_image_name(img), arch=img.architecture,
+                    root_device_type=img.root_device_type,
+                    virtualization_type=img.virtualization_type,
+                    is_public=img.is_public, location=img.location,
+                    tags=img.tags)
+
+    def _list_images(self, images, msg, sort_key=None, reverse=False,
+                     output='text'):
+        if output != 'text':
+            rows = (self._get_image_row(img) for img in images)
+            utils.print_rows(rows, self.IMAGE_FIELDS, output=output)
+            return
+        log.info(msg)
+        self.list_images(images, sort_key=sort_key, reverse=reverse)
+
+    def get_image_filters(self, arch=None, name=None, tags=None):
+        filters = self.get_tag_filters(tags or {})
+        if arch:
+            filters['architecture'] = arch
+        if name:
+            filters['name'] = name
+        return filters
+
+    def list_registered_images(self, filters=None, output='text'):
+        images = self.conn.get_all_images(owners=["self"], filters=filters)
+        self._list_images(images, "Your registered images:", output=output)
 
-    def list_executable_images(self):
-        images = self.executable_images
-        log.info("Private images owned by other users that you can execute:")
-        self.list_images(images)
+    def list_executable_images(self, filters=None, output='text'):
+        images = self.conn.get_all_images(executable_by=["self"],
+                                          filters=filters)
+        self._list_images(
+            images, "Private images owned by other users that you can "
+            "execute:", output=output)
 
     def __list_images(self, msg, imgs):
         counter = 0
@@ -938,10 +1068,10 @@ class EasyEC2(EasyAWS):
                         log.info("Removing snapshot: %s" % snapid)
                         snap.delete()
 
-    def list_starcluster_public_images(self):
-        images = self.conn.get_all_images(owners=[static.STARCLUSTER_OWNER_ID])
-        log.info("Listing all public StarCluster images...")
-        imgs = [img for img in images if img.is_public]
+    def list_starcluster_public_images(self, filters=None, output='text'):
+        filters = dict(filters or {}, **{'is-public': 'true'})
+        imgs = self.conn.get_all_images(owners=[static.STARCLUSTER_OWNER_ID],
+                                        filters=filters)
 
         def sc_public_sort(obj):
             split = obj.name.split('-')
@@ -951,7 +1081,9 @@ class EasyEC2(EasyAWS):
             if split[-1].startswith('rc'):
                 rc = int(split[-1].replace('rc', ''))
             return (osversion, rc)
-        self.list_images(imgs, sort_key=sc_public_sort, reverse=True)
+        self._list_images(imgs, "Listing all public StarCluster images...",
+                          sort_key=sc_public_sort, reverse=True,
+                          output=output)
 
     def create_volume(self, size, zone, snapshot_id=None):
         msg = "Creating %sGB volume in zone %s" % (size, zone)
@@ -1115,9 +1247,12 @@ class EasyEC2(EasyAWS):
     @print_timing("Migrating image")
     def migrate_image(self, image_id, destbucket, migrate_manifest=False,
                       kernel_id=None, ramdisk_id=None, region=None, cert=None,
-                      private_key=None):
+                      private_key=None, num_threads=10):
         """
         Migrate image_id files to destbucket
+
+        Image files are copied concurrently using num_threads threads. Files
+        already in destbucket with a matching ETag are skipped.
         """
         if migrate_manifest:
             utils.check_required(['ec2-migrate-manifest'])
@@ -1138,21 +1273,30 @@ class EasyEC2(EasyAWS):
         if not files:
             log.info("No files found for image: %s" % image_id)
             return
-        log.info("Migrating image: %s" % image_id)
-        widgets = [files[0].name, progressbar.Percentage(), ' ',
-                   progressbar.Bar(marker=progressbar.RotatingMarker()), ' ',
-                   progressbar.ETA(), ' ', ' ']
-        counter = 0
-        num_files = len(files)
-        pbar = progressbar.ProgressBar(widgets=widgets,
-                                       maxval=num_files).start()
-        for f in files:
-            widgets[0] = "%s: (%s/%s)" % (f.name, counter + 1, num_files)
-            # copy file to destination bucket with the same name
-            f.copy(destbucket, f.name)
-            pbar.update(counter)
-            counter += 1
-        pbar.finish()
+        dbucket = self.s3.get_bucket(destbucket)
+        prefix = os.path.commonprefix([f.name for f in files])
+        existing = dict([(k.name, k.etag) for k in dbucket.list(prefix=prefix)
+                         if hasattr(k, 'etag')])
+        todo = [f for f in files if existing.get(f.name) != f.etag]
+        if len(todo) < len(files):
+            log.info("Skipping %d file(s) already in bucket %s" %
+                     (len(files) - len(todo), destbucket))
+        if todo:
+            log.info("Migrating image: %s (%d files)" % (image_id, len(todo)))
+            pbar = self._get_transfer_progress_bar(
+                'migrating: ', sum([f.size for f in todo]))
+            lock = threading.Lock()
+
+            def _copy(f):
+                # copy file to destination bucket with the same name
+                f.copy(destbucket, f.name)
+                with lock:
+                    pbar.update(pbar.currval + f.size)
+            pool = threadpool.get_thread_pool(size=num_threads)
+            for f in todo:
+                pool.simple_job(_copy, (f,), jobid=f.name)
+            pool.wait(numtasks=len(todo), show_progress=False)
+            pbar.finish()
         if migrate_manifest:
             dbucket = self.s3.get_bucket(destbucket)
             manifest_key = dbucket.get_key(self.get_image_manifest(image))
@@ -1212,34 +1356,129 @@ class EasyEC2(EasyAWS):
         finally:
             s.stop()
 
+    def _copy_image_to_region(self, region_name, src_img, name=None,
+                              description=None, client_token=None):
+        try:
+            ec2 = self.get_region_conn(region_name)
+            resp = ec2.copy_image(src_img.region.name, src_img.id, name=name,
+                                  description=description,
+                                  client_token=client_token)
+            return region_name, resp, None
+        except Exception, e:
+            log.debug("copy to %s failed:" % region_name, exc_info=True)
+            return region_name, None, e
+
+    def _get_image_copy_progress(self, ec2, img):
+        """
+        Returns the copy progress (0-100) of img by checking the image's state
+        and the progress of its root device snapshot (if any)
+        """
+        img.update()
+        if img.state == 'available':
+            return 100
+        if img.state == 'failed':
+            reason = getattr(img, 'state_reason', None) or {}
+            raise exception.AWSError("image %s failed: %s" %
+                                     (img.id, reason.get('message', 'N/A')))
+        if img.root_device_type != 'ebs':
+            return 0
+        root = img.block_device_mapping.get(img.root_device_name)
+        if not root or not root.snapshot_id:
+            return 0
+        snap = ec2.get_snapshot(root.snapshot_id)
+        try:
+            progress = int(snap.progress.replace('%', ''))
+        except (AttributeError, ValueError):
+            progress = 0
+        return min(progress, 99)
+
+    def wait_for_image_copies(self, images, refresh_interval=10):
+        """
+        Wait for AMI copies in multiple regions to become available
+
+        images is a dictionary mapping region names to AMI ids. Progress of
+        all copies is aggregated into a single progress bar. Returns a
+        dictionary mapping region names to errors for any copies that failed.
+        """
+        conns = dict([(r, self.get_region_conn(r)) for r in images])
+        pending = dict([(r, None) for r in images])
+        errors = {}
+        progress = dict([(r, 0) for r in images])
+        log.info("Waiting for %d AMI copies to become available" %
+                 len(images))
+        widgets = ['AMI copies: ',
+                   progressbar.Bar(marker=progressbar.RotatingMarker()),
+                   ' ', progressbar.Percentage(), ' ', progressbar.ETA()]
+        pbar = progressbar.ProgressBar(widgets=widgets,
+                                       maxval=100 * len(images)).start()
+        while pending:
+            for r in pending.keys():
+                try:
+                    if pending[r] is None:
+                        # new AMIs may take a while to show up in the API
+                        pending[r] = conns[r].get_image_or_none(images[r])
+                    if pending[r] is not None:
+                        progress[r] = self._get_image_copy_progress(
+                            conns[r], pending[r])
+                except Exception, e:
+                    errors[r] = e
+                if r in errors:
+                    progress[r] = 100
+                if progress[r] == 100:
+                    pending.pop(r)
+            pbar.update(sum(progress.values()))
+            if pending:
+                time.sleep(refresh_interval)
+        pbar.finish()
+        return errors
+
     def copy_image_to_all_regions(self, source_region, source_image_id,
                                   name=None, description=None,
                                   client_token=None, add_region_to_desc=False,
                                   wait_for_copies=False):
-        current_region = self.region
-        self.connect_to_region(source_region)
-        src_img = self.get_image(source_image_id)
+        """
+        Copy source_image_id from source_region to all other regions. Copies
+        are issued concurrently using one connection per region and, if
+        wait_for_copies is True, waited on together with a single aggregated
+        progress bar. A failure in one region is logged and does not abort
+        the copies to the remaining regions.
+
+        Returns a dictionary mapping region names to the copy_image responses
+        of all successful copies.
+        """
+        src_img = self.get_region_conn(source_region).get_image(
+            source_image_id)
         regions = self.regions.copy()
         regions.pop(source_region)
         log.info("Copying %s to regions:\n%s" %
                  (src_img.id, ', '.join(regions.keys())))
         name = name or src_img.name
-        resps = {}
+        pool = threadpool.get_thread_pool(size=len(regions))
         for r in regions:
-            self.connect_to_region(r)
             desc = description or ''
             if add_region_to_desc:
                 desc += ' (%s)' % r.upper()
-            resp = self.copy_image(src_img.region.name, src_img.id, name=name,
-                                   description=desc,
-                                   client_token=client_token)
-            resps[r] = resp
-        if wait_for_copies:
-            for r in resps:
-                self.connect_to_region(r)
-                img = self.get_image(resps[r].image_id)
-                self.wait_for_ami(img)
-        self.connect_to_region(current_region.name)
+            pool.simple_job(self._copy_image_to_region, (r, src_img),
+                            dict(name=name, description=desc,
+                                 client_token=client_token), jobid=r)
+        results = pool.wait(numtasks=len(regions))
+        resps = {}
+        errors = {}
+        for r, resp, error in results:
+            if error:
+                errors[r] = error
+            else:
+                resps[r] = resp
+        if wait_for_copies and resps:
+            images = dict([(r, resps[r].image_id) for r in resps])
+            errors.update(self.wait_for_image_copies(images))
+            for r in errors:
+                resps.pop(r, None)
+        for r in sorted(errors):
+            log.error("Failed to copy %s to %s: %s" %
+                      (src_img.id, r, errors[r]))
+        if errors:
+            log.error("%d of %d copies failed" % (len(errors), len(regions)))
         return resps
 
     def create_block_device_map(self, root_snapshot_id=None,
@@ -1275,29 +1514,64 @@ class EasyEC2(EasyAWS):
                     bmap[drives[i]] = eph
         return bmap
 
+    def _get_transfer_progress_bar(self, label, total):
+        widgets = [label, progressbar.Percentage(), ' ',
+                   progressbar.Bar(marker=progressbar.RotatingMarker()), ' ',
+                   progressbar.ETA(), ' ', progressbar.FileTransferSpeed()]
+        return progressbar.ProgressBar(widgets=widgets, maxval=total).start()
+
+    def _local_file_matches_key(self, key, path):
+        """
+        Returns True if path exists and has the same size as the S3 key and,
+        for keys not uploaded in multiple parts, the same MD5 as its ETag
+        """
+        if not os.path.isfile(path) or os.path.getsize(path) != key.size:
+            return False
+        etag = key.etag.strip('"')
+        if '-' in etag:
+            return True
+        return utils.get_file_md5(path) == etag
+
     @print_timing("Downloading image")
-    def download_image_files(self, image_id, destdir):
+    def download_image_files(self, image_id, destdir, num_threads=10):
         """
         Downloads the manifest.xml and all AMI parts for image_id to destdir
+
+        Files are downloaded concurrently using num_threads threads. Files
+        already present in destdir with a matching size and ETag are skipped
+        which allows resuming an interrupted download.
         """
         if not os.path.isdir(destdir):
             raise exception.BaseException(
                 "destination directory '%s' does not exist" % destdir)
-        widgets = ['file: ', progressbar.Percentage(), ' ',
-                   progressbar.Bar(marker=progressbar.RotatingMarker()), ' ',
-                   progressbar.ETA(), ' ', progressbar.FileTransferSpeed()]
         files = self.get_image_files(image_id)
-
-        def _dl_progress_cb(trans, total):
-            pbar.update(trans)
-        log.info("Downloading image: %s" % image_id)
-        for file in files:
-            widgets[0] = "%s:" % file.name
-            pbar = progressbar.ProgressBar(widgets=widgets,
-                                           maxval=file.size).start()
-            file.get_contents_to_filename(os.path.join(destdir, file.name),
-                                          cb=_dl_progress_cb)
-            pbar.finish()
+        todo = [f for f in files if not self._local_file_matches_key(
+            f, os.path.join(destdir, f.name))]
+        if len(todo) < len(files):
+            log.info("Skipping %d file(s) already downloaded" %
+                     (len(files) - len(todo)))
+        if not todo:
+            return
+        log.info("Downloading image: %s (%d files)" % (image_id, len(todo)))
+        pbar = self._get_transfer_progress_bar(
+            'downloading: ', sum([f.size for f in todo]))
+        lock = threading.Lock()
+        transferred = {}
+
+        def _download(f):
+            def _dl_progress_cb(trans, total):
+                with lock:
+                    transferred[f.name] = trans
+                    pbar.update(sum(transferred.values()))
+            dest = os.path.join(destdir, f.name)
+            tmp = dest + '.download'
+            f.get_contents_to_filename(tmp, cb=_dl_progress_cb, num_cb=100)
+            os.rename(tmp, dest)
+        pool = threadpool.get_thread_pool(size=num_threads)
+        for f in todo:
+            pool.simple_job(_download, (f,), jobid=f.name)
+        pool.wait(numtasks=len(todo), show_progress=False)
+        pbar.finish()
 
     def list_image_files(self, image_id):
         """
@@ -1371,6 +1645,88 @@ class EasyEC2(EasyAWS):
                 volume.update()
             s.stop()
 
+    def wait_for_volumes(self, volumes, status=None, state=None,
+                         refresh_interval=5, log_func=log.info):
+        """
+        Wait for the status and/or attachment state of all volumes to become
+        status/state using a single DescribeVolumes call per refresh_interval
+        """
+        if not volumes:
+            return
+        vol_ids = [v.id for v in volumes]
+        log_func("Waiting for %d volume(s) to become '%s'... " %
+                 (len(vol_ids), state or status),
+                 extra=dict(__nonewline__=True))
+        s = spinner.Spinner()
+        s.start()
+        while True:
+            vols = self.get_volumes(filters={'volume-id': vol_ids})
+            pending = [v.id for v in vols
+                       if (status and v.status != status) or
+                       (state and v.attachment_state() != state)]
+            if not pending and len(vols) == len(vol_ids):
+                break
+            time.sleep(refresh_interval)
+        s.stop()
+
+    def wait_for_snapshots(self, snapshots, min_interval=5, max_interval=60):
+        """
+        Wait for all snapshots to complete using a single DescribeSnapshots
+        call per poll. The polling interval adapts to the progress of the
+        slowest snapshot (see utils.get_poll_interval)
+        """
+        snap_ids = [snap.id for snap in snapshots]
+        log.info("Waiting for snapshot(s) to complete: %s" %
+                 ', '.join(snap_ids))
+        widgets = ['%d snapshot(s): ' % len(snap_ids), '',
+                   progressbar.Bar(marker=progressbar.RotatingMarker()),
+                   '', progressbar.Percentage(), ' ', progressbar.ETA()]
+        pbar = progressbar.ProgressBar(widgets=widgets, maxval=100).start()
+        start = time.time()
+        while True:
+            snaps = self.get_snapshots(filters={'snapshot-id': snap_ids})
+            failed = [snap.id for snap in snaps if snap.status == 'error']
+            if failed:
+                raise exception.BaseException(
+                    "Snapshot(s) failed: %s" % ', '.join(failed))
+            progress = [int((snap.progress or '0').replace('%', '') or 0)
+                        for snap in snaps if snap.status != 'completed']
+            if not progress and len(snaps) == len(snap_ids):
+                break
+            progress = min(progress or [0])
+            pbar.update(progress)
+            time.sleep(utils.get_poll_interval(progress, time.time() - start,
+                                               min_interval, max_interval))
+        if not pbar.finished:
+            pbar.finish()
+        return snaps
+
+    def wait_for_images(self, image_ids, refresh_interval=15,
+                        log_func=log.info):
+        """
+        Wait for all image_ids to become available using a single
+        DescribeImages call per refresh_interval. Raises exception.AWSError
+        if any of the images fail.
+        """
+        log_func("Waiting for %s to become available..." %
+                 ', '.join(image_ids), extra=dict(__nonewline__=True))
+        s = spinner.Spinner()
+        s.start()
+        try:
+            while True:
+                imgs = self.get_images(filters={'image-id': image_ids})
+                failed = [img.id for img in imgs if img.state == 'failed']
+                if failed:
+                    raise exception.AWSError(
+                        "EBS image creation failed for %s" %
+                        ', '.join(failed))
+                available = [img for img in imgs if img.state == 'available']
+                if len(available) == len(image_ids):
+                    break
+                time.sleep(refresh_interval)
+        finally:
+            s.stop()
+
     def wait_for_snapshot(self, snapshot, refresh_interval=30):
         snap = snapshot
         log.info("Waiting for snapshot to complete: %s" % snap.id)
@@ -1426,9 +1782,12 @@ class EasyEC2(EasyAWS):
 
     def list_volumes(self, volume_id=None, status=None, attach_status=None,
                      size=None, zone=None, snapshot_id=None,
-                     show_deleted=False, tags=None, name=None):
+                     show_deleted=False, tags=None, name=None,
+                     output='text'):
         """
         Print a list of volumes to the screen
+
+        output can be one of static.LIST_OUTPUT_FORMATS
         """
         filters = {}
         if status:
@@ -1448,46 +1807,51 @@ class EasyEC2(EasyAWS):
         if snapshot_id:
             filters['snapshot-id'] = snapshot_id
         if tags:
-            tagkeys = []
-            for tag in tags:
-                val = tags.get(tag)
-                if val:
-                    filters["tag:%s" % tag] = val
-                elif tag:
-                    tagkeys.append(tag)
-            if tagkeys:
-                filters['tag-key'] = tagkeys
+            filters.update(self.get_tag_filters(tags))
         if name:
             filters['tag:Name'] = name
         vols = self.get_volumes(filters=filters)
         vols.sort(key=lambda x: x.create_time)
+        # fetch snapshots for all volumes at once rather than per volume
+        vol_snaps = {}
         if vols:
-            for vol in vols:
-                print "volume_id: %s" % vol.id
-                print "size: %sGB" % vol.size
-                print "status: %s" % vol.status
-                if vol.attachment_state():
-                    print "attachment_status: %s" % vol.attachment_state()
-                print "availability_zone: %s" % vol.zone
-                if vol.snapshot_id:
-                    print "snapshot_id: %s" % vol.snapshot_id
-                snapshots = self.get_snapshots(volume_ids=[vol.id])
-                if snapshots:
-                    snap_list = ' '.join([snap.id for snap in snapshots])
-                    print 'snapshots: %s' % snap_list
-                if vol.create_time:
-                    lt = utils.iso_to_localtime_tuple(vol.create_time)
-                print "create_time: %s" % lt
-                tags = []
-                for tag in vol.tags:
-                    val = vol.tags.get(tag)
-                    if val:
-                        tags.append("%s=%s" % (tag, val))
-                    else:
-                        tags.append(tag)
-                if tags:
-                    print "tags: %s" % ', '.join(tags)
-                print
+            snaps = self.get_snapshots(volume_ids=[v.id for v in vols])
+            for snap in snaps:
+                vol_snaps.setdefault(snap.volume_id, []).append(snap.id)
+        if output != 'text':
+            rows = (dict(id=vol.id, size=vol.size, status=vol.status,
+                         attach_status=vol.attachment_state(), zone=vol.zone,
+                         snapshot_id=vol.snapshot_id,
+                         snapshots=vol_snaps.get(vol.id, []),
+                         create_time=vol.create_time, tags=vol.tags)
+                    for vol in vols)
+            utils.print_rows(rows, self.VOLUME_FIELDS, output=output)
+            return
+        for vol in vols:
+            print "volume_id: %s" % vol.id
+            print "size: %sGB" % vol.size
+            print "status: %s" % vol.status
+            if vol.attachment_state():
+                print "attachment_status: %s" % vol.attachment_state()
+            print "availability_zone: %s" % vol.zone
+            if vol.snapshot_id:
+                print "snapshot_id: %s" % vol.snapshot_id
+            snapshots = vol_snaps.get(vol.id)
+            if snapshots:
+                print 'snapshots: %s' % ' '.join(snapshots)
+            if vol.create_time:
+                lt = utils.iso_to_localtime_tuple(vol.create_time)
+            print "create_time: %s" % lt
+            tags = []
+            for tag in vol.tags:
+                val = vol.tags.get(tag)
+                if val:
+                    tags.append("%s=%s" % (tag, val))
+                else:
+                    tags.append(tag)
+            if tags:
+                print "tags: %s" % ', '.join(tags)
+            print
         print 'Total: %s' % len(vols)
 
     def get_spot_history(self, instance_type, start=None, end=None, zone=None,
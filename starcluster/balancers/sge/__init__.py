@@ -734,6 +734,7 @@ class SGELoadBalancer(LoadBalancer):
         remove_nodes = self._find_nodes_for_removal(max_remove=max_remove)
         if not remove_nodes:
             log.info("No nodes can be removed at this time")
+        nodes = []
         for node in remove_nodes:
             if node.update() != "running":
                 log.error("Node %s is already dead - not removing" %
@@ -741,12 +742,15 @@ class SGELoadBalancer(LoadBalancer):
                 continue
             log.warn("Removing %s: %s (%s)" %
                      (node.alias, node.id, node.dns_name))
-            try:
-                self._cluster.remove_node(node)
-                self.__last_cluster_mod_time = utils.get_utc_now()
-            except Exception:
-                log.error("Failed to remove node %s" % node.alias,
-                          exc_info=True)
+            nodes.append(node)
+        if not nodes:
+            return
+        try:
+            self._cluster.remove_nodes(nodes=nodes)
+            self.__last_cluster_mod_time = utils.get_utc_now()
+        except Exception:
+            log.error("Failed to remove nodes %s" %
+                      ', '.join([n.alias for n in nodes]), exc_info=True)
 
     def _eval_terminate_cluster(self):
         """
@@ -17,8 +17,14 @@
 
 import os
 import re
+import sys
+import json
 import time
+import Queue
+import hashlib
+import threading
 import string
+import posixpath
 import pprint
 import warnings
 import datetime
@@ -34,6 +40,7 @@ from starcluster import deathrow
 from starcluster import exception
 from starcluster import threadpool
 from starcluster import validators
+from starcluster import receipts
 from starcluster import progressbar
 from starcluster import clustersetup
 from starcluster.node import Node
@@ -272,6 +279,88 @@ class ClusterManager(managers.Manager):
             raise ValueError("Invalid cluster group name: %s" % sg)
         return tag
 
+    def _get_cluster_instances(self, cluster_groups):
+        """
+        Returns a dictionary mapping each cluster group's id to its list of
+        (non-terminated) instances using a single DescribeInstances call
+        """
+        instances = dict([(g.id, []) for g in cluster_groups])
+        if not instances:
+            return instances
+        states = ['pending', 'running', 'stopping', 'stopped']
+        filters = {'instance-state-name': states,
+                   'instance.group-id': instances.keys()}
+        for inst in self.ec2.get_all_instances(filters=filters):
+            for group in inst.groups:
+                if group.id in instances:
+                    instances[group.id].append(inst)
+        return instances
+
+    def _get_cluster_spot_requests(self, cluster_groups, instances):
+        """
+        Returns a dictionary mapping each cluster group's id to its list of
+        active and open spot requests using a single
+        DescribeSpotInstanceRequests call. Requests are matched by their
+        launch specification's security groups or, failing that, by the
+        instance that fulfilled them. Unmatched open requests for VPC
+        clusters (whose groups are only recorded on the network interface)
+        are looked up per group.
+        """
+        spots = dict([(g.id, []) for g in cluster_groups])
+        if not spots:
+            return spots
+        inst_groups = {}
+        for group_id in instances:
+            for inst in instances[group_id]:
+                inst_groups[inst.id] = group_id
+        unmatched = []
+        filters = {'state': ['active', 'open']}
+        for spot in self.ec2.get_all_spot_requests(filters=filters):
+            lspec = spot.launch_specification
+            group_ids = [g.id for g in getattr(lspec, 'groups', None) or []
+                         if g.id in spots]
+            if not group_ids and spot.instance_id in inst_groups:
+                group_ids = [inst_groups[spot.instance_id]]
+            if not group_ids:
+                unmatched.append(spot.id)
+            for group_id in group_ids:
+                spots[group_id].append(spot)
+        vpc_groups = [g for g in cluster_groups if g.vpc_id]
+        if unmatched and vpc_groups:
+            for group in vpc_groups:
+                filters = {'spot-instance-request-id': unmatched,
+                           'network-interface.group-id': group.id}
+                spots[group.id].extend(
+                    self.ec2.get_all_spot_requests(filters=filters))
+        return spots
+
+    def _get_ssh_status(self, node, timeout):
+        if node.state != 'running' or not node.addr:
+            return node.id, False
+        ssh = None
+        try:
+            ssh = sshutils.SSHClient(node.addr, username=node.user,
+                                     private_key=node.key_location,
+                                     timeout=timeout)
+            return node.id, ssh.transport is not None
+        except exception.SSHError:
+            return node.id, False
+        finally:
+            if ssh:
+                ssh.close()
+
+    def _get_clusters_ssh_status(self, nodes, num_threads=20, timeout=5):
+        """
+        Probe SSH on each node concurrently using a bounded thread pool and
+        returns a dictionary mapping node ids to True/False
+        """
+        if not nodes:
+            return {}
+        log.info("Checking SSH status on %d nodes..." % len(nodes))
+        pool = threadpool.get_thread_pool(size=min(num_threads, len(nodes)))
+        return dict(pool.map(lambda n: self._get_ssh_status(n, timeout),
+                             nodes))
+
     def list_clusters(self, cluster_groups=None, show_ssh_status=False):
         """
         Prints a summary for each active cluster on EC2
@@ -280,28 +369,52 @@ class ClusterManager(managers.Manager):
             cluster_groups = self.get_cluster_security_groups()
             if not cluster_groups:
                 log.info("No clusters found...")
+            cluster_groups.sort(key=lambda g: g.name)
         else:
             try:
                 cluster_groups = [self.get_cluster_security_group(g) for g
                                   in cluster_groups]
             except exception.SecurityGroupDoesNotExist:
                 raise exception.ClusterDoesNotExist(g)
+        instances = self._get_cluster_instances(cluster_groups)
+        spots = self._get_cluster_spot_requests(cluster_groups, instances)
+        clusters = []
+        incompatible = {}
         for scg in cluster_groups:
+            if static.VERSION_TAG not in scg.tags:
+                incompatible[scg.id] = exception.IncompatibleCluster(scg)
+                clusters.append((scg, None, []))
+                continue
             tag = self.get_tag_from_sg(scg.name)
-            try:
-                cl = self.get_cluster(tag, group=scg, load_plugins=False,
-                                      load_volumes=False, require_keys=False)
-            except exception.IncompatibleCluster as e:
+            cl = Cluster(ec2_conn=self.ec2, cluster_tag=tag,
+                         cluster_group=scg)
+            nodes = cl._update_nodes(instances.get(scg.id))
+            if nodes:
+                cl.keyname = nodes[0].key_name
+                try:
+                    cl.key_location = self.cfg.get_key(cl.keyname).get(
+                        'key_location')
+                except exception.KeyNotFound:
+                    cl.key_location = ''
+                for node in nodes:
+                    node.key_location = cl.key_location
+            clusters.append((scg, cl, nodes))
+        ssh_status = {}
+        if show_ssh_status:
+            all_nodes = [n for scg, cl, nodes in clusters for n in nodes]
+            ssh_status = self._get_clusters_ssh_status(all_nodes)
+        for scg, cl, nodes in clusters:
+            if scg.id in incompatible:
                 sep = '*' * 60
-                log.error('\n'.join([sep, e.msg, sep]),
+                log.error('\n'.join([sep, incompatible[scg.id].msg, sep]),
                           extra=dict(__textwrap__=True))
                 print
                 continue
+            tag = cl.cluster_tag
             header = '%s (security group: %s)' % (tag, scg.name)
             print '-' * len(header)
             print header
             print '-' * len(header)
-            nodes = cl.nodes
             try:
                 n = nodes[0]
             except IndexError:
@@ -337,7 +450,7 @@ class ClusterManager(managers.Manager):
                           (vid, nid, dev, status))
             else:
                 print 'EBS volumes: N/A'
-            spot_reqs = cl.spot_requests
+            spot_reqs = spots.get(scg.id)
             if spot_reqs:
                 active = len([s for s in spot_reqs if s.state == 'active'])
                 opn = len([s for s in spot_reqs if s.state == 'open'])
@@ -357,27 +470,29 @@ class ClusterManager(managers.Manager):
                     if node.spot_id:
                         nodeline += ' (spot %s)' % node.spot_id
                     if show_ssh_status:
-                        ssh_status = {True: 'Up', False: 'Down'}
-                        nodeline += ' (SSH: %s)' % ssh_status[node.is_up()]
+                        status = {True: 'Up', False: 'Down'}
+                        is_up = ssh_status.get(node.id, False)
+                        nodeline += ' (SSH: %s)' % status[is_up]
                     print nodeline
                 print 'Total nodes: %d' % len(nodes)
             else:
                 print 'Cluster nodes: N/A'
             print
 
-    def run_plugin(self, plugin_name, cluster_tag):
+    def run_plugin(self, plugin_name, cluster_tag, force=False):
         """
         Run a plugin defined in the config.
 
         plugin_name must match the plugin's section name in the config
         cluster_tag specifies the cluster to run the plugin on
+        force - run the plugin even if it already ran with the same settings
         """
         cl = self.get_cluster(cluster_tag, load_plugins=False)
         if not cl.is_cluster_up():
             raise exception.ClusterNotRunning(cluster_tag)
         plugs = [self.cfg.get_plugin(plugin_name)]
         plug = deathrow._load_plugins(plugs)[0]
-        cl.run_plugin(plug, name=plugin_name)
+        cl.run_plugin(plug, name=plugin_name, force=force)
 
 
 class Cluster(object):
@@ -412,6 +527,10 @@ class Cluster(object):
                  disable_cloudinit=False,
                  subnet_id=None,
                  public_ips=None,
+                 nfs_profile='default',
+                 nfs_mount_options=None,
+                 ephemeral_raid=False,
+                 warm_image=False,
                  **kwargs):
         # update class vars with given vars
         _vars = locals().copy()
@@ -442,6 +561,8 @@ class Cluster(object):
         self._progress_bar = None
         self.__default_plugin = None
         self.__sge_plugin = None
+        self._baked_plugins = {}
+        self._journal_lock = threading.Lock()
 
     def __repr__(self):
         return '<Cluster: %s (%s-node)>' % (self.cluster_tag,
@@ -504,7 +625,10 @@ class Cluster(object):
         if not self.__default_plugin:
             self.__default_plugin = clustersetup.DefaultClusterSetup(
                 disable_threads=self.disable_threads,
-                num_threads=self.num_threads)
+                num_threads=self.num_threads,
+                nfs_profile=self.nfs_profile,
+                nfs_mount_options=self.nfs_mount_options,
+                ephemeral_raid=self.ephemeral_raid)
         return self.__default_plugin
 
     @property
@@ -512,9 +636,166 @@ class Cluster(object):
         if not self.__sge_plugin:
             self.__sge_plugin = sge.SGEPlugin(
                 disable_threads=self.disable_threads,
-                num_threads=self.num_threads)
+                num_threads=self.num_threads,
+                nfs_profile=self.nfs_profile,
+                nfs_mount_options=self.nfs_mount_options,
+                ephemeral_raid=self.ephemeral_raid)
         return self.__sge_plugin
 
+    @property
+    def bakeable_plugins(self):
+        return [p for p in self.plugins if getattr(p, 'bakeable', False)]
+
+    def _get_plugin_digest(self, plugin):
+        # json (rather than repr) so that plugins loaded from the cluster's
+        # tags (unicode settings) hash the same as those loaded from config
+        config = json.dumps(plugin.__plugin_metadata__, sort_keys=True)
+        return hashlib.sha1(config).hexdigest()[:12]
+
+    def get_warm_image_key(self):
+        """
+        Returns a hash of node_image_id and the configuration of this
+        cluster's bakeable plugins used to look up a matching warm image
+        """
+        digests = sorted([self._get_plugin_digest(p)
+                          for p in self.bakeable_plugins])
+        key = json.dumps([self.node_image_id, digests])
+        return hashlib.sha1(key).hexdigest()
+
+    def get_warm_image(self):
+        """
+        Returns the latest available warm image created for this cluster's
+        node_image_id and plugin configuration or None if there isn't one
+        """
+        if not self.bakeable_plugins:
+            return
+        filters = {'tag:%s' % static.WARM_IMAGE_TAG: self.get_warm_image_key(),
+                   'state': 'available'}
+        images = self.ec2.get_images(filters=filters)
+        if images:
+            # image names are user-defined - use the bake time to find the
+            # newest image (boto does not expose the image creation date)
+            return sorted(images, key=lambda img: img.tags.get(
+                static.WARM_IMAGE_TIME_TAG, ''))[-1]
+
+    def _get_baked_plugins(self, nodes):
+        """
+        Returns a dict mapping the image id of each node in nodes to the set
+        of plugin digests baked into that image
+        """
+        image_ids = set([n.image_id for n in nodes]) - set(self._baked_plugins)
+        if image_ids:
+            baked = dict([(img_id, set()) for img_id in image_ids])
+            filters = {'image-id': list(image_ids)}
+            for img in self.ec2.get_images(filters=filters):
+                digests = img.tags.get(static.WARM_IMAGE_PLUGINS_TAG, '')
+                baked[img.id] = set(filter(None, digests.split(',')))
+            self._baked_plugins.update(baked)
+        return self._baked_plugins
+
+    def _is_baked(self, plugin, method_name, args):
+        """
+        Returns True if plugin's install steps are already baked into the
+        images of all the nodes that method_name would run on
+        """
+        if not getattr(plugin, 'bakeable', False):
+            return False
+        if method_name == 'run':
+            nodes = args[0]
+        elif method_name == 'on_add_node':
+            nodes = [args[0]]
+        else:
+            return False
+        if not nodes:
+            return False
+        baked = self._get_baked_plugins(nodes)
+        digest = self._get_plugin_digest(plugin)
+        return all([digest in baked[n.image_id] for n in nodes])
+
+    def _use_warm_image(self):
+        img = self.get_warm_image()
+        if not img:
+            log.info("No warm image found for this plugin configuration - "
+                     "using %s" % self.node_image_id)
+            return
+        log.info("Using warm image %s (%s) instead of %s" %
+                 (img.id, img.name, self.node_image_id))
+        if self.master_image_id == self.node_image_id:
+            self.master_image_id = img.id
+        for itype in self.node_instance_types:
+            if itype.get('image') == self.node_image_id:
+                itype['image'] = img.id
+        self.node_image_id = img.id
+
+    def _launch_image_builder(self, instance_type=None):
+        vpc_id = getattr(self.subnet, 'vpc_id', None)
+        sg = self.ec2.get_or_create_group(static.WARM_IMAGE_GROUP,
+                                          'StarCluster image builder',
+                                          auth_ssh=True, vpc_id=vpc_id)
+        kwargs = dict(instance_type=instance_type or self.node_instance_type,
+                      key_name=self.keyname,
+                      placement=getattr(self.zone, 'name', None))
+        if self.subnet_id:
+            netif = self.ec2.get_network_spec(
+                device_index=0, associate_public_ip_address=self.public_ips,
+                subnet_id=self.subnet_id, groups=[sg.id])
+            kwargs.update(
+                network_interfaces=self.ec2.get_network_collection(netif))
+        else:
+            kwargs.update(security_groups=[sg.name])
+        resv = self.ec2.request_instances(self.node_image_id, **kwargs)
+        self.ec2.wait_for_propagation(instances=resv.instances)
+        return Node(resv.instances[0], self.key_location,
+                    alias='image-builder')
+
+    @print_timing("Creating warm image")
+    def create_warm_image(self, name=None, description=None,
+                          instance_type=None):
+        """
+        Create a "warm" EBS image with this cluster's bakeable plugins
+        pre-installed and return its id
+
+        Launches a builder instance from node_image_id, runs the bakeable
+        plugins on it, creates an image from it and tags the image with
+        get_warm_image_key() and the digests of the baked plugins. Clusters
+        with warm_image=True, the same node_image_id and the same plugin
+        configuration launch their nodes from this image and skip the baked
+        plugins on them.
+        """
+        plugins = self.bakeable_plugins
+        if not plugins:
+            raise exception.BaseException(
+                "Cluster template has no bakeable plugins - nothing to bake")
+        names = [getattr(p, '__name__', utils.get_fq_class_name(p))
+                 for p in plugins]
+        name = name or 'starcluster-warm-%s' % time.strftime("%Y%m%d%H%M")
+        description = description or 'StarCluster warm image (%s)' % \
+            ', '.join(names)
+        node = self._launch_image_builder(instance_type)
+        try:
+            log.info("Waiting for image builder %s to come up..." % node.id)
+            node.wait(interval=self.refresh_interval)
+            args = [[node], node, self.cluster_user, self.cluster_shell, {}]
+            for plugin, plugin_name in zip(plugins, names):
+                self._run_plugin(plugin, plugin_name, 'run', args)
+            # the package cache and wheelhouse are only useful while the
+            # plugins run - don't ship them in the image
+            node.ssh.execute('rm -rf %s %s' % (static.PKG_CACHE_DIR,
+                                               static.PY_WHEELHOUSE_DIR))
+            img_id = self.ec2.create_ebs_image(node.id, self.key_location,
+                                               name, description=description)
+            digests = [self._get_plugin_digest(p) for p in plugins]
+            self.ec2.conn.create_tags([img_id], {
+                static.WARM_IMAGE_TAG: self.get_warm_image_key(),
+                static.WARM_IMAGE_PLUGINS_TAG: ','.join(digests),
+                static.WARM_IMAGE_BASE_TAG: self.node_image_id,
+                static.WARM_IMAGE_TIME_TAG: time.strftime("%Y%m%d%H%M%S",
+                                                          time.gmtime())})
+            log.info("Baked plugins into %s: %s" % (img_id, ', '.join(names)))
+            return img_id
+        finally:
+            node.terminate()
+
     def load_volumes(self, vols):
         """
         Iterate through vols and set device/partition settings automatically if
@@ -571,11 +852,15 @@ class Cluster(object):
         cfg = self.__getstate__()
         return pprint.pformat(cfg)
 
-    def load_receipt(self, load_plugins=True, load_volumes=True):
+    def load_receipt(self, load_plugins=True, load_volumes=True,
+                     use_cache=True):
         """
         Load the original settings used to launch this cluster into this
         Cluster object. Settings are loaded from cluster group tags and the
-        master node's user data.
+        master node's user data. The plugins and volumes read from the
+        master's user data are cached locally (keyed on the cluster group's
+        id and tags) so that subsequent commands can skip fetching them
+        unless use_cache=False.
         """
         if not (load_plugins or load_volumes):
             return True
@@ -589,20 +874,19 @@ class Cluster(object):
                 sep = '*' * 60
                 log.warn('\n'.join([sep, msg, sep]), extra={'__textwrap__': 1})
             self.update(self._get_settings_from_tags())
-            try:
-                master = self.master_node
-            except exception.MasterDoesNotExist:
-                unfulfilled_spots = [sr for sr in self.spot_requests if not
-                                     sr.instance_id]
-                if unfulfilled_spots:
-                    self.wait_for_active_spots()
-                    master = self.master_node
-                else:
-                    raise
+            cache = receipts.ReceiptCache()
+            receipt = None
+            if use_cache:
+                receipt = cache.get(self.cluster_tag, self.cluster_group)
+            if receipt is None:
+                receipt = self._get_receipt_from_master()
+                cache.put(self.cluster_tag, self.cluster_group, receipt)
             if load_plugins:
-                self.plugins = self.load_plugins(master.get_plugins())
+                self.plugins = self.load_plugins(
+                    clustersetup.load_plugins_from_metadata(
+                        receipt['plugins']))
             if load_volumes:
-                self.volumes = master.get_volumes()
+                self.volumes = receipt['volumes']
         except exception.PluginError:
             log.error("An error occurred while loading plugins: ",
                       exc_info=True)
@@ -614,6 +898,20 @@ class Cluster(object):
             raise exception.IncompatibleCluster(self.cluster_group)
         return True
 
+    def _get_receipt_from_master(self):
+        try:
+            master = self.master_node
+        except exception.MasterDoesNotExist:
+            unfulfilled_spots = [sr for sr in self.spot_requests if not
+                                 sr.instance_id]
+            if unfulfilled_spots:
+                self.wait_for_active_spots()
+                master = self.master_node
+            else:
+                raise
+        return dict(plugins=master.get_plugins_metadata(),
+                    volumes=master.get_volumes())
+
     def __getstate__(self):
         cfg = {}
         exclude = ['key_location', 'plugins']
@@ -699,7 +997,11 @@ class Cluster(object):
                              subnet_id=self.subnet_id,
                              public_ips=self.public_ips,
                              disable_queue=self.disable_queue,
-                             disable_cloudinit=self.disable_cloudinit)
+                             disable_cloudinit=self.disable_cloudinit,
+                             nfs_profile=self.nfs_profile,
+                             nfs_mount_options=self.nfs_mount_options,
+                             ephemeral_raid=self.ephemeral_raid,
+                             warm_image=self.warm_image)
         user_settings = dict(cluster_user=self.cluster_user,
                              cluster_shell=self.cluster_shell,
                              keyname=self.keyname, spot_bid=self.spot_bid)
@@ -748,7 +1050,14 @@ class Cluster(object):
         states = ['pending', 'running', 'stopping', 'stopped']
         filters = {'instance-state-name': states,
                    'instance.group-name': self._security_group}
-        nodes = self.ec2.get_all_instances(filters=filters)
+        return self._update_nodes(self.ec2.get_all_instances(filters=filters))
+
+    def _update_nodes(self, nodes):
+        """
+        Update the node cache from a list of boto instances for this cluster
+        and return the cached Node objects sorted by alias
+        """
+        nodes = nodes or []
         # remove any cached nodes not in the current node list from EC2
         current_ids = [n.id for n in nodes]
         remove_nodes = [n for n in self._nodes if n.id not in current_ids]
@@ -1035,6 +1344,8 @@ class Cluster(object):
             else:
                 self.ec2.wait_for_propagation(instances=resp[0].instances)
         self.wait_for_cluster(msg="Waiting for node(s) to come up...")
+        if self.volumes:
+            self.attach_volumes(nodes=[self.get_node(a) for a in aliases])
         log.debug("Adding node(s): %s" % aliases)
         for alias in aliases:
             node = self.get_node(alias)
@@ -1069,15 +1380,15 @@ class Cluster(object):
                 if node.is_master():
                     raise exception.InvalidOperation(
                         "cannot remove master node")
+        try:
+            self.run_plugins(method_name="on_remove_nodes", node=nodes,
+                             reverse=True)
+        except:
+            if not force:
+                raise
+        if not terminate:
+            return
         for node in nodes:
-            try:
-                self.run_plugins(method_name="on_remove_node", node=node,
-                                 reverse=True)
-            except:
-                if not force:
-                    raise
-            if not terminate:
-                continue
             node.terminate()
 
     def _get_launch_map(self, reverse=False):
@@ -1477,29 +1788,51 @@ class Cluster(object):
 
     def attach_volumes_to_master(self):
         """
-        Attach each volume to the master node
+        Attach each volume to the master node (or, for volumes with a NODE
+        setting, to that node)
+        """
+        self.attach_volumes()
+
+    def attach_volumes(self, nodes=None):
         """
+        Attach each volume to the node named by its NODE setting (defaults to
+        the master) if that node is in nodes. All volumes are described,
+        attached and waited on in batch.
+        """
+        nodes = nodes or self.nodes
+        node_map = dict([(n.alias, n) for n in nodes])
+        master_alias = self.master_node.alias
+        vol_ids = list(set([self.volumes.get(v).get('volume_id')
+                            for v in self.volumes]))
+        ec2_vols = dict([(v.id, v) for v in
+                         self.ec2.get_volumes(filters={'volume-id': vol_ids})])
+        attached = []
         wait_for_volumes = []
         for vol in self.volumes:
             volume = self.volumes.get(vol)
             device = volume.get('device')
             vol_id = volume.get('volume_id')
-            vol = self.ec2.get_volume(vol_id)
-            if vol.attach_data.instance_id == self.master_node.id:
-                log.info("Volume %s already attached to master...skipping" %
-                         vol.id)
+            node = node_map.get(volume.get('node') or master_alias)
+            if not node or vol_id in attached:
+                continue
+            attached.append(vol_id)
+            vol = ec2_vols.get(vol_id)
+            if not vol:
+                raise exception.VolumeDoesNotExist(vol_id)
+            if vol.attach_data.instance_id == node.id:
+                log.info("Volume %s already attached to %s...skipping" %
+                         (vol.id, node.alias))
                 continue
             if vol.status != "available":
                 log.error('Volume %s not available...'
                           'please check and try again' % vol.id)
                 continue
-            log.info("Attaching volume %s to master node on %s ..." %
-                     (vol.id, device))
-            resp = vol.attach(self.master_node.id, device)
+            log.info("Attaching volume %s to %s on %s ..." %
+                     (vol.id, node.alias, device))
+            resp = vol.attach(node.id, device)
             log.debug("resp = %s" % resp)
             wait_for_volumes.append(vol)
-        for vol in wait_for_volumes:
-            self.ec2.wait_for_volume(vol, state='attached')
+        self.ec2.wait_for_volumes(wait_for_volumes, state='attached')
 
     def detach_volumes(self):
         """
@@ -1594,6 +1927,7 @@ class Cluster(object):
             pg = self.ec2.get_placement_group_or_none(self._security_group)
             if pg:
                 self.ec2.delete_group(pg)
+        receipts.ReceiptCache().remove(self.cluster_tag)
         sg = self.ec2.get_group_or_none(self._security_group)
         if sg:
             self.ec2.delete_group(sg)
@@ -1645,6 +1979,8 @@ class Cluster(object):
         """
         log.info("Starting cluster...")
         if create:
+            if self.warm_image:
+                self._use_warm_image()
             self.create_cluster()
         else:
             assert self.master_node is not None
@@ -1673,28 +2009,94 @@ class Cluster(object):
         log.info("The master node is %s" % self.master_node.dns_name)
         log.info("Configuring cluster...")
         if self.volumes:
-            self.attach_volumes_to_master()
-        self.run_plugins()
+            self.attach_volumes()
+        timings = self.run_plugins()
+        log.info("Plugin timings:\n%s" % '\n'.join(
+            ["%s: %0.3f mins" % (name, secs / 60.0)
+             for name, secs in timings]))
 
     def run_plugins(self, plugins=None, method_name="run", node=None,
-                    reverse=False):
+                    reverse=False, force=False):
         """
         Run all plugins specified in this Cluster object's self.plugins list
         Uses plugins list instead of self.plugins if specified.
 
         plugins must be a tuple: the first element is the plugin's name, the
         second element is the plugin object (a subclass of ClusterSetup)
+
+        Plugins are scheduled according to their 'requires' attribute (see
+        clustersetup.ClusterSetup). Plugins whose dependencies have finished
+        run concurrently. Returns a list of (plugin name, seconds) tuples in
+        the order the plugins finished.
+
+        Completed run/on_add_node steps are recorded in a journal on the
+        master. Steps that already completed on all of their nodes with the
+        same inputs are skipped unless force=True (see _get_plugin_step).
         """
         plugs = [self._default_plugin]
+        aliases = dict(default=self._default_plugin)
         if not self.disable_queue:
             plugs.append(self._sge_plugin)
+            aliases['sge'] = self._sge_plugin
         plugs += (plugins or self.plugins)[:]
+        deps = clustersetup.get_plugin_dependencies(plugs, aliases=aliases,
+                                                    reverse=reverse)
+        args = [self.nodes, self.master_node, self.cluster_user,
+                self.cluster_shell, self.volumes]
+        if node:
+            args.insert(0, node)
+        journal = self._load_plugin_journal(method_name, force)
+        order = range(len(plugs))
         if reverse:
-            plugs.reverse()
-        for plug in plugs:
-            self.run_plugin(plug, method_name=method_name, node=node)
+            order.reverse()
+        results = Queue.Queue()
+        pending = set(order)
+        running = set()
+        done = set()
+        timings = []
+        error = None
+        while pending or running:
+            if not error:
+                for i in order:
+                    if i in pending and deps[i] <= done:
+                        pending.remove(i)
+                        running.add(i)
+                        self.pool.simple_job(
+                            self._run_plugin_job,
+                            (i, plugs[i], method_name, args, journal), jobid=i,
+                            results_queue=results)
+            if not running:
+                break
+            i, name, elapsed, exc_info = self._get_plugin_result(results)
+            running.remove(i)
+            done.add(i)
+            timings.append((name, elapsed))
+            if exc_info and not error:
+                error = exc_info
+        if error:
+            raise error[0], error[1], error[2]
+        return timings
+
+    def _get_plugin_result(self, results):
+        # poll with a timeout so that KeyboardInterrupt is not blocked
+        while True:
+            try:
+                return results.get(timeout=1)
+            except Queue.Empty:
+                pass
+
+    def _run_plugin_job(self, index, plugin, method_name, args, journal):
+        name = getattr(plugin, '__name__', utils.get_fq_class_name(plugin))
+        start = time.time()
+        try:
+            self._run_journaled_plugin(plugin, name, method_name, args,
+                                       journal)
+            return index, name, time.time() - start, None
+        except Exception:
+            return index, name, time.time() - start, sys.exc_info()
 
-    def run_plugin(self, plugin, name='', method_name='run', node=None):
+    def run_plugin(self, plugin, name='', method_name='run', node=None,
+                   force=False):
         """
         Run a StarCluster plugin.
 
@@ -1702,20 +2104,89 @@ class Cluster(object):
         name - a user-friendly label for the plugin
         method_name - the method to run within the plugin (default: "run")
         node - optional node to pass as first argument to plugin method (used
-        for on_add_node/on_remove_node)
+        for on_add_node/on_remove_node or a list of nodes for on_remove_nodes)
+        force - run the plugin even if the plugin journal shows it already
+        completed with the same inputs
+        """
+        args = [self.nodes, self.master_node, self.cluster_user,
+                self.cluster_shell, self.volumes]
+        if node:
+            args.insert(0, node)
+        journal = self._load_plugin_journal(method_name, force)
+        name = name or getattr(plugin, '__name__',
+                               utils.get_fq_class_name(plugin))
+        self._run_journaled_plugin(plugin, name, method_name, args, journal)
+
+    def _load_plugin_journal(self, method_name, force=False):
+        """
+        Returns the master's plugin journal or None if method_name is not
+        journaled or force is True
+        """
+        if force or method_name not in static.JOURNALED_PLUGIN_METHODS:
+            return
+        try:
+            return self.master_node.get_plugin_journal()
+        except (exception.MasterDoesNotExist, exception.SSHError), e:
+            log.debug("Unable to load plugin journal: %s" % e)
+
+    def _get_plugin_step(self, plugin, name, method_name, args):
         """
+        Returns the nodes a plugin method runs on, the step's name in the
+        plugin journal and a hash of the step's inputs (the plugin's
+        settings, the cluster's node aliases, user, shell and volumes)
+        """
+        if method_name == 'on_add_node':
+            targets, nodes = [args[0]], args[1]
+        else:
+            targets = nodes = args[0]
+        user, shell, volumes = args[-3:]
+        step = '%s.%s' % ('_'.join(name.split()), method_name)
+        inputs = [plugin.__plugin_metadata__, step,
+                  sorted([n.alias for n in nodes]), user, shell, volumes]
+        digest = hashlib.sha1(json.dumps(inputs, sort_keys=True)).hexdigest()
+        return targets, step, digest
+
+    def _run_journaled_plugin(self, plugin, name, method_name, args,
+                              journal=None):
+        """
+        Runs a plugin method unless journal shows it already completed with
+        the same inputs on all of its nodes and records it in the master's
+        plugin journal when it completes. Does not use the journal if journal
+        is None.
+        """
+        if journal is None:
+            return self._run_plugin(plugin, name, method_name, args)
+        targets, step, digest = self._get_plugin_step(plugin, name,
+                                                      method_name, args)
+        if targets and all([journal.get((n.id, step)) == digest
+                            for n in targets]):
+            log.info("Plugin %s already completed with the same settings..."
+                     "skipping" % name)
+            return
+        self._run_plugin(plugin, name, method_name, args)
+        entries = [(n.id, step, digest) for n in targets]
+        try:
+            with self._journal_lock:
+                self.master_node.record_plugin_steps(entries)
+        except Exception, e:
+            log.warn("Unable to record plugin %s in the plugin journal: %s" %
+                     (name, e))
+
+    def _run_plugin(self, plugin, name, method_name, args):
         plugin_name = name or getattr(plugin, '__name__',
                                       utils.get_fq_class_name(plugin))
         try:
             func = getattr(plugin, method_name, None)
+            if not func and method_name == 'on_remove_nodes':
+                func = self._get_on_remove_node_fallback(plugin)
             if not func:
                 log.warn("Plugin %s has no %s method...skipping" %
                          (plugin_name, method_name))
                 return
-            args = [self.nodes, self.master_node, self.cluster_user,
-                    self.cluster_shell, self.volumes]
-            if node:
-                args.insert(0, node)
+            if self._is_baked(plugin, method_name, args):
+                log.info("Plugin %s is baked into the node image(s)..."
+                         "skipping" % plugin_name)
+                return
             log.info("Running plugin %s" % plugin_name)
             func(*args)
         except NotImplementedError:
@@ -1729,6 +2200,20 @@ class Cluster(object):
             log.error("Error occured while running plugin '%s':" % plugin_name)
             raise
 
+    def _get_on_remove_node_fallback(self, plugin):
+        """
+        Returns a function that calls plugin's on_remove_node once for each
+        node passed to on_remove_nodes or None if the plugin has neither
+        """
+        on_remove_node = getattr(plugin, 'on_remove_node', None)
+        if not on_remove_node:
+            return
+
+        def on_remove_nodes(remove_nodes, *args):
+            for node in remove_nodes:
+                on_remove_node(node, *args)
+        return on_remove_nodes
+
     def ssh_to_master(self, user='root', command=None, forward_x11=False,
                       forward_agent=False, pseudo_tty=False):
         return self.master_node.shell(user=user, command=command,
@@ -1744,6 +2229,135 @@ class Cluster(object):
                           pseudo_tty=pseudo_tty,
                           command=command)
 
+    def _get_broadcast_files(self, localpaths, remotepath, remote_isdir):
+        """
+        Returns a dictionary mapping the remote path of each local file that
+        put(localpaths, remotepath) will create to its local path
+        """
+        files = {}
+        for lpath in localpaths:
+            dest = remotepath
+            if remote_isdir:
+                name = os.path.basename(lpath.rstrip(os.sep))
+                dest = posixpath.join(remotepath, name)
+            if not os.path.isdir(lpath):
+                files[dest] = lpath
+                continue
+            for root, dirs, fnames in os.walk(lpath):
+                for fname in fnames:
+                    lfile = os.path.join(root, fname)
+                    rel = os.path.relpath(lfile, lpath).replace(os.sep, '/')
+                    files[posixpath.join(dest, rel)] = lfile
+        return files
+
+    def _get_remote_checksums(self, node, remote_paths):
+        """
+        Returns a tuple of node's alias and a dictionary mapping each file
+        found under remote_paths on node to its md5 checksum
+        """
+        paths = ' '.join([p.lstrip('/') for p in remote_paths])
+        cmd = "cd / && find %s -type f -print0 | xargs -0 -r md5sum" % paths
+        checksums = {}
+        for line in node.ssh.execute(cmd):
+            md5, path = line.split(None, 1)
+            checksums['/' + path] = md5
+        return node.alias, checksums
+
+    def _is_shared_path(self, node, path):
+        """
+        Returns True if path on node is mounted over NFS
+        """
+        out = node.ssh.execute("stat -f -c %%T %s" % path,
+                               ignore_exit_status=True)
+        return bool(out) and out[0].strip().startswith('nfs')
+
+    def broadcast(self, localpaths, remotepath, user=None, nodes=None,
+                  verify=True, num_channels=1):
+        """
+        Copy local files and/or directories to remotepath on the master and
+        all other running nodes
+
+        The files are uploaded from the local machine to the master only once
+        and then relayed between nodes over the cluster's internal network in
+        a binomial tree: in each round every node that already has the files
+        sends them to one node that does not. N nodes are seeded in about
+        log2(N) rounds.
+
+        user - upload the files as user rather than root (ownership is
+        preserved on all nodes)
+        nodes - nodes to copy the files to (defaults to all running nodes)
+        verify - compare the md5 checksum of each file on every node with the
+        local file and raise an exception if any of them differ
+        num_channels - number of SFTP channels used for the upload to the
+        master (see SSHClient.put)
+
+        Returns a dictionary mapping each remote file path to its local path
+        """
+        localpaths = [lpath for lpath in localpaths]
+        master = self.master_node
+        nodes = nodes or self.running_nodes
+        workers = [n for n in nodes if not n.is_master()]
+        user = user or 'root'
+        if not posixpath.isabs(remotepath):
+            home = master.getpwnam(user).pw_dir
+            remotepath = posixpath.normpath(posixpath.join(home, remotepath))
+        remote_isdir = master.ssh.isdir(remotepath)
+        if len(localpaths) > 1 and not remote_isdir:
+            raise exception.BaseException("Remote path does not exist: %s" %
+                                          remotepath)
+        files = self._get_broadcast_files(localpaths, remotepath,
+                                          remote_isdir)
+        dests = [posixpath.join(remotepath,
+                                os.path.basename(lpath.rstrip(os.sep)))
+                 if remote_isdir else remotepath for lpath in localpaths]
+        nbytes = sum([os.path.getsize(f) for f in files.values()])
+        start = time.time()
+        log.info("Uploading %d file(s) to %s..." % (len(files), master.alias))
+        master.ssh.switch_user(user)
+        try:
+            master.ssh.put(localpaths, remotepath, num_channels=num_channels)
+        finally:
+            master.ssh.switch_user('root')
+        log.info("Uploaded %.2f MB to %s in %.1f secs" %
+                 (nbytes / 1048576.0, master.alias, time.time() - start))
+        shared = workers and self._is_shared_path(
+            workers[0], remotepath if remote_isdir else
+            posixpath.dirname(remotepath))
+        if shared:
+            log.info("%s is shared over NFS, not copying to other nodes" %
+                     remotepath)
+        elif workers:
+            rounds = utils.get_binomial_tree_rounds(master, workers)
+            log.info("Relaying files to %d node(s) in %d round(s)..." %
+                     (len(workers), len(rounds)))
+            for pairs in rounds:
+                for sender, receiver in pairs:
+                    self.pool.simple_job(sender.push_files_to_nodes,
+                                         (dests, [receiver]),
+                                         jobid=receiver.alias)
+                self.pool.wait(numtasks=len(pairs))
+        elapsed = time.time() - start
+        ncopies = 1 if shared else len(workers) + 1
+        log.info("Copied %.2f MB to %d node(s) in %.1f secs (%.2f MB/s "
+                 "aggregate)" % (nbytes / 1048576.0, ncopies, elapsed,
+                                 nbytes * ncopies / 1048576.0 /
+                                 max(elapsed, 0.001)))
+        if verify:
+            log.info("Verifying checksums...")
+            checked = [master] if shared else [master] + workers
+            local = dict([(rpath, utils.get_file_md5(lpath))
+                          for rpath, lpath in files.items()])
+            remote = self.pool.map(self._get_remote_checksums, checked,
+                                   [dests] * len(checked),
+                                   jobid_fn=lambda n, p: n.alias)
+            bad = sorted([alias for alias, sums in remote
+                          if any([sums.get(f) != md5
+                                  for f, md5 in local.items()])])
+            if bad:
+                raise exception.BaseException(
+                    "Checksum mismatch on node(s): %s" % ', '.join(bad))
+        return files
+
 
 class ClusterValidator(validators.Validator):
 
@@ -2067,12 +2681,17 @@ class ClusterValidator(validators.Validator):
     def validate_ebs_settings(self):
         """
         Check EBS vols for missing/duplicate DEVICE/PARTITION/MOUNT_PATHs and
-        validate these settings.
+        validate these settings. Devices and mount paths only need to be
+        unique per node (see the volume NODE setting).
         """
         volmap = {}
         devmap = {}
         mount_paths = []
+        node_paths = []
         cluster = self.cluster
+        aliases = [cluster._make_alias(master=True)]
+        aliases += [cluster._make_alias(i)
+                    for i in range(1, cluster.cluster_size or 1)]
         for vol in cluster.volumes:
             vol_name = vol
             vol = cluster.volumes.get(vol)
@@ -2080,6 +2699,7 @@ class ClusterValidator(validators.Validator):
             device = vol.get('device')
             partition = vol.get('partition')
             mount_path = vol.get("mount_path")
+            node = vol.get('node')
             vmap = volmap.get(vol_id, {})
             devices = vmap.get('device', [])
             partitions = vmap.get('partition', [])
@@ -2093,15 +2713,28 @@ class ClusterValidator(validators.Validator):
                     "each configuration" % vol_id)
             vmap['partition'] = partitions + [partition]
             vmap['device'] = devices + [device]
+            nodes = vmap.get('node', [])
+            if nodes and node not in nodes:
+                raise exception.ClusterValidationError(
+                    "Can't attach volume %s to more than one node" % vol_id)
+            vmap['node'] = nodes + [node]
             volmap[vol_id] = vmap
-            dmap = devmap.get(device, {})
+            dmap = devmap.get((node, device), {})
             vol_ids = dmap.get('volume_id', [])
             if vol_ids and vol_id not in vol_ids:
                 raise exception.ClusterValidationError(
                     "Can't attach more than one volume on device %s" % device)
             dmap['volume_id'] = vol_ids + [vol_id]
-            devmap[device] = dmap
-            mount_paths.append(mount_path)
+            devmap[(node, device)] = dmap
+            if node:
+                if node not in aliases:
+                    log.warn("NODE %s for volume %s is not one of this "
+                             "cluster's initial nodes - the volume will only "
+                             "be attached if a node with that alias is added "
+                             "(see addnode --alias)" % (node, vol_name))
+                node_paths.append((node, mount_path))
+            else:
+                mount_paths.append(mount_path)
             if not device:
                 raise exception.ClusterValidationError(
                     'Missing DEVICE setting for volume %s' % vol_name)
@@ -2128,6 +2761,15 @@ class ClusterValidator(validators.Validator):
             if mount_paths.count(path) > 1:
                 raise exception.ClusterValidationError(
                     "Can't mount more than one volume on %s" % path)
+        for node, path in node_paths:
+            if node_paths.count((node, path)) > 1:
+                raise exception.ClusterValidationError(
+                    "Can't mount more than one volume on %s on %s" %
+                    (path, node))
+            if path in mount_paths + ['/home']:
+                raise exception.ClusterValidationError(
+                    "Can't mount a volume on %s on %s: %s is NFS-shared "
+                    "from the master" % (path, node, path))
         return True
 
     def validate_ebs_aws_settings(self):
@@ -2135,16 +2777,22 @@ class ClusterValidator(validators.Validator):
         Verify that all EBS volumes exist and are available.
         """
         cluster = self.cluster
-        for vol in cluster.volumes:
-            v = cluster.volumes.get(vol)
-            vol_id = v.get('volume_id')
-            vol = cluster.ec2.get_volume(vol_id)
+        vol_ids = list(set([cluster.volumes.get(v).get('volume_id')
+                            for v in cluster.volumes]))
+        if not vol_ids:
+            return
+        vols = dict([(v.id, v) for v in
+                     cluster.ec2.get_volumes(filters={'volume-id': vol_ids})])
+        node_ids = None
+        for vol_id in vol_ids:
+            vol = vols.get(vol_id)
+            if not vol:
+                raise exception.VolumeDoesNotExist(vol_id)
             if vol.status != 'available':
-                try:
-                    if vol.attach_data.instance_id == cluster.master_node.id:
-                        continue
-                except exception.MasterDoesNotExist:
-                    pass
+                if node_ids is None:
+                    node_ids = [n.id for n in cluster.nodes]
+                if vol.attach_data.instance_id in node_ids:
+                    continue
                 raise exception.ClusterValidationError(
                     "Volume '%s' is not available (status: %s)" %
                     (vol_id, vol.status))
@@ -18,9 +18,12 @@
 """
 clustersetup.py
 """
+import sys
 import posixpath
+import threading
 
 from starcluster import utils
+from starcluster import static
 from starcluster import threadpool
 from starcluster.utils import print_timing
 from starcluster.logger import log
@@ -33,7 +36,23 @@ class ClusterSetup(object):
 
     This is the base class for all StarCluster plugins. A plugin should
     implement at least one if not all of these methods.
+
+    Plugins may set the class attribute 'requires' to a list of plugin names
+    they depend on. Names can be a plugin's config section name, its class
+    name, its fully qualified class name, or 'default'/'sge' for the
+    built-in default setup and SGE plugins. A plugin that declares its
+    requirements runs as soon as those plugins have finished, possibly in
+    parallel with other plugins. Plugins that leave requires as None run
+    after all plugins listed before them.
+
+    Plugins whose run and on_add_node methods only install software (no
+    cluster-specific configuration) may set the class attribute 'bakeable'
+    to True. Their work can then be baked into a warm image with the
+    bakeimage command and is skipped on nodes launched from that image.
     """
+    requires = None
+    bakeable = False
+
     def __init__(self, *args, **kwargs):
         pass
 
@@ -50,6 +69,17 @@ class ClusterSetup(object):
         """
         raise NotImplementedError('on_remove_node method not implemented')
 
+    def on_remove_nodes(self, remove_nodes, nodes, master, user, user_shell,
+                        volumes):
+        """
+        This method gets executed before the nodes in remove_nodes are about
+        to be removed from the cluster. By default it calls on_remove_node for
+        each node in turn. Plugins can override it to remove several nodes at
+        once.
+        """
+        for node in remove_nodes:
+            self.on_remove_node(node, nodes, master, user, user_shell, volumes)
+
     def on_restart(self, nodes, master, user, user_shell, volumes):
         """
         This method gets executed before restart the cluster
@@ -84,11 +114,120 @@ class ClusterSetup(object):
         return plugin
 
 
+def load_plugins_from_metadata(plugins_metadata):
+    """
+    Instantiate plugin objects from a list of plugin metadata tuples
+    (class, args, kwargs) as stored in each plugin's __plugin_metadata__
+    """
+    plugs = []
+    for klass, args, kwargs in plugins_metadata:
+        mod_path, klass_name = klass.rsplit('.', 1)
+        try:
+            mod = __import__(mod_path, fromlist=[klass_name])
+            plug = getattr(mod, klass_name)(*args, **kwargs)
+        except SyntaxError, e:
+            raise exception.PluginSyntaxError(
+                "Plugin %s (%s) contains a syntax error at line %s" %
+                (klass_name, e.filename, e.lineno))
+        except ImportError, e:
+            raise exception.PluginLoadError(
+                "Failed to import plugin %s: %s" %
+                (klass_name, e[0]))
+        except Exception as exc:
+            log.error("Error occured:", exc_info=True)
+            raise exception.PluginLoadError(
+                "Failed to load plugin %s with "
+                "the following error: %s - %s" %
+                (klass_name, exc.__class__.__name__, exc.message))
+        plugs.append(plug)
+    return plugs
+
+
+def get_plugin_names(plugin):
+    """
+    Returns the names that can be used to refer to plugin in another
+    plugin's 'requires' list
+    """
+    names = [plugin.__class__.__name__, utils.get_fq_class_name(plugin)]
+    name = getattr(plugin, '__name__', None)
+    if name:
+        names.insert(0, name)
+    return names
+
+
+def get_plugin_dependencies(plugins, aliases={}, reverse=False):
+    """
+    Returns a list containing the set of indices into plugins that each
+    plugin must run after.
+
+    aliases is an optional dictionary mapping extra names to plugin objects
+    (e.g. {'sge': sge_plugin}). If reverse is True the dependencies are
+    inverted so that each plugin runs after the plugins that depend on it
+    (used for on_shutdown, on_restart, etc).
+
+    Raises exception.PluginError if the dependencies are circular.
+    """
+    index = {}
+    for i, plug in enumerate(plugins):
+        for name in get_plugin_names(plug):
+            index.setdefault(name, i)
+    for alias, plug in aliases.items():
+        for i, p in enumerate(plugins):
+            if p is plug:
+                index[alias] = i
+    deps = []
+    for i, plug in enumerate(plugins):
+        requires = getattr(plug, 'requires', None)
+        if requires is None:
+            deps.append(set(range(i)))
+            continue
+        pdeps = set()
+        for name in requires:
+            if name in index:
+                pdeps.add(index[name])
+            else:
+                log.debug("plugin %s requires %s which is not loaded" %
+                          (get_plugin_names(plug)[0], name))
+        pdeps.discard(i)
+        deps.append(pdeps)
+    if reverse:
+        rdeps = [set() for plug in plugins]
+        for i, pdeps in enumerate(deps):
+            for j in pdeps:
+                rdeps[j].add(i)
+        deps = rdeps
+    done = set()
+    while len(done) < len(plugins):
+        ready = [i for i in range(len(plugins))
+                 if i not in done and deps[i] <= done]
+        if not ready:
+            names = [get_plugin_names(plugins[i])[0]
+                     for i in range(len(plugins)) if i not in done]
+            raise exception.PluginError(
+                "Circular dependency between plugins: %s" % ', '.join(names))
+        done.update(ready)
+    return deps
+
+
 class DefaultClusterSetup(ClusterSetup):
     """
     Default ClusterSetup implementation for StarCluster
+
+    If pipelined is True (the default) each node is configured independently
+    from start to finish and only waits on the master for cluster-global
+    steps (creating the cluster user, NFS exports, and SSH keys). Otherwise
+    each setup phase is run on all nodes before moving on to the next phase.
+
+    nfs_profile selects the NFS export/mount options and nfsd thread count
+    from static.NFS_PROFILES and nfs_mount_options, if specified, are appended
+    to the profile's mount options.
+
+    If ephemeral_raid is True all ephemeral disks on each node are striped
+    into a RAID0 array mounted on /scratch (see Node.setup_ephemeral_raid).
     """
-    def __init__(self, disable_threads=False, num_threads=20):
+    def __init__(self, disable_threads=False, num_threads=20,
+                 pipelined=True, nfs_profile='default',
+                 nfs_mount_options=None, ephemeral_raid=False):
         self._nodes = None
         self._master = None
         self._user = None
@@ -96,7 +235,13 @@ class DefaultClusterSetup(ClusterSetup):
         self._volumes = None
         self._disable_threads = disable_threads
         self._num_threads = num_threads
+        self._pipelined = pipelined
+        self._user_ids = None
         self._pool = None
+        self._nfs_profile = nfs_profile or 'default'
+        self._nfs_mount_options = nfs_mount_options
+        self._nfs_network = None
+        self._ephemeral_raid = ephemeral_raid
 
     @property
     def pool(self):
@@ -181,13 +326,7 @@ class DefaultClusterSetup(ClusterSetup):
         chowning potentially terabytes of data.
         """
         user = user or self._user
-        uid, gid = self._get_new_user_id(user)
-        if uid == 0 or gid == 0:
-            raise exception.BaseException(
-                "Cannot create user: {0:s} (uid: {1:1d}, gid: {2:1d}). This "
-                "is caused by /home/{0:s} directory being owned by root. To "
-                "fix this you'll need to create a new AMI. Note that the "
-                "instance is still up.".format(user, uid, gid))
+        uid, gid = self._get_cluster_user_id(user)
         log.info("Creating cluster user: %s (uid: %d, gid: %d)" %
                  (user, uid, gid))
         self._add_user_to_nodes(uid, gid, self._nodes)
@@ -219,13 +358,25 @@ class DefaultClusterSetup(ClusterSetup):
     def _setup_scratch_on_node(self, node, users=None):
         nconn = node.ssh
         users = users or [self._user]
+        scratch = '/scratch'
+        raid_devices = None
+        if self._ephemeral_raid:
+            raid_devices = node.setup_ephemeral_raid(mount_path=scratch)
+            if raid_devices:
+                log.info("Striped %d ephemeral disks on %s into %s" %
+                         (len(raid_devices), node.alias, scratch))
         for user in users:
-            user_scratch = '/mnt/%s' % user
+            if raid_devices:
+                # /mnt is bind-mounted to the array: use real directories
+                user_scratch = posixpath.join(scratch, user)
+            else:
+                user_scratch = '/mnt/%s' % user
             if not nconn.path_exists(user_scratch):
                 nconn.mkdir(user_scratch)
-            nconn.execute('chown -R %(user)s:%(user)s /mnt/%(user)s' %
-                          {'user': user})
-            scratch = '/scratch'
+            nconn.execute('chown -R %(user)s:%(user)s %(path)s' %
+                          {'user': user, 'path': user_scratch})
+            if raid_devices:
+                continue
             if not nconn.path_exists(scratch):
                 nconn.mkdir(scratch)
             if not nconn.path_exists(posixpath.join(scratch, user)):
@@ -247,7 +398,8 @@ class DefaultClusterSetup(ClusterSetup):
         log.info("Configuring /etc/hosts on each node")
         nodes = nodes or self._nodes
         for node in nodes:
-            self.pool.simple_job(node.add_to_etc_hosts, (nodes, ),
+            self.pool.simple_job(node.update_etc_hosts, (),
+                                 dict(add=nodes, replace=True),
                                  jobid=node.alias)
         self.pool.wait(numtasks=len(nodes))
 
@@ -269,15 +421,42 @@ class DefaultClusterSetup(ClusterSetup):
                                      auth_conn_key=True)
         master.add_to_known_hosts(self._user, nodes)
 
-    def _setup_ebs_volumes(self):
+    def _is_master_volume(self, vol):
+        return vol.get('node') in (None, self._master.alias)
+
+    def _get_node_volumes(self, node):
         """
-        Mount EBS volumes, if specified in ~/.starcluster/config to /home
+        Returns the volumes (from the cluster's volume settings) attached to
+        node: volumes without a NODE setting belong to the master
         """
-        # setup /etc/fstab on master to use block device if specified
-        master = self._master
-        devices = master.get_device_map()
-        for vol in self._volumes:
-            vol = self._volumes[vol]
+        vols = [self._volumes[v] for v in self._volumes]
+        if node.is_master():
+            return [v for v in vols if self._is_master_volume(v)]
+        return [v for v in vols if v.get('node') == node.alias]
+
+    def _setup_ebs_volumes(self, nodes=None):
+        """
+        Mount EBS volumes, if specified in ~/.starcluster/config, on each node
+        in nodes (defaults to all nodes) in parallel
+        """
+        nodes = nodes or self._nodes
+        nodes = [n for n in nodes if self._get_node_volumes(n)]
+        for node in nodes:
+            self.pool.simple_job(self._mount_volumes, (node,),
+                                 jobid=node.alias)
+        self.pool.wait(numtasks=len(nodes))
+
+    def _mount_volumes(self, node):
+        """
+        Mount all EBS volumes attached to node on their mount paths
+        """
+        volumes = self._get_node_volumes(node)
+        if not volumes:
+            return
+        devices = node.get_device_map()
+        partition_map = node.get_partition_map()
+        mount_map = node.get_mount_map()
+        for vol in volumes:
             vol_id = vol.get("volume_id")
             mount_path = vol.get('mount_path')
             device = vol.get("device")
@@ -293,9 +472,10 @@ class DefaultClusterSetup(ClusterSetup):
                              (device, vol_id))
                     log.warn("Not mounting %s on %s" % (vol_id, mount_path))
                     log.warn("This usually means there was a problem "
-                             "attaching the EBS volume to the master node")
+                             "attaching the EBS volume to %s" % node.alias)
                     continue
-            partitions = master.get_partition_map(device=device)
+            partitions = dict([(p, partition_map[p]) for p in partition_map
+                               if p.startswith(device)])
             if not volume_partition:
                 if len(partitions) == 0:
                     volume_partition = device
@@ -315,8 +495,8 @@ class DefaultClusterSetup(ClusterSetup):
                          "been partitioned or that the partition "
                          "specified does not exist on the volume")
                 continue
-            log.info("Mounting EBS volume %s on %s..." % (vol_id, mount_path))
-            mount_map = master.get_mount_map()
+            log.info("Mounting EBS volume %s on %s:%s..." %
+                     (vol_id, node.alias, mount_path))
             if volume_partition in mount_map:
                 path, fstype, options = mount_map.get(volume_partition)
                 if path != mount_path:
@@ -327,17 +507,57 @@ class DefaultClusterSetup(ClusterSetup):
                         "Volume %s already mounted on %s...skipping" %
                         (vol_id, mount_path))
                 continue
-            master.mount_device(volume_partition, mount_path)
+            node.mount_device(volume_partition, mount_path)
 
     def _get_nfs_export_paths(self):
         export_paths = ['/home']
-        for vol in self._volumes:
-            vol = self._volumes[vol]
+        for vol in self._get_node_volumes(self._master):
             mount_path = vol.get('mount_path')
             if not mount_path in export_paths:
                 export_paths.append(mount_path)
         return export_paths
 
+    def _get_nfs_profile(self):
+        try:
+            return static.NFS_PROFILES[self._nfs_profile]
+        except KeyError:
+            raise exception.PluginError(
+                "Unknown NFS profile '%s' (options: %s)" %
+                (self._nfs_profile, ', '.join(static.NFS_PROFILES)))
+
+    def _get_mount_options(self):
+        opts = self._get_nfs_profile()['mount_options']
+        if self._nfs_mount_options:
+            opts = ','.join([opts, self._nfs_mount_options])
+        return opts
+
+    def _get_nfs_network(self):
+        """
+        Returns the CIDR block of the master's VPC subnet or None if the
+        cluster is not in a VPC. Nodes are always launched in the master's
+        subnet so exporting to the subnet covers every node.
+        """
+        master = self._master
+        if not self._nfs_network and master.subnet_id:
+            subnet = master.ec2.get_subnet(master.subnet_id)
+            self._nfs_network = subnet.cidr_block
+        return self._nfs_network
+
+    def _start_nfs_server(self):
+        threads = self._get_nfs_profile()['nfsd_threads']
+        self._master.start_nfs_server(nfsd_threads=threads)
+
+    def _export_fs_to_nodes(self, nodes, export_paths):
+        """
+        Export export_paths from the master to nodes using the NFS profile's
+        export options. In a VPC the paths are exported once to the subnet
+        instead of to each node.
+        """
+        self._master.export_fs_to_nodes(
+            nodes, export_paths,
+            options=self._get_nfs_profile()['export_options'],
+            network=self._get_nfs_network())
+
     def _mount_nfs_shares(self, nodes, export_paths=None):
         """
         Setup /etc/fstab and mount each nfs share listed in export_paths on
@@ -349,6 +569,7 @@ class DefaultClusterSetup(ClusterSetup):
         for node in nodes:
             self.pool.simple_job(node.mount_nfs_shares,
                                  (self._master, export_paths),
+                                 dict(mount_options=self._get_mount_options()),
                                  jobid=node.alias)
         self.pool.wait(numtasks=len(nodes))
 
@@ -357,16 +578,101 @@ class DefaultClusterSetup(ClusterSetup):
         """
         Share /home and all EBS mount paths via NFS to all nodes
         """
-        master = self._master
         # setup /etc/exports and start nfsd on master node
         nodes = nodes or self.nodes
         export_paths = export_paths or self._get_nfs_export_paths()
         if start_server:
-            master.start_nfs_server()
+            self._start_nfs_server()
         if nodes:
-            master.export_fs_to_nodes(nodes, export_paths)
+            self._export_fs_to_nodes(nodes, export_paths)
             self._mount_nfs_shares(nodes, export_paths=export_paths)
 
+    def _setup_master(self, nodes, master_ready, failed):
+        """
+        Run the cluster-global setup steps on the master. master_ready is set
+        as soon as the cluster user exists and NFS is exported to nodes so
+        that nodes can finish their own setup. failed is set if the master
+        fails before that.
+        """
+        master = self._master
+        try:
+            master.set_hostname()
+            self._mount_volumes(master)
+            uid, gid = self._get_cluster_user_id(self._user)
+            log.info("Creating cluster user: %s (uid: %d, gid: %d)" %
+                     (self._user, uid, gid))
+            self._add_user_to_node(uid, gid, master)
+            self._user_ids = (uid, gid)
+            self._setup_scratch_on_node(master)
+            master.update_etc_hosts(add=self._nodes, replace=True)
+            self._start_nfs_server()
+            if nodes:
+                self._export_fs_to_nodes(nodes, self._get_nfs_export_paths())
+        except:
+            failed.set()
+            raise
+        finally:
+            master_ready.set()
+
+    def _setup_node(self, node, master_ready, failed):
+        """
+        Run all per-node setup steps on a (non-master) node, waiting on the
+        master only for the cluster user and NFS exports
+        """
+        node.set_hostname()
+        node.update_etc_hosts(add=self._nodes, replace=True)
+        self._mount_volumes(node)
+        master_ready.wait()
+        if failed.is_set():
+            raise exception.BaseException(
+                "setup failed on master, not configuring %s" % node.alias)
+        uid, gid = self._user_ids
+        self._add_user_to_node(uid, gid, node)
+        self._setup_scratch_on_node(node)
+        node.mount_nfs_shares(self._master, self._get_nfs_export_paths(),
+                              mount_options=self._get_mount_options())
+
+    def _get_cluster_user_id(self, user):
+        uid, gid = self._get_new_user_id(user)
+        if uid == 0 or gid == 0:
+            raise exception.BaseException(
+                "Cannot create user: {0:s} (uid: {1:1d}, gid: {2:1d}). This "
+                "is caused by /home/{0:s} directory being owned by root. To "
+                "fix this you'll need to create a new AMI. Note that the "
+                "instance is still up.".format(user, uid, gid))
+        return uid, gid
+
+    @print_timing("Configuring nodes")
+    def _setup_pipelined(self):
+        """
+        Configure each node independently of the others. The master runs the
+        cluster-global steps in this thread while each worker node runs its
+        own setup in the thread pool, only blocking on the master when it
+        needs the cluster user or NFS exports.
+        """
+        nodes = self.nodes
+        master_ready = threading.Event()
+        failed = threading.Event()
+        log.info("Configuring %d node(s)..." % len(self._nodes))
+        for node in nodes:
+            self.pool.simple_job(self._setup_node,
+                                 (node, master_ready, failed),
+                                 jobid=node.alias)
+        try:
+            self._setup_master(nodes, master_ready, failed)
+        except:
+            exc_info = sys.exc_info()
+            try:
+                # drain the pool: nodes bail out as soon as failed is set
+                self.pool.wait(numtasks=len(nodes), show_progress=False)
+            except exception.ThreadPoolException:
+                pass
+            raise exc_info[0], exc_info[1], exc_info[2]
+        self.pool.wait(numtasks=len(nodes))
+        # copies keys to every node - wait until the nodes' own setup jobs
+        # (which also write files on them) are done
+        self._setup_passwordless_ssh(nodes)
+
     def run(self, nodes, master, user, user_shell, volumes):
         """Start cluster configuration"""
         self._nodes = nodes
@@ -374,6 +680,9 @@ class DefaultClusterSetup(ClusterSetup):
         self._user = user
         self._user_shell = user_shell
         self._volumes = volumes
+        if self._pipelined and not self._disable_threads:
+            self._setup_pipelined()
+            return
         self._setup_hostnames()
         self._setup_ebs_volumes()
         self._setup_cluster_user()
@@ -385,7 +694,9 @@ class DefaultClusterSetup(ClusterSetup):
     def _remove_from_etc_hosts(self, node):
         nodes = filter(lambda x: x.id != node.id, self.running_nodes)
         for n in nodes:
-            n.remove_from_etc_hosts([node])
+            self.pool.simple_job(n.remove_from_etc_hosts, ([node],),
+                                 jobid=n.alias)
+        self.pool.wait(numtasks=len(nodes))
 
     def _remove_nfs_exports(self, node):
         self._master.stop_exporting_fs_to_nodes([node])
@@ -423,6 +734,7 @@ class DefaultClusterSetup(ClusterSetup):
         self._volumes = volumes
         self._setup_hostnames(nodes=[node])
         self._setup_etc_hosts(nodes)
+        self._setup_ebs_volumes(nodes=[node])
         self._setup_nfs(nodes=[node], start_server=False)
         self._create_user(node)
         self._setup_scratch(nodes=[node])
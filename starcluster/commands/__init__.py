@@ -27,6 +27,7 @@ from sshinstance import CmdSshInstance
 from listclusters import CmdListClusters
 from s3image import CmdS3Image
 from ebsimage import CmdEbsImage
+from bakeimage import CmdBakeImage
 from downloadimage import CmdDownloadImage
 from createvolume import CmdCreateVolume
 from resizevolume import CmdResizeVolume
@@ -77,6 +78,7 @@ all_cmds = [
     CmdRemoveKey(),
     CmdS3Image(),
     CmdEbsImage(),
+    CmdBakeImage(),
     CmdShowImage(),
     CmdDownloadImage(),
     CmdRemoveImage(),
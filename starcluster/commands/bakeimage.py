@@ -0,0 +1,66 @@
+# Copyright 2009-2013 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+from starcluster.logger import log
+
+from base import CmdBase
+
+
+class CmdBakeImage(CmdBase):
+    """
+    bakeimage [options] <cluster_template>
+
+    Create a "warm" EBS image with a cluster template's plugins pre-installed
+
+    Launches a temporary instance from the template's node_image_id, runs the
+    template's bakeable plugins (e.g. pkginstaller, pypkginstaller) on it and
+    creates a new EBS image from it. The image is tagged with a hash of the
+    node_image_id and plugin configuration. Clusters started from a template
+    with WARM_IMAGE = True and the same node_image_id and plugin settings
+    launch their nodes from this image and skip the baked plugins.
+
+    Example:
+
+        $ starcluster bakeimage smallcluster
+    """
+    names = ['bakeimage', 'bimg']
+
+    def addopts(self, parser):
+        parser.add_option(
+            "-n", "--name", dest="name", action="store", type="string",
+            default=None, help="name of the new AMI")
+        parser.add_option(
+            "-d", "--description", dest="description", action="store",
+            type="string", default=None,
+            help="short description of this AMI")
+        parser.add_option(
+            "-i", "--instance-type", dest="instance_type", action="store",
+            type="string", default=None,
+            help="instance type to build the image on "
+            "(defaults to the template's node_instance_type)")
+
+    def execute(self, args):
+        if len(args) != 1:
+            self.parser.error("please specify a <cluster_template>")
+        scluster = self.cm.get_cluster_template(args[0])
+        img = scluster.get_warm_image()
+        if img:
+            log.warn("Warm image %s (%s) already exists for this "
+                     "configuration - it will be superseded by the new image" %
+                     (img.id, img.name))
+        ami_id = scluster.create_warm_image(**self.specified_options_dict)
+        log.info("Your new warm AMI id is: %s" % ami_id)
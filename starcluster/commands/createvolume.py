@@ -30,6 +30,9 @@ class CmdCreateVolume(CmdBase):
     createvolume [options] <volume_size> <volume_zone>
 
     Create a new EBS volume for use with StarCluster
+
+    Use --count to create and format several volumes at once on a single
+    volume host.
     """
 
     names = ['createvolume', 'cv']
@@ -80,6 +83,11 @@ class CmdCreateVolume(CmdBase):
             "-t", "--tag", dest="tags", action="callback", type="string",
             default={}, callback=self._build_dict,
             help="One or more tags to apply to the new volume (key=value)")
+        parser.add_option(
+            "-c", "--count", dest="count", action="store", type="int",
+            default=1, help="Number of volumes to create (volumes are "
+            "formatted concurrently on the same host and named NAME-1, "
+            "NAME-2, etc.)")
 
     def _load_keypair(self, keypair=None):
         key_location = None
@@ -138,13 +146,22 @@ class CmdCreateVolume(CmdBase):
         if host_instance:
             host_instance = node.Node(host_instance, key_location,
                                       alias="volumecreator_host")
+        count = self.opts.count
+        if count < 1:
+            self.parser.error("count must be an integer >= 1")
         kwargs = self.specified_options_dict
+        kwargs.pop('count', None)
         kwargs.update(dict(keypair=keypair, key_location=key_location,
                            host_instance=host_instance))
         vc = volume.VolumeCreator(self.ec2, **kwargs)
         if host_instance:
             vc._validate_host_instance(host_instance, zone)
         try:
-            vc.create(size, zone, name=self.opts.name, tags=self.opts.tags)
+            if count > 1:
+                vc.create_many(count, size, zone, name=self.opts.name,
+                               tags=self.opts.tags)
+            else:
+                vc.create(size, zone, name=self.opts.name,
+                          tags=self.opts.tags)
         except KeyboardInterrupt:
             raise exception.CancelledCreateVolume()
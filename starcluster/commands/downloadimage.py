@@ -35,10 +35,18 @@ class CmdDownloadImage(S3ImageCompleter):
     bucket = None
     image_name = None
 
+    def addopts(self, parser):
+        parser.add_option(
+            "-n", "--num-threads", dest="num_threads", action="store",
+            type="int", default=10,
+            help="number of AMI files to download concurrently "
+            "(default: 10)")
+
     def execute(self, args):
         if len(args) != 2:
             self.parser.error(
                 'you must specify an <image_id> and <destination_directory>')
         image_id, destdir = args
-        self.ec2.download_image_files(image_id, destdir)
+        self.ec2.download_image_files(image_id, destdir,
+                                      num_threads=self.opts.num_threads)
         log.info("Finished downloading AMI: %s" % image_id)
@@ -15,9 +15,6 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
 
-import glob
-
-from starcluster import exception
 from completers import ClusterCompleter
 
 
@@ -41,6 +38,9 @@ class CmdGet(ClusterCompleter):
         # Copy a file or dir from a node (node001 in this example)
         $ starcluster get mycluster --node node001 /remote/path /local/path
 
+        # Copy a large dir over 8 SFTP channels, resuming a previous attempt
+        $ starcluster get mycluster -c 8 --resume /remote/dir /local/dir
+
     """
     names = ['get']
 
@@ -49,6 +49,19 @@ class CmdGet(ClusterCompleter):
                           help="Transfer files as USER ")
         parser.add_option("-n", "--node", dest="node", default="master",
                           help="Transfer files from NODE (defaults to master)")
+        parser.add_option("-c", "--channels", dest="num_channels",
+                          type="int", default=1,
+                          help="Transfer files over NUM_CHANNELS concurrent "
+                          "SFTP channels (defaults to a single scp session)")
+        parser.add_option("-t", "--tar", dest="use_tar", action="store_true",
+                          default=False,
+                          help="Stream files as a single tar archive (faster "
+                          "for many small files)")
+        parser.add_option("-r", "--resume", dest="resume",
+                          action="store_true", default=False,
+                          help="Skip files that were already transferred and "
+                          "resume partial transfers (verified with md5 "
+                          "checksums)")
 
     def execute(self, args):
         if len(args) < 3:
@@ -61,8 +74,5 @@ class CmdGet(ClusterCompleter):
         node = cl.get_node(self.opts.node)
         if self.opts.user:
             node.ssh.switch_user(self.opts.user)
-        for rpath in rpaths:
-            if not glob.has_magic(rpath) and not node.ssh.path_exists(rpath):
-                raise exception.BaseException(
-                    "Remote file or directory does not exist: %s" % rpath)
-        node.ssh.get(rpaths, lpath)
+        node.ssh.get(rpaths, lpath, num_channels=self.opts.num_channels,
+                     use_tar=self.opts.use_tar, resume=self.opts.resume)
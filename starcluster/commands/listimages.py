@@ -15,6 +15,8 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
 
+from starcluster import static
+
 from base import CmdBase
 
 
@@ -32,9 +34,31 @@ class CmdListImages(CmdBase):
             action="store_true", default=False,
             help=("Show images owned by other users that " +
                   "you have permission to execute"))
+        parser.add_option(
+            "-a", "--arch", dest="arch", action="store", default=None,
+            choices=static.ARCHITECTURES,
+            help="show all images with architecture ARCH")
+        parser.add_option(
+            "-n", "--name", dest="name", action="store", type="string",
+            default=None, help="show all images whose name matches NAME "
+            "(wildcards allowed)")
+        parser.add_option(
+            "-t", "--tag", dest="tags", type="string", default={},
+            action="callback", callback=self._build_dict,
+            help="show all images with a given tag")
+        parser.add_option(
+            "-o", "--output", dest="output", action="store", default="text",
+            choices=static.LIST_OUTPUT_FORMATS,
+            help="output format: %s (default: text)" %
+            ', '.join(static.LIST_OUTPUT_FORMATS))
 
     def execute(self, args):
+        filters = self.ec2.get_image_filters(arch=self.opts.arch,
+                                             name=self.opts.name,
+                                             tags=self.opts.tags)
         if self.opts.executable:
-            self.ec2.list_executable_images()
+            self.ec2.list_executable_images(filters=filters,
+                                            output=self.opts.output)
         else:
-            self.ec2.list_registered_images()
+            self.ec2.list_registered_images(filters=filters,
+                                            output=self.opts.output)
@@ -15,6 +15,8 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
 
+from starcluster import static
+
 from base import CmdBase
 
 
@@ -30,6 +32,29 @@ class CmdListInstances(CmdBase):
         parser.add_option("-t", "--show-terminated", dest="show_terminated",
                           action="store_true", default=False,
                           help="show terminated instances")
+        parser.add_option("-S", "--state", dest="state", action="store",
+                          default=None, choices=static.INSTANCE_STATES,
+                          help="show all instances with state")
+        parser.add_option("-z", "--zone", dest="zone", action="store",
+                          type="string", default=None,
+                          help="show all instances in zone")
+        parser.add_option("-i", "--image-id", dest="image_id",
+                          action="store", type="string", default=None,
+                          help="show all instances launched from IMAGE_ID")
+        parser.add_option("-I", "--instance-type", dest="instance_type",
+                          action="store", type="string", default=None,
+                          help="show all instances of a given type")
+        parser.add_option("-g", "--group", dest="group", action="store",
+                          type="string", default=None,
+                          help="show all instances in security group")
+        parser.add_option("-T", "--tag", dest="tags", type="string",
+                          default={}, action="callback",
+                          callback=self._build_dict,
+                          help="show all instances with a given tag")
+        parser.add_option("-o", "--output", dest="output", action="store",
+                          default="text", choices=static.LIST_OUTPUT_FORMATS,
+                          help="output format: %s (default: text)" %
+                          ', '.join(static.LIST_OUTPUT_FORMATS))
 
     def execute(self, args):
-        self.ec2.list_all_instances(self.opts.show_terminated)
+        self.ec2.list_all_instances(**self.options_dict)
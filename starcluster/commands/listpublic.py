@@ -15,6 +15,8 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
 
+from starcluster import static
+
 from base import CmdBase
 
 
@@ -26,5 +28,12 @@ class CmdListPublic(CmdBase):
     """
     names = ['listpublic', 'lp']
 
+    def addopts(self, parser):
+        parser.add_option(
+            "-o", "--output", dest="output", action="store", default="text",
+            choices=static.LIST_OUTPUT_FORMATS,
+            help="output format: %s (default: text)" %
+            ', '.join(static.LIST_OUTPUT_FORMATS))
+
     def execute(self, args):
-        self.ec2.list_starcluster_public_images()
+        self.ec2.list_starcluster_public_images(output=self.opts.output)
@@ -58,6 +58,10 @@ class CmdListVolumes(CmdBase):
                           default={}, action="callback",
                           callback=self._build_dict,
                           help="show all volumes with a given tag")
+        parser.add_option("-o", "--output", dest="output", action="store",
+                          default="text", choices=static.LIST_OUTPUT_FORMATS,
+                          help="output format: %s (default: text)" %
+                          ', '.join(static.LIST_OUTPUT_FORMATS))
 
     def execute(self, args):
         self.ec2.list_volumes(**self.options_dict)
@@ -41,8 +41,18 @@ class CmdPut(ClusterCompleter):
         # Copy a file or dir to a node (node001 in this example)
         $ starcluster put mycluster --node node001 /local/path /remote/path
 
+        # Copy a file or dir to all nodes in the cluster
+        $ starcluster put mycluster --all /local/path /remote/path
+
+        # Copy many small files to the master as a single tar stream
+        $ starcluster put mycluster --tar /local/dir /remote/dir
+
 
     This will copy a file or directory to the remote server
+
+    With --all the files are uploaded to the master only once and then relayed
+    from node to node within the cluster. The md5 checksum of every file is
+    verified on each node after the transfer.
     """
     names = ['put']
 
@@ -51,6 +61,22 @@ class CmdPut(ClusterCompleter):
                           help="Transfer files as USER ")
         parser.add_option("-n", "--node", dest="node", default="master",
                           help="Transfer files to NODE (defaults to master)")
+        parser.add_option("-a", "--all", dest="all", action="store_true",
+                          default=False,
+                          help="Transfer files to all nodes in the cluster")
+        parser.add_option("-c", "--channels", dest="num_channels",
+                          type="int", default=1,
+                          help="Transfer files over NUM_CHANNELS concurrent "
+                          "SFTP channels (defaults to a single scp session)")
+        parser.add_option("-t", "--tar", dest="use_tar", action="store_true",
+                          default=False,
+                          help="Stream files as a single tar archive (faster "
+                          "for many small files)")
+        parser.add_option("-r", "--resume", dest="resume",
+                          action="store_true", default=False,
+                          help="Skip files that were already transferred and "
+                          "resume partial transfers (verified with md5 "
+                          "checksums)")
 
     def execute(self, args):
         if len(args) < 3:
@@ -64,10 +90,17 @@ class CmdPut(ClusterCompleter):
                 raise exception.BaseException(
                     "Local file or directory does not exist: %s" % lpath)
         cl = self.cm.get_cluster(ctag, load_receipt=False)
+        if self.opts.all:
+            if self.opts.node != 'master':
+                self.parser.error("--all and --node are mutually exclusive")
+            cl.broadcast(lpaths, rpath, user=self.opts.user,
+                         num_channels=self.opts.num_channels)
+            return
         node = cl.get_node(self.opts.node)
         if self.opts.user:
             node.ssh.switch_user(self.opts.user)
         if len(lpaths) > 1 and not node.ssh.isdir(rpath):
             raise exception.BaseException("Remote path does not exist: %s" %
                                           rpath)
-        node.ssh.put(lpaths, rpath)
+        node.ssh.put(lpaths, rpath, num_channels=self.opts.num_channels,
+                     use_tar=self.opts.use_tar, resume=self.opts.resume)
@@ -18,15 +18,19 @@
 from starcluster import node
 from starcluster import volume
 from starcluster import static
+from starcluster import exception
 
 from createvolume import CmdCreateVolume
 
 
 class CmdResizeVolume(CmdCreateVolume):
     """
-    resizevolume [options] <volume_id> <volume_size>
+    resizevolume [options] <volume_id> [<volume_id> ...] <volume_size>
 
-    Resize an existing EBS volume
+    Resize one or more existing EBS volumes
+
+    Multiple volumes are snapshotted, restored and resized concurrently
+    using a single volume host per zone.
 
     NOTE: The EBS volume must either be unpartitioned or contain only a single
     partition. Any other configuration will be aborted.
@@ -75,15 +79,34 @@ class CmdResizeVolume(CmdCreateVolume):
             "formatting volume (default: resize2fs)")
 
     def execute(self, args):
-        if len(args) != 2:
+        if len(args) < 2:
             self.parser.error(
                 "you must specify a volume id and a size (in GB)")
-        volid, size = args
+        volids, size = args[:-1], args[-1]
         size = self._get_size_arg(size)
+        if len(volids) > 1:
+            return self._resize_many(volids, size)
+        volid = volids[0]
         vol = self.ec2.get_volume(volid)
         zone = vol.zone
         if self.opts.dest_zone:
             zone = self.ec2.get_zone(self.opts.dest_zone).name
+        keypair, key_location, host_instance = self._get_host_instance()
+        vc = self._get_volume_creator(keypair, key_location, host_instance)
+        if host_instance:
+            vc._validate_host_instance(host_instance, zone)
+        try:
+            new_volid = vc.resize(vol, size, dest_zone=self.opts.dest_zone)
+            if new_volid:
+                self.log.info("Volume %s was successfully resized to %sGB" %
+                              (volid, size))
+                self.log.info("New volume id is: %s" % new_volid)
+            else:
+                self.log.error("failed to resize volume %s" % volid)
+        except KeyboardInterrupt:
+            self.cancel_command()
+
+    def _get_host_instance(self):
         key = self.opts.keypair
         host_instance = None
         if self.opts.host_instance:
@@ -93,19 +116,33 @@ class CmdResizeVolume(CmdCreateVolume):
         if host_instance:
             host_instance = node.Node(host_instance, key_location,
                                       alias="volumecreator_host")
+        return keypair, key_location, host_instance
+
+    def _get_volume_creator(self, keypair, key_location, host_instance):
         kwargs = self.specified_options_dict
         kwargs.update(dict(keypair=keypair, key_location=key_location,
                            host_instance=host_instance))
-        vc = volume.VolumeCreator(self.ec2, **kwargs)
-        if host_instance:
-            vc._validate_host_instance(host_instance, zone)
+        return volume.VolumeCreator(self.ec2, **kwargs)
+
+    def _resize_many(self, volids, size):
+        vols = self.ec2.get_volumes(filters={'volume-id': volids})
+        missing = set(volids) - set([v.id for v in vols])
+        if missing:
+            raise exception.VolumeDoesNotExist(', '.join(sorted(missing)))
+        if self.opts.dest_zone:
+            self.ec2.get_zone(self.opts.dest_zone)
+        keypair, key_location, host_instance = self._get_host_instance()
+        vc = self._get_volume_creator(keypair, key_location, host_instance)
         try:
-            new_volid = vc.resize(vol, size, dest_zone=self.opts.dest_zone)
+            new_volids = vc.resize_many(vols, size,
+                                        dest_zone=self.opts.dest_zone)
+        except KeyboardInterrupt:
+            self.cancel_command()
+            return
+        for volid in volids:
+            new_volid = new_volids.get(volid)
             if new_volid:
-                self.log.info("Volume %s was successfully resized to %sGB" %
-                              (volid, size))
-                self.log.info("New volume id is: %s" % new_volid)
+                self.log.info("Volume %s was successfully resized to %sGB "
+                              "(new volume id: %s)" % (volid, size, new_volid))
             else:
                 self.log.error("failed to resize volume %s" % volid)
-        except KeyboardInterrupt:
-            self.cancel_command()
@@ -30,11 +30,19 @@ class CmdRunPlugin(CmdBase):
     Example:
 
        $ starcluster runplugin myplugin mycluster
+
+    Plugins that already ran on all of the cluster's nodes with the same
+    settings are skipped. Use --force to run the plugin anyway.
     """
     names = ['runplugin', 'rp']
 
+    def addopts(self, parser):
+        parser.add_option("-f", "--force", dest="force", action="store_true",
+                          default=False, help="run the plugin even if it "
+                          "already ran with the same settings")
+
     def execute(self, args):
         if len(args) != 2:
             self.parser.error("Please provide a plugin_name and <cluster_tag>")
         plugin_name, cluster_tag = args
-        self.cm.run_plugin(plugin_name, cluster_tag)
+        self.cm.run_plugin(plugin_name, cluster_tag, force=self.opts.force)
@@ -18,14 +18,34 @@
 import os
 import time
 import string
+import threading
 
 from starcluster import utils
 from starcluster import sshutils
 from starcluster import exception
+from starcluster import progressbar
 from starcluster.spinner import Spinner
 from starcluster.utils import print_timing
 from starcluster.logger import log
 
+# removes ssh keys, logs, root's files and /tmp from an image host in a single
+# remote command
+PRIVATE_DATA_CLEANUP_CMDS = [
+    'find /home -maxdepth 1 -type d -exec rm -rf {}/.ssh \;',
+    'rm -f /etc/ssh/ssh_host*key*',
+    'rm -f /var/log/secure',
+    'rm -f /var/log/lastlog',
+    'rm -rf /var/log/*.gz',
+    'rm -rf /root/*',
+    'rm -f /root/.bash_history',
+    'rm -rf /root/*.hist*',
+    'rm -rf /tmp/*',
+]
+
+# paths that are not synced to the root volume of a new EBS image
+ROOT_SYNC_EXCLUDES = ['/root/.ssh', '/tmp/*', '/var/tmp/*',
+                      '/var/cache/apt/archives/*.deb', '/var/cache/yum/*']
+
 
 class ImageCreator(object):
     """
@@ -56,21 +76,8 @@ class ImageCreator(object):
         self.ramdisk_id = ramdisk_id or self.host.ramdisk
 
     def clean_private_data(self):
-        log.info('Removing private data...')
-        conn = self.host_ssh
-        conn.execute('find /home -maxdepth 1 -type d -exec rm -rf {}/.ssh \;')
-        log.info("Cleaning up SSH host keys")
-        conn.execute('rm -f /etc/ssh/ssh_host*key*')
-        log.info("Cleaning up /var/log")
-        conn.execute('rm -f /var/log/secure')
-        conn.execute('rm -f /var/log/lastlog')
-        conn.execute('rm -rf /var/log/*.gz')
-        log.info("Cleaning out /root")
-        conn.execute('rm -rf /root/*')
-        conn.execute('rm -f /root/.bash_history')
-        conn.execute('rm -rf /root/*.hist*')
-        log.info("Cleaning up /tmp")
-        conn.execute('rm -rf /tmp/*')
+        log.info('Removing private data (SSH keys, logs, /root, /tmp)...')
+        self.host_ssh.execute(' && '.join(PRIVATE_DATA_CLEANUP_CMDS))
 
 
 class S3ImageCreator(ImageCreator):
@@ -225,20 +232,39 @@ class EBSImageCreator(ImageCreator):
 
     def __init__(self, easy_ec2, instance_id, key_location, name,
                  description=None, snapshot_description=None,
-                 kernel_id=None, ramdisk_id=None, **kwargs):
+                 kernel_id=None, ramdisk_id=None, sync_procs=4, **kwargs):
         super(EBSImageCreator, self).__init__(easy_ec2, instance_id,
                                               key_location, description,
                                               kernel_id, ramdisk_id)
         self.name = name
         self.description = description
         self.snapshot_description = snapshot_description or description
+        self.sync_procs = sync_procs
         self._snap = None
         self._vol = None
+        self._timings = []
+
+    def _run_phase(self, name, method, *args, **kwargs):
+        """
+        Run method(*args, **kwargs) and record how long it took as phase name
+        """
+        start = time.time()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            self._timings.append((name, time.time() - start))
+
+    def _log_timings(self):
+        if self._timings:
+            log.info("Image creation timings:\n%s" % '\n'.join(
+                ["%s: %0.3f mins" % (name, secs / 60.0)
+                 for name, secs in self._timings]))
 
     @print_timing
     def create_image(self, size=15):
+        self._timings = []
         try:
-            self.clean_private_data()
+            self._run_phase("Removing private data", self.clean_private_data)
             if self.host.root_device_type == "ebs":
                 return self._create_image_from_ebs(size)
             return self._create_image_from_instance_store(size)
@@ -252,53 +278,64 @@ class EBSImageCreator(ImageCreator):
                 self._vol.detach(force=True)
                 self._vol.delete()
             raise
+        finally:
+            self._log_timings()
 
     def _create_image_from_ebs(self, size=15):
         log.info("Creating new EBS AMI...")
-        imgid = self.ec2.create_image(self.host.id, self.name,
-                                      self.description)
-        img = self.ec2.get_image(imgid)
+        imgid = self._run_phase("Creating image", self.ec2.create_image,
+                                self.host.id, self.name, self.description)
         log.info("New EBS AMI created: %s" % imgid)
+        self._run_phase("Waiting for snapshot", self._wait_for_ebs_snapshot,
+                        imgid)
+        self._run_phase("Waiting for image", self.ec2.wait_for_images,
+                        [imgid])
+        return imgid
+
+    def _wait_for_ebs_snapshot(self, imgid):
+        img = self.ec2.get_image(imgid)
         root_dev = self.host.root_device_name
-        if root_dev in self.host.block_device_mapping:
-            log.info("Fetching block device mapping for %s" % imgid,
-                     extra=dict(__nonewline__=True))
-            s = Spinner()
-            try:
-                s.start()
-                while root_dev not in img.block_device_mapping:
-                    img = self.ec2.get_image(imgid)
-                    time.sleep(5)
-            finally:
-                s.stop()
-            snapshot_id = img.block_device_mapping[root_dev].snapshot_id
-            snap = self.ec2.get_snapshot(snapshot_id)
-            self.ec2.wait_for_snapshot(snap)
-        else:
+        if root_dev not in self.host.block_device_mapping:
             log.warn("Unable to find root device - cant wait for snapshot")
-        log.info("Waiting for %s to become available..." % imgid,
+            return
+        log.info("Fetching block device mapping for %s" % imgid,
                  extra=dict(__nonewline__=True))
         s = Spinner()
         try:
             s.start()
-            while img.state == "pending":
-                time.sleep(15)
-                if img.update() == "failed":
-                    raise exception.AWSError(
-                        "EBS image creation failed for %s" % imgid)
+            while root_dev not in img.block_device_mapping:
+                time.sleep(5)
+                img = self.ec2.get_image(imgid)
         finally:
             s.stop()
-        return imgid
+        snapshot_id = img.block_device_mapping[root_dev].snapshot_id
+        snap = self.ec2.get_snapshot(snapshot_id)
+        self.ec2.wait_for_snapshots([snap])
 
     def _create_image_from_instance_store(self, size=15):
-        host = self.host
-        host_ssh = self.host_ssh
         log.info("Creating new EBS-backed image from instance-store instance")
+        vol, dev = self._run_phase("Creating root volume",
+                                   self._create_root_volume, size)
+        fs_type, mount_point = self._run_phase(
+            "Formatting root volume", self._format_root_volume, vol, dev)
+        self._run_phase("Syncing root filesystem", self._sync_root_fs, vol,
+                        mount_point, fs_type)
+        self._run_phase("Detaching root volume", self._detach_root_volume,
+                        vol, dev, mount_point)
+        snap = self._run_phase("Creating snapshot", self._snapshot_volume,
+                               vol)
+        img_id = self._run_phase("Registering image", self._register_image,
+                                 snap)
+        self._run_phase("Waiting for image", self.ec2.wait_for_images,
+                        [img_id])
+        return img_id
+
+    def _create_root_volume(self, size):
+        host = self.host
         log.info("Creating new root volume...")
         vol = self._vol = self.ec2.create_volume(size, host.placement)
         log.info("Created new volume: %s" % vol.id)
-        while vol.update() != 'available':
-            time.sleep(5)
+        self.ec2.wait_for_volumes([vol], status='available')
         dev = None
         for i in string.ascii_lowercase[::-1]:
             dev = '/dev/sd%s' % i
@@ -307,12 +344,31 @@ class EBSImageCreator(ImageCreator):
         log.info("Attaching volume %s to instance %s on %s" %
                  (vol.id, host.id, dev))
         vol.attach(host.id, dev)
-        while vol.update() != 'in-use':
-            time.sleep(5)
-        while not host_ssh.path_exists(dev):
-            time.sleep(5)
-        log.info("Formatting %s..." % vol.id)
-        host_ssh.execute('mkfs.ext3 -F %s' % dev, silent=False)
+        self.ec2.wait_for_volumes([vol], state='attached')
+        # newer kernels name the device /dev/xvdX instead of /dev/sdX
+        xvdev = dev.replace('/dev/sd', '/dev/xvd')
+        while True:
+            if self.host_ssh.path_exists(dev):
+                return vol, dev
+            if self.host_ssh.path_exists(xvdev):
+                return vol, xvdev
+            time.sleep(2)
+
+    def _format_root_volume(self, vol, dev):
+        """
+        Format dev with ext4 (using lazy inode table initialization) falling
+        back to ext3 if the host does not have mkfs.ext4
+        """
+        host_ssh = self.host_ssh
+        if host_ssh.get_status('command -v mkfs.ext4') == 0:
+            fs_type = 'ext4'
+            mkfs = ('mkfs.ext4 -F -E lazy_itable_init=1 %(dev)s || '
+                    'mkfs.ext4 -F %(dev)s')
+        else:
+            fs_type = 'ext3'
+            mkfs = 'mkfs.ext3 -F %(dev)s'
+        log.info("Formatting %s (%s)..." % (vol.id, fs_type))
+        host_ssh.execute(mkfs % dict(dev=dev), silent=False)
         log.info("Setting filesystem label on %s" % dev)
         host_ssh.execute('e2label %s /' % dev)
         mount_point = '/ebs'
@@ -321,42 +377,95 @@ class EBSImageCreator(ImageCreator):
         host_ssh.mkdir(mount_point)
         log.info("Mounting %s on %s" % (dev, mount_point))
         host_ssh.execute('mount %s %s' % (dev, mount_point))
+        return fs_type, mount_point
+
+    def _get_used_bytes(self, *paths):
+        lines = self.host_ssh.execute('df -P -B1 %s' % ' '.join(paths))
+        return [int(line.split()[2]) for line in lines[1:]]
+
+    def _sync_root_fs(self, vol, mount_point, fs_type):
+        """
+        Sync the root filesystem to mount_point running one rsync per
+        top-level directory (sync_procs at a time) and skipping
+        ROOT_SYNC_EXCLUDES. Progress is estimated from the space used on the
+        volume vs the root filesystem.
+        """
+        host_ssh = self.host_ssh
         log.info("Configuring /etc/fstab")
         host_ssh.remove_lines_from_file('/etc/fstab', '/mnt')
         fstab = host_ssh.remote_file('/etc/fstab', 'a')
         fstab.write('/dev/sdb1 /mnt auto defaults,nobootwait 0 0\n')
         fstab.close()
         log.info("Syncing root filesystem to new volume (%s)" % vol.id)
-        host_ssh.execute(
-            'rsync -aqx --exclude %(mpt)s --exclude /root/.ssh / %(mpt)s' %
-            {'mpt': mount_point}, silent=False)
+        excludes = ' '.join(["--exclude '%s'" % e for e in ROOT_SYNC_EXCLUDES])
+        # copy the top-level entries first (this also creates empty mount
+        # points) then fan out one rsync per top-level directory that lives
+        # on the root filesystem
+        cmd = ("rsync -aqx --exclude %(mpt)s --exclude '/*/*' / %(mpt)s/ && "
+               "rootdev=$(stat -c %%d /) && for d in /*; do "
+               "[ -d \"$d\" -a ! -L \"$d\" -a \"$d\" != %(mpt)s ] && "
+               "[ \"$(stat -c %%d \"$d\")\" = \"$rootdev\" ] && "
+               "echo \"$d\"; done | xargs -P %(procs)d -I{} "
+               "rsync -aqx %(excludes)s {} %(mpt)s/")
+        cmd %= dict(mpt=mount_point, procs=self.sync_procs, excludes=excludes)
+        errors = []
+
+        def sync():
+            try:
+                host_ssh.execute(cmd, silent=False)
+            except Exception, e:
+                errors.append(e)
+        t = threading.Thread(target=sync)
+        t.start()
+        total = max(self._get_used_bytes('/')[0], 1)
+        widgets = ['Syncing: ', progressbar.Percentage(), ' ',
+                   progressbar.Bar(marker=progressbar.RotatingMarker()),
+                   ' ', progressbar.ETA()]
+        pbar = progressbar.ProgressBar(widgets=widgets, maxval=100).start()
+        while t.isAlive():
+            t.join(10)
+            used = self._get_used_bytes(mount_point)[0]
+            pbar.update(min(99, used * 100 / total))
+        if errors:
+            raise errors[0]
+        pbar.finish()
+        if fs_type != 'ext3':
+            # make sure the new root filesystem's type is right in its fstab
+            host_ssh.execute("sed -i -r 's@^(\S+\s+/\s+)ext[23]\s@\\1%s @' "
+                             "%s/etc/fstab" % (fs_type, mount_point))
+
+    def _detach_root_volume(self, vol, dev, mount_point):
         log.info("Unmounting %s from %s" % (dev, mount_point))
-        host_ssh.execute('umount %s' % mount_point)
+        self.host_ssh.execute('umount %s' % mount_point)
         log.info("Detaching volume %s from %s" % (dev, mount_point))
         vol.detach()
-        while vol.update() != 'available':
-            time.sleep(5)
+        self.ec2.wait_for_volumes([vol], status='available')
+
+    def _snapshot_volume(self, vol):
         sdesc = self.snapshot_description
-        snap = self._snap = self.ec2.create_snapshot(vol,
-                                                     description=sdesc,
-                                                     wait_for_snapshot=True)
+        snap = self._snap = self.ec2.create_snapshot(vol, description=sdesc)
+        self.ec2.wait_for_snapshots([snap])
         log.info("New snapshot created: %s" % snap.id)
         log.info("Removing generated volume %s" % vol.id)
         vol.delete()
+        self._vol = None
+        return snap
+
+    def _register_image(self, snap):
         log.info("Creating root block device map using snapshot %s" % snap.id)
         bmap = self.ec2.create_block_device_map(root_snapshot_id=snap.id,
                                                 instance_store=True,
                                                 num_ephemeral_drives=1,
                                                 add_ephemeral_drives=True)
         log.info("Registering new image...")
-        img_id = self.ec2.register_image(name=self.name,
-                                         description=self.description,
-                                         architecture=host.architecture,
-                                         kernel_id=self.kernel_id,
-                                         ramdisk_id=self.ramdisk_id,
-                                         root_device_name='/dev/sda1',
-                                         block_device_map=bmap)
-        return img_id
+        host = self.host
+        return self.ec2.register_image(name=self.name,
+                                       description=self.description,
+                                       architecture=host.architecture,
+                                       kernel_id=self.kernel_id,
+                                       ramdisk_id=self.ramdisk_id,
+                                       root_device_name='/dev/sda1',
+                                       block_device_map=bmap)
 
 
 # for backwards compatibility
@@ -18,8 +18,10 @@
 import re
 import time
 import stat
+import pipes
 import base64
 import posixpath
+import threading
 import subprocess
 
 from starcluster import utils
@@ -28,10 +30,85 @@ from starcluster import sshutils
 from starcluster import awsutils
 from starcluster import managers
 from starcluster import userdata
+from starcluster import clustersetup
 from starcluster import exception
 from starcluster.logger import log
 
 
+# Stripes all of the node's ephemeral (instance-store) disks into a RAID0
+# array and mounts it on %(mount_path)s. /mnt, normally the first ephemeral
+# disk, is bind-mounted to the array so that existing users of /mnt also get
+# the striped storage. An existing array is looked up in /proc/mdstat by its
+# member devices since it may come back under another name (e.g. /dev/md127)
+# after a reboot. Both mounts are added to /etc/fstab with nofail so that a
+# stopped and started node, whose ephemeral disks are wiped, still boots.
+# The array's member devices are printed on the last line.
+EPHEMERAL_RAID_TEMPLATE = """\
+MD=%(device)s
+MNT=%(mount_path)s
+BDM=%(metadata_uri)s/meta-data/block-device-mapping
+devs=""
+for eph in $(curl -sf $BDM/ | grep ephemeral); do
+    d=$(curl -sf $BDM/$eph)
+    d=${d#/dev/}
+    for dev in /dev/$d /dev/${d/#sd/xvd}; do
+        if [ -b $dev ]; then
+            devs="$devs $dev"
+            break
+        fi
+    done
+done
+n=$(echo $devs | wc -w)
+if [ $n -lt 2 ] || ! command -v mdadm >/dev/null; then
+    echo "RAID0:"
+    exit 0
+fi
+for dev in $devs; do
+    md=$(awk -v d=${dev#/dev/} '$1 ~ /^md/ {
+             for (i = 3; i <= NF; i++) if (index($i, d "[") == 1) print $1
+         }' /proc/mdstat)
+    if [ -n "$md" ]; then
+        MD=/dev/$md
+        mdadm --run $MD >/dev/null 2>&1
+        break
+    fi
+done
+if [ -z "$md" ] && ! mdadm --assemble $MD $devs >/dev/null 2>&1; then
+    for dev in $devs; do
+        umount $dev 2>/dev/null
+        awk -v dev=$dev -v sdev=${dev/#\\/dev\\/xvd//dev/sd} \\
+            '$1 != dev && $1 != sdev' /etc/fstab > /etc/fstab.starcluster
+        mv -f /etc/fstab.starcluster /etc/fstab
+    done
+    mdadm --create $MD --run --level=0 --raid-devices=$n $devs || exit 1
+    mkfs.ext4 -q $MD || exit 1
+    mdconf=/etc/mdadm/mdadm.conf
+    [ -d /etc/mdadm ] || mdconf=/etc/mdadm.conf
+    mdadm --detail --scan | grep " $MD " >> $mdconf
+fi
+mkdir -p $MNT
+mountpoint -q $MNT || mount -o noatime $MD $MNT || exit 1
+mountpoint -q /mnt || mount --bind $MNT /mnt
+uuid=$(blkid -s UUID -o value $MD)
+if [ -n "$uuid" ] && ! grep -q "^UUID=$uuid " /etc/fstab; then
+    echo "UUID=$uuid $MNT ext4 noatime,nofail 0 0" >> /etc/fstab
+    echo "$MNT /mnt none bind,nofail 0 0" >> /etc/fstab
+fi
+echo "RAID0:$devs"
+"""
+
+
+def parse_ephemeral_raid_output(lines):
+    """
+    Returns the list of RAID0 member devices reported on the last 'RAID0:'
+    line of EPHEMERAL_RAID_TEMPLATE's output or an empty list if none
+    """
+    for line in reversed(lines):
+        if line.startswith('RAID0:'):
+            return line.split()[1:]
+    return []
+
+
 class NodeManager(managers.Manager):
     """
     Manager class for Node objects
@@ -89,6 +166,9 @@ class Node(object):
         self._alias = alias
         self._groups = None
         self._ssh = None
+        self._user_ssh = {}
+        # serializes package manager commands from concurrent plugins
+        self._pkg_lock = threading.Lock()
         self._num_procs = None
         self._memory = None
         self._user_data = None
@@ -154,32 +234,18 @@ class Node(object):
             self._alias = alias
         return self._alias
 
-    def get_plugins(self):
+    def get_plugins_metadata(self):
+        """
+        Returns the list of (class, args, kwargs) tuples describing the
+        plugins this node's cluster was launched with
+        """
         plugstxt = self.user_data.get(static.UD_PLUGINS_FNAME)
         payload = plugstxt.split('\n', 2)[2]
-        plugins_metadata = utils.decode_uncompress_load(payload)
-        plugs = []
-        for klass, args, kwargs in plugins_metadata:
-            mod_path, klass_name = klass.rsplit('.', 1)
-            try:
-                mod = __import__(mod_path, fromlist=[klass_name])
-                plug = getattr(mod, klass_name)(*args, **kwargs)
-            except SyntaxError, e:
-                raise exception.PluginSyntaxError(
-                    "Plugin %s (%s) contains a syntax error at line %s" %
-                    (klass_name, e.filename, e.lineno))
-            except ImportError, e:
-                raise exception.PluginLoadError(
-                    "Failed to import plugin %s: %s" %
-                    (klass_name, e[0]))
-            except Exception as exc:
-                log.error("Error occured:", exc_info=True)
-                raise exception.PluginLoadError(
-                    "Failed to load plugin %s with "
-                    "the following error: %s - %s" %
-                    (klass_name, exc.__class__.__name__, exc.message))
-            plugs.append(plug)
-        return plugs
+        return utils.decode_uncompress_load(payload)
+
+    def get_plugins(self):
+        return clustersetup.load_plugins_from_metadata(
+            self.get_plugins_metadata())
 
     def get_volumes(self):
         volstxt = self.user_data.get(static.UD_VOLUMES_FNAME)
@@ -565,20 +631,29 @@ class Node(object):
             nodes.append(self)
         self.remove_from_known_hosts(username, nodes)
         for node in nodes:
-            server_pkey = node.ssh.get_server_public_key()
-            node_names = {}.fromkeys([node.alias, node.private_dns_name,
-                                      node.private_dns_name_short],
-                                     node.private_ip_address)
-            node_names[node.public_dns_name] = node.ip_address
-            for name, ip in node_names.items():
-                name_ip = "%s,%s" % (name, ip)
-                khosts.append(' '.join([name_ip, server_pkey.get_name(),
-                                        base64.b64encode(str(server_pkey))]))
+            khosts += node.get_known_hosts_entries()
         khostsf = self.ssh.remote_file(known_hosts_file, 'a')
         khostsf.write('\n'.join(khosts) + '\n')
         khostsf.chown(user.pw_uid, user.pw_gid)
         khostsf.close()
 
+    def get_known_hosts_entries(self):
+        """
+        Returns a list of known_hosts lines for all of this node's network
+        names using the server public key of this node's ssh connection
+        """
+        server_pkey = self.ssh.get_server_public_key()
+        node_names = {}.fromkeys([self.alias, self.private_dns_name,
+                                  self.private_dns_name_short],
+                                 self.private_ip_address)
+        node_names[self.public_dns_name] = self.ip_address
+        khosts = []
+        for name, ip in node_names.items():
+            name_ip = "%s,%s" % (name, ip)
+            khosts.append(' '.join([name_ip, server_pkey.get_name(),
+                                    base64.b64encode(str(server_pkey))]))
+        return khosts
+
     def remove_from_known_hosts(self, username, nodes):
         """
         Remove all network names for nodes from username's known_hosts file
@@ -594,9 +669,14 @@ class Node(object):
             regex = '|'.join(hostnames)
             self.ssh.remove_lines_from_file(known_hosts_file, regex)
 
-    def enable_passwordless_ssh(self, username, nodes):
+    def enable_passwordless_ssh(self, username, nodes, fan_out=True):
         """
         Configure passwordless ssh for user between this Node and nodes
+
+        If fan_out is True only the user's authorized_keys file is copied
+        to nodes through the local machine. This Node then pushes the
+        remaining files (private/public key and known_hosts) directly to all
+        nodes in parallel over the cluster's internal network.
         """
         user = self.getpwnam(username)
         ssh_folder = posixpath.join(user.pw_dir, '.ssh')
@@ -607,12 +687,42 @@ class Node(object):
         self.add_to_known_hosts(username, nodes)
         # exclude this node from copying
         nodes = filter(lambda n: n.id != self.id, nodes)
-        # copy private key and public key to node
-        self.copy_remote_file_to_nodes(priv_key_file, nodes)
-        self.copy_remote_file_to_nodes(pub_key_file, nodes)
-        # copy authorized_keys and known_hosts to node
+        if not nodes:
+            return
+        # copy authorized_keys to node first so that this node can reach it
         self.copy_remote_file_to_nodes(auth_key_file, nodes)
-        self.copy_remote_file_to_nodes(known_hosts_file, nodes)
+        files = [priv_key_file, pub_key_file, known_hosts_file]
+        if fan_out:
+            try:
+                self.push_files_to_nodes(files, nodes, username=username)
+                return
+            except exception.RemoteCommandFailed:
+                log.warn("Failed to push ssh keys from %s to nodes, copying "
+                         "them from the local machine instead" % self.alias)
+        for f in files:
+            self.copy_remote_file_to_nodes(f, nodes)
+
+    def push_files_to_nodes(self, remote_files, nodes, username='root',
+                            num_procs=20):
+        """
+        Push remote_files from this Node to the same paths on each node in
+        nodes over ssh, num_procs nodes at a time. File permissions and
+        ownership are preserved.
+
+        Requires that username on this Node can ssh to nodes without a
+        password (e.g. after copying username's authorized_keys to nodes)
+        """
+        paths = ' '.join([pipes.quote(f.lstrip('/')) for f in remote_files])
+        hosts = ' '.join([n.private_ip_address for n in nodes])
+        log.debug("Pushing %s from %s to %d node(s)" %
+                  (', '.join(remote_files), self.alias, len(nodes)))
+        push_cmd = ("tar -C / -cpf - %s | ssh -o BatchMode=yes "
+                    "-o ConnectTimeout=30 {} tar -C / -xpf -" % paths)
+        cmd = "printf '%%s\\n' %s | xargs -P %d -I{} sh -c %s" % (
+            hosts, num_procs, pipes.quote(push_cmd))
+        if username != 'root':
+            cmd = "su - %s -c %s" % (username, pipes.quote(cmd))
+        self.ssh.execute(cmd)
 
     def copy_remote_file_to_node(self, remote_file, node, dest=None):
         return self.copy_remote_file_to_nodes(remote_file, [node], dest=dest)
@@ -651,12 +761,17 @@ class Node(object):
         self.ssh.execute('userdel %s' % name)
         self.ssh.execute('groupdel %s' % name)
 
-    def export_fs_to_nodes(self, nodes, export_paths):
+    def export_fs_to_nodes(self, nodes, export_paths,
+                           options=static.NFS_EXPORT_OPTIONS, network=None):
         """
         Export each path in export_paths to each node in nodes via NFS
 
         nodes - list of nodes to export each path to
         export_paths - list of paths on this remote host to export to each node
+        options - NFS export options to use for each path
+        network - export each path once to this network (e.g. the VPC
+                  subnet's CIDR block) instead of once per node. /etc/exports
+                  is left untouched when nodes are added to the network.
 
         Example:
         # export /home and /opt/sge6 to each node in nodes
@@ -664,29 +779,40 @@ class Node(object):
         $ node.export_fs_to_nodes(nodes=[node1,node2],
                                   export_paths=['/home', '/opt/sge6'])
         """
-        log.debug("Cleaning up potentially stale NFS entries")
-        self.stop_exporting_fs_to_nodes(nodes, paths=export_paths)
         log.info("Configuring NFS exports path(s):\n%s" %
                  ' '.join(export_paths))
-        nfs_export_settings = "(async,no_root_squash,no_subtree_check,rw)"
-        etc_exports = self.ssh.remote_file('/etc/exports', 'r')
-        contents = etc_exports.read()
-        etc_exports.close()
-        etc_exports = self.ssh.remote_file('/etc/exports', 'a')
-        for node in nodes:
-            for path in export_paths:
-                export_line = ' '.join(
-                    [path, node.alias + nfs_export_settings + '\n'])
-                if export_line not in contents:
-                    etc_exports.write(export_line)
+        if network:
+            # one line per path for the whole network replacing any previous
+            # export of the path to the network (e.g. with other options)
+            etc_exports = self.ssh.remote_file('/etc/exports', 'r')
+            contents = [l.rstrip('\n') + '\n' for l in etc_exports]
+            etc_exports.close()
+            prefixes = tuple(['%s %s(' % (path, network)
+                              for path in export_paths])
+            lines = [l for l in contents if not l.startswith(prefixes)]
+            lines += ['%s %s(%s)\n' % (path, network, options)
+                      for path in export_paths]
+            if sorted(lines) == sorted(contents):
+                log.debug("NFS exports to %s are up to date" % network)
+                return
+            etc_exports = self.ssh.remote_file('/etc/exports', 'w')
+        else:
+            log.debug("Cleaning up potentially stale NFS entries")
+            self.stop_exporting_fs_to_nodes(nodes, paths=export_paths,
+                                            reexport=False)
+            lines = ['%s %s(%s)\n' % (path, node.alias, options)
+                     for node in nodes for path in export_paths]
+            etc_exports = self.ssh.remote_file('/etc/exports', 'a')
+        etc_exports.writelines(lines)
         etc_exports.close()
-        self.ssh.execute('exportfs -fra')
+        self.ssh.execute('exportfs -ra')
 
-    def stop_exporting_fs_to_nodes(self, nodes, paths=None):
+    def stop_exporting_fs_to_nodes(self, nodes, paths=None, reexport=True):
         """
         Removes nodes from this node's /etc/exportfs
 
         nodes - list of nodes to stop
+        reexport - whether to re-export the updated /etc/exports right away
 
         Example:
         $ node.remove_export_fs_to_nodes(nodes=[node1,node2])
@@ -697,9 +823,14 @@ class Node(object):
         else:
             regex = '|'.join([n.alias for n in nodes])
         self.ssh.remove_lines_from_file('/etc/exports', regex)
-        self.ssh.execute('exportfs -fra')
+        if reexport:
+            self.ssh.execute('exportfs -fra')
 
-    def start_nfs_server(self):
+    def start_nfs_server(self, nfsd_threads=None):
+        """
+        Start the NFS server on this node optionally setting the number of
+        nfsd threads
+        """
         log.info("Starting NFS server on %s" % self.alias)
         self.ssh.execute('/etc/init.d/portmap start', ignore_exit_status=True)
         self.ssh.execute('mount -t rpc_pipefs sunrpc /var/lib/nfs/rpc_pipefs/',
@@ -718,14 +849,20 @@ class Node(object):
         self.ssh.execute('/etc/init.d/nfs start')
         self.ssh.execute('rm -f %s' % DUMMY_EXPORT_FILE)
         self.ssh.execute('rm -rf %s' % DUMMY_EXPORT_DIR)
+        if nfsd_threads:
+            log.info("Setting number of nfsd threads on %s to %d" %
+                     (self.alias, nfsd_threads))
+            self.ssh.execute('rpc.nfsd %d' % nfsd_threads)
         self.ssh.execute('exportfs -fra')
 
-    def mount_nfs_shares(self, server_node, remote_paths):
+    def mount_nfs_shares(self, server_node, remote_paths,
+                         mount_options=static.NFS_MOUNT_OPTIONS):
         """
         Mount each path in remote_paths from the remote server_node
 
         server_node - remote server node that is sharing the remote_paths
         remote_paths - list of remote paths to mount from server_node
+        mount_options - NFS mount options to use in /etc/fstab for each path
         """
         self.ssh.execute('/etc/init.d/portmap start')
         # TODO: move this fix for xterm somewhere else
@@ -747,10 +884,9 @@ class Node(object):
                                           remote_paths))
         self.ssh.remove_lines_from_file('/etc/fstab', remote_paths_regex)
         fstab = self.ssh.remote_file('/etc/fstab', 'a')
-        mount_opts = 'rw,exec,noauto'
         for path in remote_paths:
             fstab.write('%s:%s %s nfs %s 0 0\n' %
-                        (server_node.alias, path, path, mount_opts))
+                        (server_node.alias, path, path, mount_options))
         fstab.close()
         for path in remote_paths:
             if not self.ssh.path_exists(path):
@@ -814,23 +950,54 @@ class Node(object):
             self.ssh.makedirs(path)
         self.ssh.execute('mount %s' % path)
 
+    def setup_ephemeral_raid(self, mount_path='/scratch', device='/dev/md0'):
+        """
+        Assemble all ephemeral (instance-store) disks on this node into a
+        striped RAID0 array on device and mount it on mount_path.
+
+        Returns the list of devices in the array or an empty list if the node
+        has less than two ephemeral disks (or mdadm is not installed) in which
+        case nothing is changed.
+        """
+        cmd = EPHEMERAL_RAID_TEMPLATE % dict(
+            device=device, mount_path=mount_path,
+            metadata_uri=static.INSTANCE_METADATA_URI)
+        return parse_ephemeral_raid_output(self.ssh.execute(cmd))
+
+    def update_etc_hosts(self, add=None, remove=None, replace=False):
+        """
+        Update the StarCluster-managed block in this node's /etc/hosts file
+
+        add - list of nodes to add (or refresh) in the block
+        remove - list of nodes to remove from the block
+        replace - if True the block will only contain the nodes in add
+
+        The new file is rendered locally from a single read of /etc/hosts and
+        then swapped in place of the old one with a single write.
+        """
+        add = [(n.alias, n.get_hosts_entry()) for n in add or []]
+        remove = [n.alias for n in remove or []]
+        lines = self.ssh.get_remote_file_lines('/etc/hosts')
+        lines = utils.update_hosts_block(lines, add=add, remove=remove,
+                                         replace=replace)
+        tmp_file = '/etc/hosts.starcluster'
+        host_file = self.ssh.remote_file(tmp_file, 'w')
+        host_file.writelines(lines)
+        host_file.close()
+        self.ssh.execute('mv -f %s /etc/hosts' % tmp_file)
+
     def add_to_etc_hosts(self, nodes):
         """
         Adds all names for node in nodes arg to this node's /etc/hosts file
         """
-        self.remove_from_etc_hosts(nodes)
-        host_file = self.ssh.remote_file('/etc/hosts', 'a')
-        for node in nodes:
-            print >> host_file, node.get_hosts_entry()
-        host_file.close()
+        self.update_etc_hosts(add=nodes)
 
     def remove_from_etc_hosts(self, nodes):
         """
         Remove all network names for node in nodes arg from this node's
         /etc/hosts file
         """
-        aliases = map(lambda x: x.alias, nodes)
-        self.ssh.remove_lines_from_file('/etc/hosts', '|'.join(aliases))
+        self.update_etc_hosts(remove=nodes)
 
     def set_hostname(self, hostname=None):
         """
@@ -916,6 +1083,31 @@ class Node(object):
         if spot:
             return spot[0]
 
+    def get_plugin_journal(self):
+        """
+        Returns the plugin steps recorded in this node's plugin journal as a
+        dict mapping (instance id, step) to the hash of the step's inputs
+        """
+        journal = {}
+        lines = self.ssh.execute('cat %s 2>/dev/null || true' %
+                                 static.STARCLUSTER_PLUGIN_JOURNAL)
+        for line in lines:
+            entry = line.split()
+            if len(entry) == 3:
+                instance_id, step, digest = entry
+                journal[(instance_id, step)] = digest
+        return journal
+
+    def record_plugin_steps(self, entries):
+        """
+        Append (instance id, step, input hash) entries to this node's plugin
+        journal
+        """
+        journal = static.STARCLUSTER_PLUGIN_JOURNAL
+        lines = ' '.join([pipes.quote('%s %s %s' % e) for e in entries])
+        self.ssh.execute("mkdir -p %s && printf '%%s\\n' %s >> %s" %
+                         (posixpath.dirname(journal), lines, journal))
+
     def is_master(self):
         return self.alias == 'master' or self.alias.endswith("-master")
 
@@ -1065,6 +1257,21 @@ class Node(object):
                                            private_key=self.key_location)
         return self._ssh
 
+    def get_user_ssh(self, user):
+        """
+        Returns an ssh connection to this node as user. The connection is
+        kept open and reused, so running commands as a non-root user does not
+        require switching (and reconnecting) the node's root connection.
+        """
+        if user == self.user:
+            return self.ssh
+        ssh = self._user_ssh.get(user)
+        if not ssh or not ssh.is_active():
+            ssh = sshutils.SSHClient(self.addr, username=user,
+                                     private_key=self.key_location)
+            self._user_ssh[user] = ssh
+        return ssh
+
     def shell(self, user=None, forward_x11=False, forward_agent=False,
               pseudo_tty=False, command=None):
         """
@@ -1135,18 +1342,66 @@ class Node(object):
         dpkg_opts = "Dpkg::Options::='--force-confnew'"
         cmd = "apt-get -o %s -y --force-yes %s" % (dpkg_opts, cmd)
         cmd = "DEBIAN_FRONTEND='noninteractive' " + cmd
-        self.ssh.execute(cmd)
+        with self._pkg_lock:
+            self.ssh.execute(cmd)
+
+    def apt_update(self, max_age=static.APT_INDEX_MAX_AGE):
+        """
+        Run apt-get update unless the package indexes were refreshed less than
+        max_age seconds ago (pass max_age=0 to always update)
+        """
+        stamp = static.APT_UPDATE_STAMP
+        if max_age:
+            mins = max(1, int(max_age) / 60)
+            cmd = 'test -n "$(find %s -mmin -%d 2>/dev/null)"' % (stamp, mins)
+            if self.ssh.get_status(cmd) == 0:
+                log.debug("apt indexes on %s are fresh, skipping update" %
+                          self.alias)
+                return
+        self.apt_command('update')
+        self.ssh.execute('touch %s' % stamp)
 
-    def apt_install(self, pkgs):
+    def apt_install(self, pkgs, update=True, cache_dir=None):
         """
         Install a set of packages via apt-get.
 
         pkgs is a string that contains one or more packages separated by a
         space
-        """
-        self.apt_command('update')
+
+        If cache_dir is specified the package indexes and .debs are copied
+        from a cache previously populated by apt_seed_cache (e.g. on the
+        master over NFS) instead of running apt-get update. Any packages
+        missing from the cache are still fetched from the mirror.
+        """
+        if cache_dir:
+            lists = posixpath.join(cache_dir, 'lists')
+            archives = posixpath.join(cache_dir, 'archives')
+            cmd = ' && '.join([
+                "cp -p %s/* /var/lib/apt/lists/" % lists,
+                "find %s -maxdepth 1 -name '*.deb' -exec cp -p {} "
+                "/var/cache/apt/archives/ +" % archives,
+                "touch %s" % static.APT_UPDATE_STAMP])
+            with self._pkg_lock:
+                self.ssh.execute(cmd)
+        elif update:
+            self.apt_update()
         self.apt_command('install %s' % pkgs)
 
+    def apt_seed_cache(self, pkgs, cache_dir):
+        """
+        Install a set of packages via apt-get while keeping the downloaded
+        .debs and the current package indexes in cache_dir so that other
+        nodes can install the same packages with apt_install(cache_dir=...)
+        """
+        lists = posixpath.join(cache_dir, 'lists')
+        archives = posixpath.join(cache_dir, 'archives')
+        self.ssh.execute('mkdir -p %s %s/partial' % (lists, archives))
+        self.apt_update()
+        self.apt_command('-o Dir::Cache::archives=%s install %s' %
+                         (archives, pkgs))
+        self.ssh.execute('rm -f %s/* && cp -p /var/lib/apt/lists/*_* %s/' %
+                         (lists, lists))
+
     def yum_command(self, cmd):
         """
         Run a yum command with all necessary options for non-interactive use.
@@ -1154,16 +1409,37 @@ class Node(object):
         """
         yum_opts = ['-d', '0', '-e', '0', '-y']
         cmd = "yum " + " ".join(yum_opts) + " " + cmd
-        self.ssh.execute(cmd)
+        with self._pkg_lock:
+            self.ssh.execute(cmd)
 
-    def yum_install(self, pkgs):
+    def yum_install(self, pkgs, cache_dir=None):
         """
         Install a set of packages via yum.
 
         pkgs is a string that contains one or more packages separated by a
         space
+
+        If cache_dir is specified yum runs entirely from the metadata and
+        rpms previously stored there by yum_seed_cache.
         """
-        self.yum_command('install %s' % pkgs)
+        if cache_dir:
+            self.yum_command("-C --setopt=cachedir='%s' install %s" %
+                             (self._get_yum_cachedir(cache_dir), pkgs))
+        else:
+            self.yum_command('install %s' % pkgs)
+
+    def yum_seed_cache(self, pkgs, cache_dir):
+        """
+        Install a set of packages via yum while keeping the metadata and rpms
+        in cache_dir so that other nodes can install the same packages with
+        yum_install(cache_dir=...)
+        """
+        self.yum_command("--setopt=keepcache=1 --setopt=cachedir='%s' "
+                         "install %s" % (self._get_yum_cachedir(cache_dir),
+                                         pkgs))
+
+    def _get_yum_cachedir(self, cache_dir):
+        return posixpath.join(cache_dir, 'yum', '$basearch', '$releasever')
 
     @property
     def package_provider(self):
@@ -1177,16 +1453,31 @@ class Node(object):
         elif self.ssh.isfile('/usr/bin/yum'):
             return "yum"
 
-    def package_install(self, pkgs):
+    def package_install(self, pkgs, cache_dir=None):
         """
         Provides a declarative install packages on systems, regardless
         of the system's packging type (apt/yum).
+
+        If cache_dir is specified packages are installed from a cache
+        populated by seed_package_cache.
+        """
+        if self.package_provider == "apt":
+            self.apt_install(pkgs, cache_dir=cache_dir)
+        elif self.package_provider == "yum":
+            self.yum_install(pkgs, cache_dir=cache_dir)
+
+    def seed_package_cache(self, pkgs, cache_dir):
+        """
+        Install packages on this node while storing everything needed to
+        install them elsewhere in cache_dir (see package_install)
         """
         if self.package_provider == "apt":
-            self.apt_install(pkgs)
+            self.apt_seed_cache(pkgs, cache_dir)
         elif self.package_provider == "yum":
-            self.yum_install(pkgs)
+            self.yum_seed_cache(pkgs, cache_dir)
 
     def __del__(self):
         if self._ssh:
             self._ssh.close()
+        for ssh in self._user_ssh.values():
+            ssh.close()
@@ -15,32 +15,75 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
 
+import re
+import time
+
 from starcluster import clustersetup
 from starcluster.templates import condor
 from starcluster.logger import log
 
 CONDOR_CFG = '/etc/condor/config.d/40starcluster'
 FS_REMOTE_DIR = '/home/._condor_tmp'
+# directories condor needs to exist (and be owned by condor) on every node
+CONDOR_DIR_VARS = ["LOCAL_DIR", "LOG", "SPOOL", "RUN", "EXECUTE", "LOCK",
+                   "CRED_STORE_DIR"]
+CONDOR_SETUP_SCRIPT = """\
+cat > %(cfg_file)s << 'STARCLUSTER_CONDOR_EOF'
+%(cfg)sSTARCLUSTER_CONDOR_EOF
+pkill condor
+mkdir -p %(dirs)s && chown -R condor:condor %(dirs)s && \\
+/etc/init.d/condor start
+"""
+
+
+def expand_config_vars(cfg, names):
+    """
+    Returns the values of the config variables in names from the condor
+    config text cfg with $(VAR) references expanded
+    """
+    config = {}
+    for line in cfg.splitlines():
+        if '=' in line:
+            key, val = line.split('=', 1)
+            config[key.strip()] = val.strip()
+
+    def expand(val, depth=0):
+        if depth > 10:
+            return val
+        return re.sub(r'\$\((\w+)\)',
+                      lambda m: expand(config.get(m.group(1), ''), depth + 1),
+                      val)
+    return [expand(config.get(name, '')) for name in names]
 
 
 class CondorPlugin(clustersetup.DefaultClusterSetup):
+    """
+    Configures a Condor pool on the cluster
 
-    def _add_condor_node(self, node):
-        condorcfg = node.ssh.remote_file(CONDOR_CFG, 'w')
+    drain_timeout - seconds to wait for running jobs on nodes being removed
+    to finish before stopping condor on them anyway (default: 3600)
+    """
+
+    def __init__(self, drain_timeout=3600, drain_interval=30, **kwargs):
+        super(CondorPlugin, self).__init__(**kwargs)
+        self.drain_timeout = int(drain_timeout)
+        self.drain_interval = int(drain_interval)
+
+    def _get_condor_config(self, node):
         daemon_list = "MASTER, STARTD, SCHEDD"
         if node.is_master():
             daemon_list += ", COLLECTOR, NEGOTIATOR"
         ctx = dict(CONDOR_HOST='master', DAEMON_LIST=daemon_list,
                    FS_REMOTE_DIR=FS_REMOTE_DIR)
-        condorcfg.write(condor.condor_tmpl % ctx)
-        condorcfg.close()
-        node.ssh.execute('pkill condor', ignore_exit_status=True)
-        config_vars = ["LOCAL_DIR", "LOG", "SPOOL", "RUN", "EXECUTE", "LOCK",
-                       "CRED_STORE_DIR"]
-        config_vals = ['$(condor_config_val %s)' % var for var in config_vars]
-        node.ssh.execute('mkdir -p %s' % ' '.join(config_vals))
-        node.ssh.execute('chown -R condor:condor %s' % ' '.join(config_vals))
-        node.ssh.execute('/etc/init.d/condor start')
+        return condor.condor_tmpl % ctx
+
+    def _add_condor_node(self, node):
+        # render the config and resolve condor's directories locally so that
+        # the node is configured in a single remote command
+        cfg = self._get_condor_config(node)
+        dirs = ' '.join(expand_config_vars(cfg, CONDOR_DIR_VARS))
+        node.ssh.execute(CONDOR_SETUP_SCRIPT % dict(cfg_file=CONDOR_CFG,
+                                                    cfg=cfg, dirs=dirs))
 
     def _setup_condor(self, master=None, nodes=None):
         log.info("Setting up Condor grid")
@@ -76,12 +119,64 @@ class CondorPlugin(clustersetup.DefaultClusterSetup):
         log.info("Adding %s to Condor" % node.alias)
         self._add_condor_node(node)
 
-    def on_remove_node(self, node, nodes, master, user, user_shell, volumes):
+    def _get_busy_slots(self, master, aliases):
+        """
+        Returns a dict mapping each alias in aliases that still has a condor
+        startd to the number of its slots that are running jobs
+        """
+        busy = {}
+        out = master.ssh.execute(
+            "condor_status -format '%s ' Machine -format '%s\\n' Activity",
+            ignore_exit_status=True, silent=True)
+        for line in out:
+            entry = line.split()
+            if len(entry) != 2:
+                continue
+            alias = entry[0].split('.')[0]
+            if alias in aliases:
+                busy.setdefault(alias, 0)
+                if entry[1] != 'Idle':
+                    busy[alias] += 1
+        return busy
+
+    def _drain_nodes(self, master, nodes):
+        """
+        Peacefully turn off condor on nodes and wait (up to drain_timeout
+        seconds) for their running jobs to finish
+        """
+        aliases = [node.alias for node in nodes]
+        log.info("Removing %s from Condor peacefully..." % ', '.join(aliases))
+        master.ssh.execute("condor_off -peaceful %s" % ' '.join(aliases),
+                           ignore_exit_status=True)
+        start = time.time()
+        while True:
+            busy = self._get_busy_slots(master, aliases)
+            draining = [a for a in aliases if busy.get(a)]
+            if not draining:
+                break
+            elapsed = time.time() - start
+            if elapsed >= self.drain_timeout:
+                log.warn("Timed out after %ds waiting for jobs to finish on: "
+                         "%s" % (elapsed, ', '.join(draining)))
+                break
+            log.info("Waiting for jobs to finish on %d of %d node(s): %s" %
+                     (len(draining), len(aliases), ', '.join(
+                         ["%s (%d busy)" % (a, busy[a]) for a in draining])))
+            time.sleep(self.drain_interval)
+        for node in nodes:
+            self.pool.simple_job(node.ssh.execute, ("pkill condor",),
+                                 dict(ignore_exit_status=True),
+                                 jobid=node.alias)
+        self.pool.wait(numtasks=len(nodes))
+
+    def on_remove_nodes(self, remove_nodes, nodes, master, user, user_shell,
+                        volumes):
         self._nodes = nodes
         self._master = master
         self._user = user
         self._user_shell = user_shell
         self._volumes = volumes
-        log.info("Removing %s from Condor peacefully..." % node.alias)
-        master.ssh.execute("condor_off -peaceful %s" % node.alias)
-        node.ssh.execute("pkill condor", ignore_exit_status=True)
+        self._drain_nodes(master, remove_nodes)
+
+    def on_remove_node(self, node, nodes, master, user, user_shell, volumes):
+        self.on_remove_nodes([node], nodes, master, user, user_shell, volumes)
@@ -15,7 +15,11 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
 
+import time
+import base64
+import tarfile
 import posixpath
+import StringIO
 
 from starcluster import threadpool
 from starcluster import clustersetup
@@ -68,6 +72,11 @@ hdfs_site_templ = """\
   The default is used if replication is not specified in create time.
   </description>
 </property>
+<property>
+  <name>dfs.hosts.exclude</name>
+  <value>%(exclude_file)s</value>
+  <description>Datanodes listed in this file are decommissioned.</description>
+</property>
 </configuration>
 """
 
@@ -89,26 +98,107 @@ mapred_site_templ = """\
 </property>
 <property>
   <name>mapred.tasktracker.map.tasks.maximum</name>
-  <value>%(map_tasks_max)d</value>
+  <value>%(map_tasks_max)s</value>
 </property>
 <property>
   <name>mapred.tasktracker.reduce.tasks.maximum</name>
-  <value>%(reduce_tasks_max)d</value>
+  <value>%(reduce_tasks_max)s</value>
 </property>
 </configuration>
 """
 
+configure_node_templ = """\
+set -e
+gpasswd -a %(user)s hadoop
+mkdir -p %(hadoop_conf)s
+cp -r %(empty_conf)s/. %(hadoop_conf)s/
+if [ -f /etc/redhat-release ]; then
+    alternatives=%(centos_alt_cmd)s
+    java_home=%(centos_java_home)s
+else
+    alternatives=%(ubuntu_alt_cmd)s
+    java_home=
+    for java in %(ubuntu_javas)s; do
+        if [ -d $java ]; then
+            java_home=$java
+            break
+        fi
+    done
+    if [ -z "$java_home" ]; then
+        echo "Cant find JAVA jre" >&2
+        exit 1
+    fi
+fi
+$alternatives --install /etc/hadoop-0.20/conf hadoop-0.20-conf \\
+    %(hadoop_conf)s 50
+echo '%(conf_archive)s' | base64 -d | tar -C %(hadoop_conf)s -xzf -
+sed -i '/JAVA_HOME/d' %(hadoop_conf)s/hadoop-env.sh
+echo "export JAVA_HOME=$java_home" >> %(hadoop_conf)s/hadoop-env.sh
+# Hadoop default: 2 maps, 1 reduce
+# AWS EMR uses approx 1 map per proc and .3 reduce per proc
+nprocs=$(grep -c ^processor /proc/cpuinfo)
+map_tasks_max=$(awk "BEGIN {n = int($nprocs * %(map_ratio)f); \\
+                            print (n < 2) ? 2 : n}")
+reduce_tasks_max=$(awk "BEGIN {n = int($nprocs * %(reduce_ratio)f); \\
+                               print (n < 1) ? 1 : n}")
+sed -i -e "s/@MAP_TASKS_MAX@/$map_tasks_max/" \\
+    -e "s/@REDUCE_TASKS_MAX@/$reduce_tasks_max/" \\
+    %(hadoop_conf)s/mapred-site.xml
+setup_hadoop_dir() {
+    mkdir -p $1
+    chown -R $2:hadoop $1
+    chmod -R 775 $1
+}
+setup_hadoop_dir %(hadoop_tmpdir)s hdfs
+setup_hadoop_dir %(hadoop_tmpdir)s/hadoop-mapred mapred
+setup_hadoop_dir %(hadoop_tmpdir)s/hadoop-%(user)s %(user)s
+if [ ! -d %(hadoop_tmpdir)s/hadoop-hdfs ]; then
+    su hdfs -c 'hadoop namenode -format'
+fi
+setup_hadoop_dir %(hadoop_tmpdir)s/hadoop-hdfs hdfs
+if [ ! -f /etc/dumbo.conf ]; then
+    printf '[hadoops]\\nstarcluster: %(hadoop_home)s\\n' > /etc/dumbo.conf
+fi
+"""
+
+
+def parse_decommission_status(report):
+    """
+    Returns a dict mapping each datanode's IP address to its decommission
+    status (e.g. Normal, Decommission in progress, Decommissioned) from the
+    output lines of 'hadoop dfsadmin -report'
+    """
+    status = {}
+    ip = None
+    for line in report:
+        key, sep, val = line.partition(':')
+        key, val = key.strip(), val.strip()
+        if key == 'Name':
+            ip = val.split(':')[0]
+        elif key == 'Decommission Status' and ip:
+            status[ip] = val
+    return status
+
 
 class Hadoop(clustersetup.ClusterSetup):
     """
     Configures Hadoop using Cloudera packages on StarCluster
+
+    Datanodes are decommissioned before they are removed from the cluster.
+    Nodes are removed anyway (with a warning) if HDFS has not finished
+    re-replicating their blocks after decommission_timeout seconds (default:
+    3600) or if fewer datanodes than dfs.replication would remain.
     """
 
     def __init__(self, hadoop_tmpdir='/mnt/hadoop', map_to_proc_ratio='1.0',
-                 reduce_to_proc_ratio='0.3'):
+                 reduce_to_proc_ratio='0.3', decommission_timeout='3600'):
         self.hadoop_tmpdir = hadoop_tmpdir
         self.hadoop_home = '/usr/lib/hadoop'
         self.hadoop_conf = '/etc/hadoop-0.20/conf.starcluster'
+        self.exclude_file = posixpath.join(self.hadoop_conf, 'dfs.exclude')
+        self.decommission_timeout = int(decommission_timeout)
+        self.decommission_interval = 30
+        self.replication = 3
         self.empty_conf = '/etc/hadoop-0.20/conf.empty'
         self.centos_java_home = '/usr/lib/jvm/java'
         self.centos_alt_cmd = 'alternatives'
@@ -126,181 +216,79 @@ class Hadoop(clustersetup.ClusterSetup):
             self._pool = threadpool.get_thread_pool(20, disable_threads=False)
         return self._pool
 
-    def _get_java_home(self, node):
-        # check for CentOS, otherwise default to Ubuntu 10.04's JAVA_HOME
-        if node.ssh.isfile('/etc/redhat-release'):
-            return self.centos_java_home
-        for java in self.ubuntu_javas:
-            if node.ssh.isdir(java):
-                return java
-        raise Exception("Cant find JAVA jre")
-
-    def _get_alternatives_cmd(self, node):
-        # check for CentOS, otherwise default to Ubuntu 10.04
-        if node.ssh.isfile('/etc/redhat-release'):
-            return self.centos_alt_cmd
-        return self.ubuntu_alt_cmd
-
-    def _setup_hadoop_user(self, node, user):
-        node.ssh.execute('gpasswd -a %s hadoop' % user)
-
-    def _install_empty_conf(self, node):
-        node.ssh.execute('cp -r %s %s' % (self.empty_conf, self.hadoop_conf))
-        alternatives_cmd = self._get_alternatives_cmd(node)
-        cmd = '%s --install /etc/hadoop-0.20/conf ' % alternatives_cmd
-        cmd += 'hadoop-0.20-conf %s 50' % self.hadoop_conf
-        node.ssh.execute(cmd)
-
-    def _configure_env(self, node):
-        env_file_sh = posixpath.join(self.hadoop_conf, 'hadoop-env.sh')
-        node.ssh.remove_lines_from_file(env_file_sh, 'JAVA_HOME')
-        env_file = node.ssh.remote_file(env_file_sh, 'a')
-        env_file.write('export JAVA_HOME=%s\n' % self._get_java_home(node))
-        env_file.close()
-
-    def _configure_mapreduce_site(self, node, cfg):
-        mapred_site_xml = posixpath.join(self.hadoop_conf, 'mapred-site.xml')
-        mapred_site = node.ssh.remote_file(mapred_site_xml)
-        # Hadoop default: 2 maps, 1 reduce
-        # AWS EMR uses approx 1 map per proc and .3 reduce per proc
-        map_tasks_max = max(
-            2,
-            int(self.map_to_proc_ratio * node.num_processors))
-        reduce_tasks_max = max(
-            1,
-            int(self.reduce_to_proc_ratio * node.num_processors))
-        cfg.update({
-            'map_tasks_max': map_tasks_max,
-            'reduce_tasks_max': reduce_tasks_max})
-        mapred_site.write(mapred_site_templ % cfg)
-        mapred_site.close()
-
-    def _configure_core(self, node, cfg):
-        core_site_xml = posixpath.join(self.hadoop_conf, 'core-site.xml')
-        core_site = node.ssh.remote_file(core_site_xml)
-        core_site.write(core_site_templ % cfg)
-        core_site.close()
-
-    def _configure_hdfs_site(self, node, cfg):
-        hdfs_site_xml = posixpath.join(self.hadoop_conf, 'hdfs-site.xml')
-        hdfs_site = node.ssh.remote_file(hdfs_site_xml)
-        hdfs_site.write(hdfs_site_templ % cfg)
-        hdfs_site.close()
-
-    def _configure_masters(self, node, master):
-        masters_file = posixpath.join(self.hadoop_conf, 'masters')
-        masters_file = node.ssh.remote_file(masters_file)
-        masters_file.write(master.alias)
-        masters_file.close()
-
-    def _configure_slaves(self, node, node_aliases):
-        slaves_file = posixpath.join(self.hadoop_conf, 'slaves')
-        slaves_file = node.ssh.remote_file(slaves_file)
-        slaves_file.write('\n'.join(node_aliases))
-        slaves_file.close()
-
-    def _setup_hdfs(self, node, user):
-        self._setup_hadoop_dir(node, self.hadoop_tmpdir, 'hdfs', 'hadoop')
-        mapred_dir = posixpath.join(self.hadoop_tmpdir, 'hadoop-mapred')
-        self._setup_hadoop_dir(node, mapred_dir, 'mapred', 'hadoop')
-        userdir = posixpath.join(self.hadoop_tmpdir, 'hadoop-%s' % user)
-        self._setup_hadoop_dir(node, userdir, user, 'hadoop')
-        hdfsdir = posixpath.join(self.hadoop_tmpdir, 'hadoop-hdfs')
-        if not node.ssh.isdir(hdfsdir):
-            node.ssh.execute("su hdfs -c 'hadoop namenode -format'")
-        self._setup_hadoop_dir(node, hdfsdir, 'hdfs', 'hadoop')
-
-    def _setup_dumbo(self, node):
-        if not node.ssh.isfile('/etc/dumbo.conf'):
-            f = node.ssh.remote_file('/etc/dumbo.conf')
-            f.write('[hadoops]\nstarcluster: %s\n' % self.hadoop_home)
-            f.close()
+    def _get_conf_archive(self, master, node_aliases):
+        """
+        Render all Hadoop config files once and return them as a base64
+        encoded tar.gz archive. The number of map/reduce tasks depends on
+        each node's CPU count and is filled in on the node itself.
+        """
+        cfg = {'master': master.alias, 'replication': self.replication,
+               'hadoop_tmpdir': posixpath.join(self.hadoop_tmpdir,
+                                               'hadoop-${user.name}'),
+               'map_tasks_max': '@MAP_TASKS_MAX@',
+               'reduce_tasks_max': '@REDUCE_TASKS_MAX@',
+               'exclude_file': self.exclude_file}
+        conf_files = {'core-site.xml': core_site_templ % cfg,
+                      'hdfs-site.xml': hdfs_site_templ % cfg,
+                      'mapred-site.xml': mapred_site_templ % cfg,
+                      'masters': master.alias,
+                      'slaves': '\n'.join(node_aliases),
+                      'dfs.exclude': ''}
+        archive = StringIO.StringIO()
+        tar = tarfile.open(fileobj=archive, mode='w:gz')
+        for name, contents in sorted(conf_files.items()):
+            info = tarfile.TarInfo(name)
+            info.size = len(contents)
+            info.mode = 0644
+            info.mtime = time.time()
+            tar.addfile(info, StringIO.StringIO(contents))
+        tar.close()
+        return base64.b64encode(archive.getvalue())
+
+    def _configure_node(self, node, user, conf_archive):
+        """
+        Install the Hadoop config archive and configure HDFS directories,
+        JAVA_HOME, and dumbo on node in a single remote command
+        """
+        node.ssh.execute(configure_node_templ % dict(
+            user=user, hadoop_conf=self.hadoop_conf,
+            empty_conf=self.empty_conf, hadoop_home=self.hadoop_home,
+            hadoop_tmpdir=self.hadoop_tmpdir,
+            centos_alt_cmd=self.centos_alt_cmd,
+            centos_java_home=self.centos_java_home,
+            ubuntu_alt_cmd=self.ubuntu_alt_cmd,
+            ubuntu_javas=' '.join(self.ubuntu_javas),
+            map_ratio=self.map_to_proc_ratio,
+            reduce_ratio=self.reduce_to_proc_ratio,
+            conf_archive=conf_archive))
 
     def _configure_hadoop(self, master, nodes, user):
-        log.info("Configuring Hadoop...")
-        log.info("Adding user %s to hadoop group" % user)
-        for node in nodes:
-            self.pool.simple_job(self._setup_hadoop_user, (node, user),
-                                 jobid=node.alias)
-        self.pool.wait(numtasks=len(nodes))
+        log.info("Configuring Hadoop (user: %s) on %d node(s)..." %
+                 (user, len(nodes)))
         node_aliases = map(lambda n: n.alias, nodes)
-        cfg = {'master': master.alias, 'replication': 3,
-               'hadoop_tmpdir': posixpath.join(self.hadoop_tmpdir,
-                                               'hadoop-${user.name}')}
-        log.info("Installing configuration templates...")
-        for node in nodes:
-            self.pool.simple_job(self._install_empty_conf, (node,),
-                                 jobid=node.alias)
-        self.pool.wait(numtasks=len(nodes))
-        log.info("Configuring environment...")
-        for node in nodes:
-            self.pool.simple_job(self._configure_env, (node,),
-                                 jobid=node.alias)
-        self.pool.wait(numtasks=len(nodes))
-        log.info("Configuring MapReduce Site...")
-        for node in nodes:
-            self.pool.simple_job(self._configure_mapreduce_site, (node, cfg),
-                                 jobid=node.alias)
-        self.pool.wait(numtasks=len(nodes))
-        log.info("Configuring Core Site...")
+        conf_archive = self._get_conf_archive(master, node_aliases)
         for node in nodes:
-            self.pool.simple_job(self._configure_core, (node, cfg),
+            self.pool.simple_job(self._configure_node,
+                                 (node, user, conf_archive),
                                  jobid=node.alias)
         self.pool.wait(numtasks=len(nodes))
-        log.info("Configuring HDFS Site...")
-        for node in nodes:
-            self.pool.simple_job(self._configure_hdfs_site, (node, cfg),
-                                 jobid=node.alias)
-        self.pool.wait(numtasks=len(nodes))
-        log.info("Configuring masters file...")
-        for node in nodes:
-            self.pool.simple_job(self._configure_masters, (node, master),
-                                 jobid=node.alias)
-        self.pool.wait(numtasks=len(nodes))
-        log.info("Configuring slaves file...")
-        for node in nodes:
-            self.pool.simple_job(self._configure_slaves, (node, node_aliases),
-                                 jobid=node.alias)
-        self.pool.wait(numtasks=len(nodes))
-        log.info("Configuring HDFS...")
-        for node in nodes:
-            self.pool.simple_job(self._setup_hdfs, (node, user),
-                                 jobid=node.alias)
-        self.pool.wait(numtasks=len(nodes))
-        log.info("Configuring dumbo...")
-        for node in nodes:
-            self.pool.simple_job(self._setup_dumbo, (node,), jobid=node.alias)
-        self.pool.wait(numtasks=len(nodes))
-
-    def _setup_hadoop_dir(self, node, path, user, group, permission="775"):
-        if not node.ssh.isdir(path):
-            node.ssh.mkdir(path)
-        node.ssh.execute("chown -R %s:hadoop %s" % (user, path))
-        node.ssh.execute("chmod -R %s %s" % (permission, path))
 
-    def _start_datanode(self, node):
-        node.ssh.execute('/etc/init.d/hadoop-0.20-datanode restart')
-
-    def _start_tasktracker(self, node):
-        node.ssh.execute('/etc/init.d/hadoop-0.20-tasktracker restart')
+    def _start_workers(self, node):
+        node.ssh.execute('/etc/init.d/hadoop-0.20-datanode restart && '
+                         '/etc/init.d/hadoop-0.20-tasktracker restart')
 
     def _start_hadoop(self, master, nodes):
-        log.info("Starting namenode...")
-        master.ssh.execute('/etc/init.d/hadoop-0.20-namenode restart')
-        log.info("Starting secondary namenode...")
-        master.ssh.execute('/etc/init.d/hadoop-0.20-secondarynamenode restart')
-        log.info("Starting datanode on all nodes...")
+        log.info("Starting namenode and secondary namenode...")
+        master.ssh.execute(
+            '/etc/init.d/hadoop-0.20-namenode restart && '
+            '/etc/init.d/hadoop-0.20-secondarynamenode restart')
+        log.info("Starting datanode and tasktracker on all nodes...")
         for node in nodes:
-            self.pool.simple_job(self._start_datanode, (node,),
+            self.pool.simple_job(self._start_workers, (node,),
                                  jobid=node.alias)
-        self.pool.wait()
+        self.pool.wait(numtasks=len(nodes))
         log.info("Starting jobtracker...")
         master.ssh.execute('/etc/init.d/hadoop-0.20-jobtracker restart')
-        log.info("Starting tasktracker on all nodes...")
-        for node in nodes:
-            self.pool.simple_job(self._start_tasktracker, (node,),
-                                 jobid=node.alias)
-        self.pool.wait()
 
     def _open_ports(self, master):
         ports = [50070, 50030]
@@ -322,3 +310,79 @@ class Hadoop(clustersetup.ClusterSetup):
         self._open_ports(master)
         log.info("Job tracker status: http://%s:50030" % master.dns_name)
         log.info("Namenode status: http://%s:50070" % master.dns_name)
+
+    def _refresh_nodes(self, master):
+        master.ssh.execute("su hdfs -c 'hadoop dfsadmin -refreshNodes'")
+
+    def _wait_for_decommission(self, master, nodes):
+        """
+        Wait until the namenode reports all nodes' datanodes as
+        decommissioned (i.e. their blocks have been re-replicated)
+        """
+        start = time.time()
+        while True:
+            report = master.ssh.execute(
+                "su hdfs -c 'hadoop dfsadmin -report'", silent=True)
+            status = parse_decommission_status(report)
+            pending = [n.alias for n in nodes
+                       if status.get(n.private_ip_address,
+                                     'Decommissioned') != 'Decommissioned']
+            if not pending:
+                return
+            elapsed = time.time() - start
+            if elapsed >= self.decommission_timeout:
+                log.warn("Timed out after %ds waiting for HDFS to "
+                         "decommission: %s - some blocks may be lost" %
+                         (elapsed, ', '.join(pending)))
+                return
+            log.info("Waiting for HDFS to decommission: %s" %
+                     ', '.join(pending))
+            time.sleep(self.decommission_interval)
+
+    def on_add_node(self, node, nodes, master, user, user_shell, volumes):
+        log.info("Adding %s to Hadoop cluster" % node.alias)
+        node_aliases = map(lambda n: n.alias, nodes)
+        if node.alias not in node_aliases:
+            node_aliases.append(node.alias)
+        self._configure_node(node, user,
+                             self._get_conf_archive(master, node_aliases))
+        slaves_file = posixpath.join(self.hadoop_conf, 'slaves')
+        master.ssh.execute("grep -qx %s %s || echo %s >> %s" %
+                           (node.alias, slaves_file, node.alias, slaves_file))
+        # a previously removed node with the same alias is still excluded
+        if master.ssh.get_status("grep -qx %s %s" %
+                                 (node.alias, self.exclude_file)) == 0:
+            master.ssh.execute("sed -i '/^%s$/d' %s" %
+                               (node.alias, self.exclude_file))
+            self._refresh_nodes(master)
+        self._start_workers(node)
+
+    def on_remove_nodes(self, remove_nodes, nodes, master, user, user_shell,
+                        volumes):
+        aliases = [node.alias for node in remove_nodes]
+        log.info("Decommissioning %s from Hadoop cluster" % ', '.join(aliases))
+        slaves_file = posixpath.join(self.hadoop_conf, 'slaves')
+        master.ssh.execute(' && '.join(
+            ["(grep -qx %s %s || echo %s >> %s)" %
+             (a, self.exclude_file, a, self.exclude_file) for a in aliases] +
+            ["sed -i '/^%s$/d' %s" % (a, slaves_file) for a in aliases]))
+        self._refresh_nodes(master)
+        remaining = len([n for n in nodes if n.alias not in aliases])
+        if remaining < self.replication:
+            # HDFS can never finish decommissioning in this case
+            log.warn("Only %d datanode(s) would remain (dfs.replication=%d) "
+                     "- not waiting for HDFS to decommission %s, some blocks "
+                     "may be lost" % (remaining, self.replication,
+                                      ', '.join(aliases)))
+        else:
+            self._wait_for_decommission(master, remove_nodes)
+        for node in remove_nodes:
+            self.pool.simple_job(
+                node.ssh.execute,
+                ('/etc/init.d/hadoop-0.20-tasktracker stop; '
+                 '/etc/init.d/hadoop-0.20-datanode stop',),
+                dict(ignore_exit_status=True), jobid=node.alias)
+        self.pool.wait(numtasks=len(remove_nodes))
+
+    def on_remove_node(self, node, nodes, master, user, user_shell, volumes):
+        self.on_remove_nodes([node], nodes, master, user, user_shell, volumes)
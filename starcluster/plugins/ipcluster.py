@@ -57,23 +57,36 @@ http://star.mit.edu/cluster/docs/latest/plugins/ipython.html
 """
 
 
-def _start_engines(node, user, n_engines=None, kill_existing=False):
+def _start_engines(node, user, n_engines=None, kill_existing=False,
+                   reserve_cpu=False):
     """Launch IPython engines on the given node
 
-    Start one engine per CPU except on master where 1 CPU is reserved for house
-    keeping tasks when possible.
+    Start one engine per CPU unless n_engines is given. The CPU count is read
+    by the same remote command that launches the engines. If reserve_cpu is
+    True and the node has more than 2 CPUs, 1 CPU is left free for house
+    keeping tasks.
 
     If kill_existing is True, any running of IPython engines on the same node
     are killed first.
 
+    Returns the number of engines started.
     """
     if n_engines is None:
-        n_engines = node.num_processors
-    node.ssh.switch_user(user)
+        cmd = "n=$(grep -c ^processor /proc/cpuinfo); "
+        if reserve_cpu:
+            cmd += "[ $n -gt 2 ] && n=$((n - 1)); "
+    else:
+        cmd = "n=%d; " % n_engines
     if kill_existing:
-        node.ssh.execute("pkill -f ipengineapp", ignore_exit_status=True)
-    node.ssh.execute("ipcluster engines --n=%i --daemonize" % n_engines)
-    node.ssh.switch_user('root')
+        # the bracket keeps the pattern from matching this command's shell
+        cmd += "pkill -f '[i]pengineapp'; "
+    cmd += ("ipcluster engines --n=$n --daemonize > /dev/null 2>&1 && "
+            "echo ENGINES=$n")
+    for line in node.get_user_ssh(user).execute(cmd):
+        if line.startswith('ENGINES='):
+            return int(line.split('=', 1)[1])
+    raise exception.PluginError("Failed to start IPython engines on %s" %
+                                node.alias)
 
 
 class IPCluster(DefaultClusterSetup):
@@ -166,8 +179,11 @@ class IPCluster(DefaultClusterSetup):
         n_engines = max(1, master.num_processors - 1)
         log.info("Starting the IPython controller and %i engines on master"
                  % n_engines)
-        # cleanup existing connection files, to prevent their use
-        master.ssh.execute("rm -f %s/security/*.json" % profile_dir)
+        # cleanup existing connection files, to prevent their use, and old
+        # controller logs so that _wait_for_engines only counts the engines
+        # registered with the new controller
+        master.ssh.execute("rm -f %s/security/*.json %s/log/ipcontroller-*.log"
+                           % (profile_dir, profile_dir))
         master.ssh.execute("ipcluster start --n=%i --delay=5 --daemonize"
                            % n_engines)
         # wait for JSON file to exist
@@ -177,16 +193,14 @@ class IPCluster(DefaultClusterSetup):
         s = spinner.Spinner()
         s.start()
         try:
-            found_file = False
-            for i in range(30):
-                if master.ssh.isfile(json_filename):
-                    found_file = True
-                    break
-                time.sleep(1)
-            if not found_file:
-                raise ValueError(
-                    "Timeout while waiting for the cluser json file: "
-                    + json_filename)
+            # wait on the master rather than polling it from here
+            master.ssh.execute(
+                "for i in $(seq 60); do [ -f %s ] && exit 0; sleep 0.5; "
+                "done; exit 1" % json_filename)
+        except exception.RemoteCommandFailed:
+            raise ValueError(
+                "Timeout while waiting for the cluser json file: "
+                + json_filename)
         finally:
             s.stop()
         # Retrieve JSON connection info to make it possible to connect a local
@@ -215,6 +229,34 @@ class IPCluster(DefaultClusterSetup):
             self._authorize_port(master, (1000, 65535), "IPython controller")
         return local_json, n_engines
 
+    def _wait_for_engines(self, master, profile_dir, n_engines, timeout=120):
+        """
+        Report the number of engines registered with the controller (taken
+        from the controller's log) until all n_engines have registered or
+        timeout seconds have passed
+        """
+        log_files = posixpath.join(profile_dir, 'log', 'ipcontroller-*.log')
+        cmd = ("cat %s 2>/dev/null | grep -c 'finished registering engine'" %
+               log_files)
+        registered = 0
+        start = time.time()
+        while registered < n_engines:
+            out = master.ssh.execute(cmd, ignore_exit_status=True)
+            count = int(out[-1]) if out and out[-1].isdigit() else 0
+            if count != registered:
+                registered = count
+                log.info("%d of %d engines registered" %
+                         (registered, n_engines))
+            if registered >= n_engines:
+                break
+            if time.time() - start > timeout:
+                log.warn("Only %d of %d engines registered after %d seconds,"
+                         " the remaining engines may still be starting" %
+                         (registered, n_engines, timeout))
+                break
+            time.sleep(2)
+        return registered
+
     def _start_notebook(self, master, user, profile_dir):
         log.info("Setting up IPython web notebook for user: %s" % user)
         user_cert = posixpath.join(profile_dir, '%s.pem' % user)
@@ -288,19 +330,19 @@ class IPCluster(DefaultClusterSetup):
         cfile, n_engines_master = self._start_cluster(master, profile_dir)
         # Start engines on each of the non-master nodes
         non_master_nodes = [node for node in nodes if not node.is_master()]
-        for node in non_master_nodes:
-            self.pool.simple_job(
-                _start_engines, (node, user, node.num_processors),
-                jobid=node.alias)
-        n_engines_non_master = sum(node.num_processors
-                                   for node in non_master_nodes)
+        n_engines_non_master = 0
         if len(non_master_nodes) > 0:
-            log.info("Adding %d engines on %d nodes",
+            log.info("Adding engines on %d nodes", len(non_master_nodes))
+            for node in non_master_nodes:
+                self.pool.simple_job(_start_engines, (node, user),
+                                     jobid=node.alias)
+            n_engines_non_master = sum(self.pool.wait(len(non_master_nodes)))
+            log.info("Started %d engines on %d nodes",
                      n_engines_non_master, len(non_master_nodes))
-            self.pool.wait(len(non_master_nodes))
+        n_engines_total = n_engines_master + n_engines_non_master
+        self._wait_for_engines(master, profile_dir, n_engines_total)
         if self.enable_notebook:
             self._start_notebook(master, user, profile_dir)
-        n_engines_total = n_engines_master + n_engines_non_master
         log.info(STARTED_MSG % dict(cluster=master.parent_cluster,
                                     user=user, connector_file=cfile,
                                     key_location=master.key_location,
@@ -310,9 +352,8 @@ class IPCluster(DefaultClusterSetup):
 
     def on_add_node(self, node, nodes, master, user, user_shell, volumes):
         self._check_ipython_installed(node)
-        n_engines = node.num_processors
-        log.info("Adding %d engines on %s", n_engines, node.alias)
-        _start_engines(node, user)
+        n_engines = _start_engines(node, user)
+        log.info("Added %d engines on %s", n_engines, node.alias)
 
     def on_remove_node(self, node, nodes, master, user, user_shell, volumes):
         raise NotImplementedError("on_remove_node method not implemented")
@@ -343,9 +384,8 @@ class IPClusterStop(DefaultClusterSetup):
         self.pool.wait(len(nodes))
 
     def _stop_engines(self, node, user):
-        node.ssh.switch_user(user)
-        node.ssh.execute("pkill -f ipengineapp", ignore_exit_status=True)
-        node.ssh.switch_user('root')
+        node.get_user_ssh(user).execute("pkill -f ipengineapp",
+                                        ignore_exit_status=True)
 
     def on_add_node(self, node, nodes, master, user, user_shell, volumes):
         raise NotImplementedError("on_add_node method not implemented")
@@ -367,17 +407,14 @@ class IPClusterRestartEngines(DefaultClusterSetup):
 
     """
     def run(self, nodes, master, user, user_shell, volumes):
-        n_total = 0
+        log.info("Restarting engines on %d nodes", len(nodes))
         for node in nodes:
-            n_engines = node.num_processors
-            if node.is_master() and n_engines > 2:
-                n_engines -= 1
             self.pool.simple_job(
-                _start_engines, (node, user, n_engines, True),
+                _start_engines, (node, user),
+                dict(kill_existing=True, reserve_cpu=node.is_master()),
                 jobid=node.alias)
-            n_total += n_engines
-        log.info("Restarting %d engines on %d nodes", n_total, len(nodes))
-        self.pool.wait(len(nodes))
+        n_total = sum(self.pool.wait(len(nodes)))
+        log.info("Restarted %d engines on %d nodes", n_total, len(nodes))
 
     def on_add_node(self, node, nodes, master, user, user_shell, volumes):
         raise NotImplementedError("on_add_node method not implemented")
@@ -21,6 +21,7 @@ from starcluster.logger import log
 
 class MPICH2Setup(clustersetup.DefaultClusterSetup):
 
+    requires = ['default']
     MPICH2_HOSTS = '/home/mpich2.hosts'
     MPICH2_PROFILE = '/etc/profile.d/mpich2.sh'
 
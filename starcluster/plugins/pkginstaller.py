@@ -15,6 +15,8 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
 
+from starcluster import static
+from starcluster import exception
 from starcluster import clustersetup
 from starcluster.logger import log
 
@@ -27,12 +29,30 @@ class PackageInstaller(clustersetup.DefaultClusterSetup):
     [plugin pkginstaller]
     setup_class = starcluster.plugins.pkginstaller.PackageInstaller
     packages = mongodb, python-mongodb
+    # install on the master first and let the other nodes install from the
+    # master's cache over NFS instead of each hitting the mirror (default)
+    use_cache = True
     """
-    def __init__(self, packages=None):
+    requires = ['default']
+    bakeable = True
+
+    def __init__(self, packages=None, use_cache=True):
         super(PackageInstaller, self).__init__()
         self.packages = packages
         if packages:
             self.packages = [pkg.strip() for pkg in packages.split(',')]
+        self.use_cache = str(use_cache).lower() == "true"
+        self.cache_dir = static.PKG_CACHE_DIR
+
+    def _install(self, node, pkgs, cache_dir=None):
+        if cache_dir:
+            try:
+                node.package_install(pkgs, cache_dir=cache_dir)
+                return
+            except exception.RemoteCommandFailed:
+                log.warn("Failed to install packages on %s from the "
+                         "package cache, retrying without it" % node.alias)
+        node.package_install(pkgs)
 
     def run(self, nodes, master, user, user_shell, volumes):
         if not self.packages:
@@ -41,14 +61,28 @@ class PackageInstaller(clustersetup.DefaultClusterSetup):
         log.info('Installing the following packages on all nodes:')
         log.info(', '.join(self.packages), extra=dict(__raw__=True))
         pkgs = ' '.join(self.packages)
+        cache_dir = None
+        if self.use_cache and len(nodes) > 1:
+            try:
+                log.info("Populating package cache on %s" % master.alias)
+                master.seed_package_cache(pkgs, self.cache_dir)
+                cache_dir = self.cache_dir
+                nodes = [n for n in nodes if not n.is_master()]
+            except exception.RemoteCommandFailed:
+                log.warn("Failed to populate package cache on %s, installing "
+                         "directly on all nodes" % master.alias)
         for node in nodes:
-            self.pool.simple_job(node.apt_install, (pkgs), jobid=node.alias)
+            self.pool.simple_job(self._install, (node, pkgs, cache_dir),
+                                 jobid=node.alias)
         self.pool.wait(len(nodes))
 
     def on_add_node(self, new_node, nodes, master, user, user_shell, volumes):
         log.info('Installing the following packages on %s:' % new_node.alias)
         pkgs = ' '.join(self.packages)
-        new_node.apt_install(pkgs)
+        cache_dir = None
+        if self.use_cache and new_node.ssh.isdir(self.cache_dir):
+            cache_dir = self.cache_dir
+        self._install(new_node, pkgs, cache_dir=cache_dir)
 
     def on_remove_node(self, node, nodes, master, user, user_shell, volumes):
         raise NotImplementedError("on_remove_node method not implemented")
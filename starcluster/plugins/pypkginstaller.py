@@ -37,7 +37,24 @@ and the latest released version of some dependencies::
                python-msgpack,
                git+http://github.com/ipython/ipython.git
 
+By default the packages and their dependencies are resolved and built into
+wheels once on the master, in a wheelhouse on the master's NFS-shared /home,
+and every node then installs them with ``--no-index --find-links`` instead of
+downloading and compiling them itself. Wheels are reused by later runs and by
+``addnode``. To keep the wheelhouse across cluster restarts point it at a
+persistent EBS volume, or disable this behavior with ``use_wheels = False``::
+
+    [plugin scipy-stack]
+    setup_class = starcluster.plugins.pypkginstaller.PyPkgInstaller
+    packages = numpy, scipy
+    wheelhouse = /data/wheelhouse
+
 """
+import re
+import pipes
+
+from starcluster import static
+from starcluster import exception
 from starcluster.clustersetup import DefaultClusterSetup
 from starcluster.logger import log
 from starcluster.utils import print_timing
@@ -45,28 +62,97 @@ from starcluster.utils import print_timing
 
 class PyPkgInstaller(DefaultClusterSetup):
     """Install Python packages with pip."""
+    requires = ['default', 'PackageInstaller']
+    bakeable = True
 
-    def __init__(self, packages="", install_command="pip install %s"):
+    def __init__(self, packages="", install_command="pip install %s",
+                 use_wheels=True, wheelhouse=static.PY_WHEELHOUSE_DIR):
         super(PyPkgInstaller, self).__init__()
         self.install_command = install_command
         self.packages = [p.strip() for p in packages.split(",") if p.strip()]
+        self.use_wheels = str(use_wheels).lower() == "true"
+        self.wheelhouse = wheelhouse
+
+    def _get_pip(self):
+        """
+        Returns the pip executable used by install_command or None if
+        install_command is not a pip install command
+        """
+        m = re.match(r'^\s*(\S*pip[\d.]*)\s+install\s', self.install_command)
+        if m:
+            return m.group(1)
+
+    @print_timing("Building wheels")
+    def build_wheels(self, master):
+        """
+        Resolve and build wheels for all packages and their dependencies on
+        the master. Wheels already in the wheelhouse are reused.
+        """
+        pip = self._get_pip()
+        log.info("Building Python package wheels on %s in %s" %
+                 (master.alias, self.wheelhouse))
+        pkgs = ' '.join([pipes.quote(p) for p in self.packages])
+        wh = pipes.quote(self.wheelhouse)
+        cmd = ' && '.join([
+            "mkdir -p %s" % wh,
+            "%s install wheel" % pip,
+            "%s wheel --wheel-dir=%s --find-links=%s %s" % (pip, wh, wh, pkgs)
+        ])
+        master.ssh.execute(cmd)
+
+    def _install(self, node, cmd, fallback_cmd=None):
+        if fallback_cmd:
+            try:
+                node.ssh.execute(cmd)
+                return
+            except exception.RemoteCommandFailed:
+                log.warn("Failed to install Python packages on %s from the "
+                         "wheelhouse, retrying without it" % node.alias)
+                cmd = fallback_cmd
+        node.ssh.execute(cmd)
 
     @print_timing("PyPkgInstaller")
-    def install_packages(self, nodes, dest='all nodes'):
+    def install_packages(self, nodes, dest='all nodes', wheelhouse=None):
         log.info("Installing Python packages on %s:" % dest)
         commands = [self.install_command % p for p in self.packages]
+        cmd = "\n".join(commands)
+        fallback_cmd = None
+        if wheelhouse:
+            opts = "--no-index --find-links=%s " % pipes.quote(wheelhouse)
+            fallback_cmd = cmd
+            commands = [self.install_command % (opts + p)
+                        for p in self.packages]
+            # any package missing from the wheelhouse must fail the command
+            # so that _install falls back to installing from the index
+            cmd = " && ".join(commands)
         for command in commands:
             log.info("$ " + command)
-        cmd = "\n".join(commands)
         for node in nodes:
-            self.pool.simple_job(node.ssh.execute, (cmd,), jobid=node.alias)
+            self.pool.simple_job(self._install, (node, cmd, fallback_cmd),
+                                 jobid=node.alias)
         self.pool.wait(len(nodes))
 
+    def _get_wheelhouse(self, master):
+        if not self.use_wheels:
+            return
+        if not self._get_pip():
+            log.warn("install_command is not a pip install command, "
+                     "skipping wheelhouse")
+            return
+        try:
+            self.build_wheels(master)
+            return self.wheelhouse
+        except exception.RemoteCommandFailed:
+            log.warn("Failed to build wheels on %s, installing packages "
+                     "directly on all nodes" % master.alias)
+
     def run(self, nodes, master, user, user_shell, volumes):
-        self.install_packages(nodes)
+        wheelhouse = self._get_wheelhouse(master)
+        self.install_packages(nodes, wheelhouse=wheelhouse)
 
     def on_add_node(self, node, nodes, master, user, user_shell, volumes):
-        self.install_packages([node], dest=node.alias)
+        wheelhouse = self._get_wheelhouse(master)
+        self.install_packages([node], dest=node.alias, wheelhouse=wheelhouse)
 
     def on_remove_node(self, node, nodes, master, user, user_shell, volumes):
         raise NotImplementedError("on_remove_node method not implemented")
@@ -34,6 +34,15 @@ class SGEPlugin(clustersetup.DefaultClusterSetup):
         mssh = self._master.ssh
         mssh.execute('qconf -ah %s' % node.alias)
 
+    def _add_sge_hosts(self, nodes):
+        """
+        Register nodes as SGE admin and submit hosts with a single remote
+        command
+        """
+        aliases = ','.join([node.alias for node in nodes])
+        self._master.ssh.execute('qconf -ah %s && qconf -as %s' %
+                                 (aliases, aliases))
+
     def _setup_sge_profile(self, node):
         sge_profile = node.ssh.remote_file("/etc/profile.d/sge.sh", "w")
         arch = node.ssh.execute("/opt/sge6/util/arch")[0]
@@ -76,6 +85,34 @@ class SGEPlugin(clustersetup.DefaultClusterSetup):
                      (name, queue))
             mssh.execute('qconf -mattr queue pe_list "%s" %s' % (name, queue))
 
+    def _get_sge_pe_slots(self, name="orte"):
+        """
+        Returns the number of slots in an existing SGE parallel environment
+        or None if it does not exist
+        """
+        out = self._master.ssh.execute('qconf -sp %s' % name,
+                                       ignore_exit_status=True)
+        for line in out:
+            fields = line.split()
+            if len(fields) == 2 and fields[0] == 'slots':
+                return int(fields[1])
+
+    def _update_sge_pe_slots(self, nodes, name="orte", remove=False):
+        """
+        Add (or remove) the processors of nodes to (from) an SGE parallel
+        environment's slots with a single qconf call. Only the nodes being
+        added or removed are probed for their processor count.
+        """
+        slots = self._get_sge_pe_slots(name)
+        if slots is None:
+            return self._create_sge_pe(name=name)
+        delta = sum([node.num_processors for node in nodes])
+        slots = max(0, slots - delta if remove else slots + delta)
+        log.info("Updating SGE parallel environment '%s' to %d slots" %
+                 (name, slots))
+        self._master.ssh.execute("qconf -mattr pe slots %s %s" %
+                                 (slots, name))
+
     def _inst_sge(self, node, exec_host=True):
         inst_sge = 'cd /opt/sge6 && TERM=rxvt ./inst_sge '
         if node.is_master():
@@ -118,23 +155,36 @@ class SGEPlugin(clustersetup.DefaultClusterSetup):
         self._setup_sge_profile(master)
         # set all.q shell to bash
         master.ssh.execute('qconf -mattr queue shell "/bin/bash" all.q')
+        if self.nodes:
+            self._add_sge_hosts(self.nodes)
         for node in self.nodes:
-            self._add_sge_admin_host(node)
-            self._add_sge_submit_host(node)
             self.pool.simple_job(self._add_to_sge, (node,), jobid=node.alias)
         self.pool.wait(numtasks=len(self.nodes))
         self._create_sge_pe()
 
-    def _remove_from_sge(self, node):
+    def _is_sge_exec_host(self, node):
+        return self._master.ssh.get_status('qconf -se %s' % node.alias) == 0
+
+    def _remove_from_sge(self, nodes):
+        """
+        Remove nodes from SGE with a single qconf command line on the master
+        """
         master = self._master
-        master.ssh.execute('qconf -dattr hostgroup hostlist %s @allhosts' %
-                           node.alias)
-        master.ssh.execute('qconf -purge queue slots all.q@%s' % node.alias)
-        master.ssh.execute('qconf -dconf %s' % node.alias)
-        master.ssh.execute('qconf -de %s' % node.alias)
-        node.ssh.execute('pkill -9 sge_execd')
-        nodes = filter(lambda n: n.alias != node.alias, self._nodes)
-        self._create_sge_pe(nodes=nodes)
+        # only exec hosts have been counted in the parallel environment
+        exec_hosts = master.ssh.execute('qconf -sel', ignore_exit_status=True)
+        exec_nodes = [node for node in nodes if node.alias in exec_hosts]
+        aliases = ','.join([node.alias for node in nodes])
+        cmds = ['qconf -dattr hostgroup hostlist %s @allhosts' % aliases]
+        cmds += ['qconf -purge queue slots all.q@%s' % node.alias
+                 for node in nodes]
+        cmds += ['qconf -dconf %s' % aliases, 'qconf -de %s' % aliases]
+        master.ssh.execute(' && '.join(cmds))
+        if exec_nodes:
+            self._update_sge_pe_slots(exec_nodes, remove=True)
+        for node in nodes:
+            self.pool.simple_job(node.ssh.execute, ('pkill -9 sge_execd',),
+                                 jobid=node.alias)
+        self.pool.wait(numtasks=len(nodes))
 
     def run(self, nodes, master, user, user_shell, volumes):
         if not master.ssh.isdir("/opt/sge6-fresh"):
@@ -157,17 +207,24 @@ class SGEPlugin(clustersetup.DefaultClusterSetup):
         log.info("Adding %s to SGE" % node.alias)
         self._setup_nfs(nodes=[node], export_paths=['/opt/sge6'],
                         start_server=False)
-        self._add_sge_admin_host(node)
-        self._add_sge_submit_host(node)
+        # don't count the node's slots twice if it was added before
+        is_exec_host = self._is_sge_exec_host(node)
+        self._add_sge_hosts([node])
         self._add_to_sge(node)
-        self._create_sge_pe()
+        if not is_exec_host:
+            self._update_sge_pe_slots([node])
 
     def on_remove_node(self, node, nodes, master, user, user_shell, volumes):
+        self.on_remove_nodes([node], nodes, master, user, user_shell, volumes)
+
+    def on_remove_nodes(self, remove_nodes, nodes, master, user, user_shell,
+                        volumes):
         self._nodes = nodes
         self._master = master
         self._user = user
         self._user_shell = user_shell
         self._volumes = volumes
-        log.info("Removing %s from SGE" % node.alias)
-        self._remove_from_sge(node)
-        self._remove_nfs_exports(node)
+        log.info("Removing %s from SGE" %
+                 ', '.join([node.alias for node in remove_nodes]))
+        self._remove_from_sge(remove_nodes)
+        master.stop_exporting_fs_to_nodes(remove_nodes)
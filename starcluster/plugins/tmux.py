@@ -27,6 +27,8 @@ class TmuxControlCenter(clustersetup.DefaultClusterSetup):
     nodes. This allows you to interactively run commands on all nodes and see
     all the output at once.
     """
+    requires = ['default']
+
     _layouts = ['even-horizontal', 'even-vertical', 'main-horizontal',
                 'main-vertical', 'tiled']
 
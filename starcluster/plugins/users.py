@@ -16,10 +16,12 @@
 # along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import pipes
 import posixpath
 
 from starcluster import utils
 from starcluster import static
+from starcluster import sshutils
 from starcluster import exception
 from starcluster import clustersetup
 from starcluster.logger import log
@@ -32,6 +34,38 @@ class CreateUsers(clustersetup.DefaultClusterSetup):
 
     DOWNLOAD_KEYS_DIR = os.path.join(static.STARCLUSTER_CFG_DIR, 'user_keys')
     BATCH_USER_FILE = "/root/.users/users.txt"
+    KNOWN_HOSTS_FILE = "/root/.users/known_hosts"
+    SSH_SETUP_SCRIPT = "/root/.users/setup_ssh.sh"
+    SSH_SETUP_TEMPLATE = """\
+#!/bin/bash
+set -e
+known_hosts=%(known_hosts)s
+conn_key=%(conn_key)s
+for user in %(usernames)s; do
+    ssh_dir=$(getent passwd $user | cut -d: -f6)/.ssh
+    mkdir -p $ssh_dir
+    if [ ! -f $ssh_dir/id_rsa ]; then
+        ssh-keygen -q -t rsa -N '' -f $ssh_dir/id_rsa
+    fi
+    auth_keys=$ssh_dir/authorized_keys
+    touch $auth_keys
+    for key in "$(cat $ssh_dir/id_rsa.pub)" "$conn_key"; do
+        if [ -n "$key" ] && ! grep -qxF "$key" $auth_keys; then
+            echo "$key" >> $auth_keys
+        fi
+    done
+    if [ -s $known_hosts ]; then
+        touch $ssh_dir/known_hosts
+        awk -F'[ ,]' 'NR==FNR {h[$1]; next} !($1 in h)' $known_hosts \\
+            $ssh_dir/known_hosts > $ssh_dir/known_hosts.new
+        cat $known_hosts >> $ssh_dir/known_hosts.new
+        mv $ssh_dir/known_hosts.new $ssh_dir/known_hosts
+    fi
+    chmod 400 $ssh_dir/id_rsa $ssh_dir/id_rsa.pub
+    chmod 600 $auth_keys $ssh_dir/known_hosts
+    chown -R $user: $ssh_dir
+done
+"""
 
     def __init__(self, num_users=None, usernames=None, download_keys=None,
                  download_keys_dir=None):
@@ -75,28 +109,48 @@ class CreateUsers(clustersetup.DefaultClusterSetup):
         self.pool.wait(numtasks=len(nodes))
         log.info("Configuring passwordless ssh for %d cluster users" %
                  self._num_users)
-        pbar = self.pool.progress_bar.reset()
-        pbar.maxval = self._num_users
-        for i, user in enumerate(self._usernames):
-            master.generate_key_for_user(user, auth_new_key=True,
-                                         auth_conn_key=True)
-            master.add_to_known_hosts(user, nodes)
-            pbar.update(i + 1)
-        pbar.finish()
+        self._setup_users_ssh(master, self._usernames, nodes)
         self._setup_scratch(nodes, self._usernames)
         if self._download_keys:
             self._download_user_keys(master, self._usernames)
 
+    def _setup_users_ssh(self, master, usernames, nodes):
+        """
+        Generate ssh keys (if missing), authorize them, and add nodes to
+        known_hosts for all usernames on the master with a single remote
+        script. Host keys are collected once per node rather than once per
+        user and node.
+        """
+        khosts = []
+        for node in nodes:
+            khosts += node.get_known_hosts_entries()
+        pardir = posixpath.dirname(self.SSH_SETUP_SCRIPT)
+        if not master.ssh.isdir(pardir):
+            master.ssh.makedirs(pardir)
+        khostsf = master.ssh.remote_file(self.KNOWN_HOSTS_FILE, 'w')
+        khostsf.write('\n'.join(khosts) + '\n')
+        khostsf.close()
+        conn_key = ''
+        if master.ssh._pkey:
+            conn_key = sshutils.get_public_key(master.ssh._pkey)
+        script = master.ssh.remote_file(self.SSH_SETUP_SCRIPT, 'w')
+        script.write(self.SSH_SETUP_TEMPLATE % dict(
+            known_hosts=pipes.quote(self.KNOWN_HOSTS_FILE),
+            conn_key=pipes.quote(conn_key),
+            usernames=' '.join([pipes.quote(u) for u in usernames])))
+        script.close()
+        master.ssh.execute("bash %s" % self.SSH_SETUP_SCRIPT)
+
     def _download_user_keys(self, master, usernames):
         pardir = posixpath.dirname(self.BATCH_USER_FILE)
         bfile = posixpath.basename(self.BATCH_USER_FILE)
         if not master.ssh.isdir(pardir):
             master.ssh.makedirs(pardir)
         log.info("Tarring all SSH keys for cluster users...")
-        for user in usernames:
-            master.ssh.execute(
-                "cp /home/%(user)s/.ssh/id_rsa %(keydest)s" %
-                dict(user=user, keydest=posixpath.join(pardir, user + '.rsa')))
+        master.ssh.execute(
+            "for user in %(users)s; do "
+            "cp /home/$user/.ssh/id_rsa %(pardir)s/$user.rsa; done" %
+            dict(users=' '.join(usernames), pardir=pardir))
         cluster_tag = master.cluster_groups[0].name.replace(
             static.SECURITY_GROUP_PREFIX, '')
         tarfile = "%s-%s.tar.gz" % (cluster_tag, master.region.name)
@@ -124,12 +178,19 @@ class CreateUsers(clustersetup.DefaultClusterSetup):
         shpath = master.ssh.which(shell)[0]
         ctx = dict(shell=shpath)
         base_uid, base_gid = self._get_max_unused_user_id()
+        # stat all existing home folders at once
+        homes = {}
+        out = master.ssh.execute(
+            "stat -c '%%n %%u %%g' %s 2>/dev/null" %
+            ' '.join(['/home/%s' % user for user in usernames]),
+            ignore_exit_status=True)
+        for line in out:
+            home_folder, uid, gid = line.rsplit(' ', 2)
+            homes[home_folder] = (int(uid), int(gid))
         for user in usernames:
             home_folder = '/home/%s' % user
-            if master.ssh.path_exists(home_folder):
-                s = master.ssh.stat(home_folder)
-                uid = s.st_uid
-                gid = s.st_gid
+            if home_folder in homes:
+                uid, gid = homes[home_folder]
             else:
                 uid = base_uid
                 gid = base_gid
@@ -158,12 +219,7 @@ class CreateUsers(clustersetup.DefaultClusterSetup):
         node.ssh.execute("echo -n '%s' | newusers" % newusers)
         log.info("Adding %s to known_hosts for %d users" %
                  (node.alias, self._num_users))
-        pbar = self.pool.progress_bar.reset()
-        pbar.maxval = self._num_users
-        for i, user in enumerate(self._usernames):
-            master.add_to_known_hosts(user, [node])
-            pbar.update(i + 1)
-        pbar.finish()
+        self._setup_users_ssh(master, self._usernames, [node])
         self._setup_scratch(nodes=[node], users=self._usernames)
 
     def on_remove_node(self, node, nodes, master, user, user_shell, volumes):
@@ -24,6 +24,8 @@ class XvfbSetup(clustersetup.DefaultClusterSetup):
     Installs, configures, and sets up an Xvfb server
     (thanks to Adam Marsh for his contribution)
     """
+    requires = ['default']
+
     def _install_xvfb(self, node):
         node.apt_install('xvfb')
 
@@ -0,0 +1,129 @@
+# Copyright 2009-2013 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Local cache for cluster receipts
+
+Loading a cluster's receipt requires finding the master node and then fetching
+and unbundling its user data in order to recover the plugins and volumes the
+cluster was launched with. This module caches the decoded receipt locally in
+~/.starcluster/receipts so that subsequent commands against the same cluster
+can skip those round trips.
+"""
+import os
+import re
+import json
+import hashlib
+import tempfile
+
+from starcluster import utils
+from starcluster import static
+from starcluster.logger import log
+
+
+class ReceiptCache(object):
+    """
+    Stores cluster receipts (plugin metadata and volumes) on the local
+    filesystem keyed by cluster tag and security group id.
+
+    Cached receipts are only returned if the StarCluster version tag and the
+    fingerprint of the cluster group's tags match those recorded when the
+    receipt was cached.
+    """
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or static.STARCLUSTER_RECEIPT_CACHE_DIR
+
+    def _get_receipt_dir(self, cluster_tag):
+        tag = re.sub('[^\w.-]', '_', cluster_tag)
+        return os.path.join(self.cache_dir, tag)
+
+    def _get_receipt_file(self, cluster_tag, group):
+        return os.path.join(self._get_receipt_dir(cluster_tag),
+                            group.id + '.receipt')
+
+    def get_fingerprint(self, group):
+        """
+        Returns a digest of the security group's id and StarCluster tags. This
+        changes whenever the cluster is recreated or its settings change.
+        """
+        sha = hashlib.sha1(group.id)
+        prefix = static.SECURITY_GROUP_PREFIX
+        for key in sorted(group.tags):
+            if key.startswith(prefix):
+                sha.update('%s=%s\n' % (key, group.tags[key]))
+        return sha.hexdigest()
+
+    def get(self, cluster_tag, group):
+        """
+        Returns the cached receipt for cluster_tag as a dictionary with
+        'plugins' and 'volumes' keys or None if no valid receipt is cached
+        """
+        rfile = self._get_receipt_file(cluster_tag, group)
+        if not os.path.isfile(rfile):
+            return
+        try:
+            with open(rfile) as f:
+                cached = json.load(f)
+            version = group.tags.get(static.VERSION_TAG, '')
+            if cached.get('version') != version:
+                log.debug("receipt cache version mismatch: %s" % rfile)
+                return
+            if cached.get('fingerprint') != self.get_fingerprint(group):
+                log.debug("receipt cache fingerprint mismatch: %s" % rfile)
+                return
+            receipt = utils.decode_uncompress_load(cached.get('receipt'))
+        except Exception:
+            log.debug("failed to load cached receipt %s" % rfile,
+                      exc_info=True)
+            return
+        log.debug("using cached receipt: %s" % rfile)
+        return receipt
+
+    def put(self, cluster_tag, group, receipt):
+        """
+        Cache receipt for cluster_tag. Any previously cached receipts for
+        cluster_tag (e.g. from an older cluster with the same tag) are removed.
+        """
+        self.remove(cluster_tag)
+        rfile = self._get_receipt_file(cluster_tag, group)
+        cached = dict(version=group.tags.get(static.VERSION_TAG, ''),
+                      fingerprint=self.get_fingerprint(group),
+                      receipt=utils.dump_compress_encode(receipt))
+        rdir = os.path.dirname(rfile)
+        try:
+            if not os.path.isdir(rdir):
+                os.makedirs(rdir)
+            fd, tmpfile = tempfile.mkstemp(dir=rdir)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(cached, f)
+            os.rename(tmpfile, rfile)
+        except (IOError, OSError):
+            log.debug("failed to cache receipt %s" % rfile, exc_info=True)
+
+    def remove(self, cluster_tag):
+        """
+        Remove all cached receipts for cluster_tag
+        """
+        rdir = self._get_receipt_dir(cluster_tag)
+        if not os.path.isdir(rdir):
+            return
+        for fname in os.listdir(rdir):
+            try:
+                os.unlink(os.path.join(rdir, fname))
+            except OSError:
+                log.debug("failed to remove cached receipt %s" % fname,
+                          exc_info=True)
@@ -25,8 +25,11 @@ import string
 import socket
 import fnmatch
 import hashlib
+import tarfile
+import threading
 import warnings
 import posixpath
+import pipes
 
 import scp
 import paramiko
@@ -41,11 +44,50 @@ try:
 except ImportError:
     HAS_TERMIOS = False
 
+from starcluster import utils
 from starcluster import exception
+from starcluster import threadpool
 from starcluster import progressbar
 from starcluster.logger import log
 
 
+class LockedSFTP(object):
+    """
+    Wraps a paramiko SFTPClient (or a file opened with it) so that each call
+    holds lock while it runs.
+
+    paramiko's SFTPClient is not thread-safe: a thread waiting for a reply
+    discards replies to other threads' requests. All threads sharing an
+    SSHClient's SFTP session therefore need to take turns.
+    """
+
+    def __init__(self, obj, lock):
+        self._obj = obj
+        self._lock = lock
+
+    def __getattr__(self, name):
+        attr = getattr(self._obj, name)
+        if not callable(attr):
+            return attr
+
+        def locked(*args, **kwargs):
+            with self._lock:
+                result = attr(*args, **kwargs)
+            if isinstance(result, paramiko.SFTPFile):
+                return LockedSFTP(result, self._lock)
+            return result
+        return locked
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
 class SSHClient(object):
     """
     Establishes an SSH connection to a remote host using either password or
@@ -70,9 +112,11 @@ class SSHClient(object):
         self._password = password
         self._timeout = timeout
         self._sftp = None
+        self._sftp_lock = threading.RLock()
         self._scp = None
         self._transport = None
         self._progress_bar = None
+        self._thread_local = threading.local()
         self._compress = compress
         if private_key:
             self._pkey = self.load_private_key(private_key, private_key_pass)
@@ -199,11 +243,16 @@ class SSHClient(object):
 
     @property
     def sftp(self):
-        """Establish the SFTP connection."""
-        if not self._sftp or self._sftp.sock.closed:
-            log.debug("creating sftp connection")
-            self._sftp = paramiko.SFTPClient.from_transport(self.transport)
-        return self._sftp
+        """
+        Establish the SFTP connection. Returns the SFTP client wrapped so that
+        it can be used from multiple threads (see LockedSFTP)
+        """
+        with self._sftp_lock:
+            if not self._sftp or self._sftp.sock.closed:
+                log.debug("creating sftp connection")
+                self._sftp = paramiko.SFTPClient.from_transport(
+                    self.transport)
+        return LockedSFTP(self._sftp, self._sftp_lock)
 
     @property
     def scp(self):
@@ -421,9 +470,210 @@ class SSHClient(object):
             return [obj]
         return obj
 
-    def get(self, remotepaths, localpath=''):
+    def _quote(self, paths):
+        return ' '.join([pipes.quote(p) for p in paths])
+
+    def stat_paths(self, paths, recursive=False):
+        """
+        Returns a dictionary mapping each existing path in paths (and every
+        path below it if recursive is True) to a (type, size) tuple using a
+        single remote find command instead of one SFTP stat per path. The
+        type is find's %y type letter (e.g. 'f' for regular files, 'd' for
+        directories). Symlinks are followed and paths that do not exist are
+        omitted.
+        """
+        stats = {}
+        depth = '' if recursive else '-maxdepth 0 '
+        for chunk in utils.chunk_list(paths, items=500):
+            cmd = "find -L %s %s-printf '%%y\\t%%s\\t%%p\\n' 2>/dev/null"
+            cmd %= (self._quote(chunk), depth)
+            for line in self.execute(cmd, ignore_exit_status=True,
+                                     log_output=False):
+                fields = line.split('\t', 2)
+                if len(fields) == 3:
+                    stats[fields[2]] = (fields[0], int(fields[1]))
+        return stats
+
+    def get_md5s(self, paths, sizes=None):
+        """
+        Returns a dictionary mapping each remote file in paths to its md5
+        checksum using a single remote command per 500 files
+
+        sizes - optional list with the number of bytes at the start of each
+        file to checksum (defaults to the whole file)
+        """
+        sizes = sizes or [None] * len(paths)
+        items = zip(paths, sizes)
+        md5s = {}
+        for chunk in utils.chunk_list(items, items=500):
+            cmds = []
+            for path, size in chunk:
+                if size is None:
+                    cmds.append("(md5sum < %s || echo -)" % pipes.quote(path))
+                else:
+                    cmds.append("(head -c %d %s | md5sum)" %
+                                (size, pipes.quote(path)))
+            out = self.execute('; '.join(cmds) + ' 2>/dev/null',
+                               ignore_exit_status=True, log_output=False)
+            for (path, size), line in zip(chunk, out):
+                md5s[path] = line.split()[0]
+        return md5s
+
+    def _get_thread_sftp(self):
+        """
+        Returns an SFTP client for the calling thread. Each thread gets its
+        own SFTP channel on this connection's transport so that transfers in
+        different threads do not block each other.
+        """
+        sftp = getattr(self._thread_local, 'sftp', None)
+        if sftp is None or sftp.sock.closed:
+            log.debug("creating sftp channel for %s" %
+                      threading.current_thread().name)
+            sftp = paramiko.SFTPClient.from_transport(self.transport)
+            self._thread_local.sftp = sftp
+        return sftp
+
+    def _get_file(self, remotepath, localpath, offset, callback):
+        rf = self._get_thread_sftp().open(remotepath, 'rb')
+        try:
+            rf.seek(offset)
+            rf.prefetch()
+            with open(localpath, 'ab' if offset else 'wb') as lf:
+                for data in iter(lambda: rf.read(1024 * 1024), ''):
+                    lf.write(data)
+                    offset += len(data)
+                    callback(remotepath, offset)
+        finally:
+            rf.close()
+
+    def _put_file(self, localpath, remotepath, offset, callback):
+        sftp = self._get_thread_sftp()
+        rf = sftp.open(remotepath, 'ab' if offset else 'wb')
+        try:
+            rf.set_pipelined(True)
+            with open(localpath, 'rb') as lf:
+                lf.seek(offset)
+                for data in iter(lambda: lf.read(1024 * 1024), ''):
+                    rf.write(data)
+                    offset += len(data)
+                    callback(localpath, offset)
+        finally:
+            rf.close()
+        sftp.chmod(remotepath, stat.S_IMODE(os.stat(localpath).st_mode))
+
+    def _transfer_files(self, method, files, num_channels, label):
+        """
+        Transfer files, a list of (src, dest, size, offset) tuples, using
+        method(src, dest, offset, callback) in num_channels threads
+        """
+        total = sum([size - offset for src, dest, size, offset in files])
+        widgets = [label, progressbar.Percentage(), ' ',
+                   progressbar.Bar(marker=progressbar.RotatingMarker()), ' ',
+                   progressbar.ETA(), ' ', progressbar.FileTransferSpeed()]
+        pbar = progressbar.ProgressBar(widgets=widgets,
+                                       maxval=max(total, 1)).start()
+        lock = threading.Lock()
+        transferred = dict([(src, 0) for src, dest, size, offset in files])
+        offsets = dict([(src, offset) for src, dest, size, offset in files])
+
+        def _progress(src, pos):
+            with lock:
+                transferred[src] = pos - offsets[src]
+                pbar.update(sum(transferred.values()))
+        pool = threadpool.get_thread_pool(size=num_channels,
+                                          disable_threads=False)
+        for src, dest, size, offset in files:
+            pool.simple_job(method, (src, dest, offset, _progress),
+                            jobid=src)
+        try:
+            pool.wait(numtasks=len(files), show_progress=False)
+        except exception.ThreadPoolException, e:
+            raise exception.SCPException(
+                "%d file transfer(s) failed: %s" %
+                (len(e.exceptions), e.exceptions[0][0]))
+        pbar.finish()
+
+    def _verify_files(self, files, remote_index):
+        """
+        Compare the md5 checksum of each (src, dest, size, offset) tuple in
+        files locally and remotely. remote_index is the position of the
+        remote path in each tuple.
+        """
+        if not files:
+            return
+        remote = [f[remote_index] for f in files]
+        md5s = self.get_md5s(remote)
+        for f in files:
+            local = f[1 - remote_index]
+            if utils.get_file_md5(local) != md5s.get(f[remote_index]):
+                raise exception.SCPException(
+                    "checksum mismatch after resuming transfer: %s" % local)
+
+    def _get_tar(self, remotepaths, localpath):
+        """
+        Stream remotepaths into localpath (a directory) as a single tar
+        archive over one channel
+        """
+        if not os.path.isdir(localpath):
+            raise exception.BaseException(
+                "Local path must be an existing directory when using tar: "
+                "%s" % localpath)
+        args = ' '.join(['-C %s %s' % (pipes.quote(posixpath.dirname(p) or
+                                                   '.'),
+                                       pipes.quote(posixpath.basename(p)))
+                         for p in remotepaths])
+        channel = self.transport.open_session()
+        channel.exec_command('tar -cf - %s' % args)
+        tf = tarfile.open(fileobj=channel.makefile('rb', -1), mode='r|')
+        try:
+            tf.extractall(localpath)
+        finally:
+            tf.close()
+        status = channel.recv_exit_status()
+        if status != 0:
+            raise exception.SCPException(
+                "remote tar failed with status %d: %s" %
+                (status, channel.makefile_stderr('rb', -1).read()))
+
+    def _put_tar(self, localpaths, remotepath):
+        """
+        Stream localpaths into remotepath (a directory) as a single tar
+        archive over one channel
+        """
+        if not self.stat_paths([remotepath]).get(remotepath, ('',))[0] == 'd':
+            raise exception.BaseException(
+                "Remote path must be an existing directory when using tar: "
+                "%s" % remotepath)
+        channel = self.transport.open_session()
+        channel.exec_command('tar -C %s --no-same-owner -xpf -' %
+                             pipes.quote(remotepath))
+        wf = channel.makefile('wb', -1)
+        tf = tarfile.open(fileobj=wf, mode='w|')
+        try:
+            for lpath in localpaths:
+                tf.add(lpath, arcname=os.path.basename(lpath.rstrip(os.sep)))
+        finally:
+            tf.close()
+            wf.close()
+            channel.shutdown_write()
+        status = channel.recv_exit_status()
+        if status != 0:
+            raise exception.SCPException(
+                "remote tar failed with status %d: %s" %
+                (status, channel.makefile_stderr('rb', -1).read()))
+
+    def get(self, remotepaths, localpath='', num_channels=1, use_tar=False,
+            resume=False):
         """
         Copies one or more files from the remote host to the local host.
+
+        num_channels - number of SFTP channels used to copy files
+        concurrently (by default everything is copied in a single scp
+        session)
+        use_tar - stream all files as one tar archive, useful for many small
+        files (localpath must be an existing directory)
+        resume - skip files that have already been copied and resume
+        partially copied files (verified using md5 checksums)
         """
         remotepaths = self._make_list(remotepaths)
         localpath = localpath or os.getcwd()
@@ -438,13 +688,22 @@ class SSHClient(object):
         remotepaths = noglobs
         for globresult in globresults:
             remotepaths.extend(globresult)
-        recursive = False
+        remotepaths = [rpath.rstrip('/') or '/' for rpath in remotepaths]
+        parallel = num_channels > 1 or resume
+        stats = self.stat_paths(remotepaths,
+                                recursive=parallel and not use_tar)
         for rpath in remotepaths:
-            if not self.path_exists(rpath):
+            if rpath not in stats:
                 raise exception.BaseException(
                     "Remote file or directory does not exist: %s" % rpath)
+        if use_tar:
+            return self._get_tar(remotepaths, localpath)
+        elif parallel:
+            return self._get_parallel(remotepaths, localpath, stats,
+                                      num_channels, resume)
+        recursive = False
         for rpath in remotepaths:
-            if self.isdir(rpath):
+            if stats[rpath][0] == 'd':
                 recursive = True
                 break
         try:
@@ -455,11 +714,65 @@ class SSHClient(object):
                       str(remotepaths), localpath)
             raise exception.SCPException(str(e))
 
-    def put(self, localpaths, remotepath='.'):
+    def _get_parallel(self, remotepaths, localpath, stats, num_channels=4,
+                      resume=False):
+        local_isdir = os.path.isdir(localpath)
+        if len(remotepaths) > 1 and not local_isdir:
+            raise exception.BaseException(
+                "Local directory does not exist: %s" % localpath)
+        files = []
+        for rpath in remotepaths:
+            dest = localpath
+            if local_isdir:
+                dest = os.path.join(localpath, posixpath.basename(rpath))
+            prefix = rpath.rstrip('/') + '/'
+            for path, (typ, size) in stats.items():
+                if path != rpath and not path.startswith(prefix):
+                    continue
+                rel = path[len(prefix):] if path != rpath else ''
+                lpath = os.path.join(dest, *rel.split('/')) if rel else dest
+                if typ == 'd' and not os.path.isdir(lpath):
+                    os.makedirs(lpath)
+                elif typ == 'f':
+                    files.append((path, lpath, size, 0))
+        resumed = []
+        if resume:
+            partial = [f for f in files if os.path.isfile(f[1]) and
+                       0 < os.path.getsize(f[1]) <= f[2]]
+            sizes = [os.path.getsize(f[1]) for f in partial]
+            md5s = self.get_md5s([f[0] for f in partial], sizes=sizes)
+            for (rpath, lpath, size, offset), lsize in zip(partial, sizes):
+                if utils.get_file_md5(lpath) == md5s.get(rpath):
+                    resumed.append((rpath, lpath, size, lsize))
+            done = set([f[0] for f in resumed])
+            files = [f for f in files if f[0] not in done] + resumed
+            files = [f for f in files if f[3] < f[2] or f[2] == 0]
+            log.info("Resuming transfer: %d file(s) already copied" %
+                     len([f for f in resumed if f[3] == f[2]]))
+        if files:
+            self._transfer_files(self._get_file, files, num_channels,
+                                 'downloading: ')
+        self._verify_files([f for f in resumed if f[3] < f[2]], 0)
+
+    def put(self, localpaths, remotepath='.', num_channels=1, use_tar=False,
+            resume=False):
         """
         Copies one or more files from the local host to the remote host.
+
+        num_channels - number of SFTP channels used to copy files
+        concurrently (by default everything is copied in a single scp
+        session)
+        use_tar - stream all files as one tar archive, useful for many small
+        files (remotepath must be an existing directory)
+        resume - skip files that have already been copied and resume
+        partially copied files (verified using md5 checksums)
         """
         localpaths = self._make_list(localpaths)
+        if use_tar:
+            return self._put_tar(localpaths, remotepath)
+        elif num_channels > 1 or resume:
+            return self._put_parallel(localpaths, remotepath, num_channels,
+                                      resume)
         recursive = False
         for lpath in localpaths:
             if os.path.isdir(lpath):
@@ -473,6 +786,53 @@ class SSHClient(object):
                       str(localpaths), remotepath)
             raise exception.SCPException(str(e))
 
+    def _put_parallel(self, localpaths, remotepath, num_channels=4,
+                      resume=False):
+        remote_isdir = self.stat_paths([remotepath]).get(
+            remotepath, ('',))[0] == 'd'
+        if len(localpaths) > 1 and not remote_isdir:
+            raise exception.BaseException(
+                "Remote directory does not exist: %s" % remotepath)
+        files = []
+        dirs = []
+        for lpath in localpaths:
+            dest = remotepath
+            if remote_isdir:
+                name = os.path.basename(lpath.rstrip(os.sep))
+                dest = posixpath.join(remotepath, name)
+            if not os.path.isdir(lpath):
+                files.append((lpath, dest, os.path.getsize(lpath), 0))
+                continue
+            for root, dnames, fnames in os.walk(lpath):
+                rel = os.path.relpath(root, lpath).replace(os.sep, '/')
+                rdir = posixpath.normpath(posixpath.join(dest, rel))
+                dirs.append(rdir)
+                for fname in fnames:
+                    lfile = os.path.join(root, fname)
+                    files.append((lfile, posixpath.join(rdir, fname),
+                                  os.path.getsize(lfile), 0))
+        for chunk in utils.chunk_list(dirs, items=500):
+            self.execute('mkdir -p %s' % self._quote(chunk))
+        resumed = []
+        if resume:
+            stats = self.stat_paths([f[1] for f in files])
+            partial = [f for f in files if f[1] in stats and
+                       0 < stats[f[1]][1] <= f[2]]
+            md5s = self.get_md5s([f[1] for f in partial])
+            for lpath, rpath, size, offset in partial:
+                rsize = stats[rpath][1]
+                if utils.get_file_md5(lpath, size=rsize) == md5s.get(rpath):
+                    resumed.append((lpath, rpath, size, rsize))
+            done = set([f[0] for f in resumed])
+            files = [f for f in files if f[0] not in done] + resumed
+            files = [f for f in files if f[3] < f[2] or f[2] == 0]
+            log.info("Resuming transfer: %d file(s) already copied" %
+                     len([f for f in resumed if f[3] == f[2]]))
+        if files:
+            self._transfer_files(self._put_file, files, num_channels,
+                                 'uploading: ')
+        self._verify_files([f for f in resumed if f[3] < f[2]], 1)
+
     def execute_async(self, command, source_profile=True):
         """
         Executes a remote command so that it continues running even after this
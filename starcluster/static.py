@@ -53,6 +53,7 @@ def create_sc_config_dirs():
     __makedirs(STARCLUSTER_CFG_DIR, exit_on_failure=True)
     __makedirs(STARCLUSTER_PLUGIN_DIR)
     __makedirs(STARCLUSTER_LOG_DIR)
+    __makedirs(STARCLUSTER_RECEIPT_CACHE_DIR)
 
 
 VERSION = "0.95.3"
@@ -73,6 +74,11 @@ STARCLUSTER_PLUGIN_DIR = os.path.join(STARCLUSTER_CFG_DIR, 'plugins')
 STARCLUSTER_LOG_DIR = os.path.join(STARCLUSTER_CFG_DIR, 'logs')
 STARCLUSTER_RECEIPT_DIR = "/var/run/starcluster"
 STARCLUSTER_RECEIPT_FILE = os.path.join(STARCLUSTER_RECEIPT_DIR, "receipt.pkl")
+# completed plugin steps recorded on the master (cleared when it reboots)
+STARCLUSTER_PLUGIN_JOURNAL = os.path.join(STARCLUSTER_RECEIPT_DIR,
+                                          "plugins.journal")
+JOURNALED_PLUGIN_METHODS = ['run', 'on_add_node']
+STARCLUSTER_RECEIPT_CACHE_DIR = os.path.join(STARCLUSTER_CFG_DIR, 'receipts')
 STARCLUSTER_OWNER_ID = 342652561657
 
 DEBUG_FILE = os.path.join(STARCLUSTER_LOG_DIR, 'debug.log')
@@ -101,6 +107,23 @@ UD_PLUGINS_FNAME = "_sc_plugins.txt"
 UD_VOLUMES_FNAME = "_sc_volumes.txt"
 UD_ALIASES_FNAME = "_sc_aliases.txt"
 
+# markers for the StarCluster-managed section of /etc/hosts on each node
+ETC_HOSTS_BEGIN = "# BEGIN STARCLUSTER HOSTS"
+ETC_HOSTS_END = "# END STARCLUSTER HOSTS"
+
+# cluster-local package cache (lives on the master's NFS-shared /home)
+PKG_CACHE_DIR = "/home/.starcluster/pkgcache"
+APT_UPDATE_STAMP = "/var/lib/apt/lists/.starcluster-updated"
+APT_INDEX_MAX_AGE = 3600
+PY_WHEELHOUSE_DIR = "/home/.starcluster/wheelhouse"
+
+# "warm" images with plugin installs baked in (see Cluster.create_warm_image)
+WARM_IMAGE_TAG = 'starcluster-warm-image'
+WARM_IMAGE_PLUGINS_TAG = 'starcluster-baked-plugins'
+WARM_IMAGE_BASE_TAG = 'starcluster-base-image'
+WARM_IMAGE_TIME_TAG = 'starcluster-baked-at'
+WARM_IMAGE_GROUP = 'starcluster-image-builder'
+
 INSTANCE_METADATA_URI = "http://169.254.169.254/latest"
 INSTANCE_STATES = ['pending', 'running', 'shutting-down',
                    'terminated', 'stopping', 'stopped']
@@ -108,6 +131,9 @@ VOLUME_STATUS = ['creating', 'available', 'in-use',
                  'deleting', 'deleted', 'error']
 VOLUME_ATTACH_STATUS = ['attaching', 'attached', 'detaching', 'detached']
 
+LIST_OUTPUT_FORMATS = ['text', 'json', 'tsv']
+ARCHITECTURES = ['i386', 'x86_64']
+
 INSTANCE_TYPES = {
     't1.micro': ['i386', 'x86_64'],
     'm1.small': ['i386', 'x86_64'],
@@ -186,6 +212,34 @@ PROTOCOLS = ['tcp', 'udp', 'icmp']
 
 WORLD_CIDRIP = '0.0.0.0/0'
 
+# NFS tuning profiles for the shares exported by the master (/home and EBS
+# volumes). export_options and mount_options are used in /etc/exports and
+# /etc/fstab respectively and nfsd_threads sets the number of nfsd threads on
+# the master (None leaves the distro default)
+NFS_EXPORT_OPTIONS = 'async,no_root_squash,no_subtree_check,rw'
+NFS_MOUNT_OPTIONS = 'rw,exec,noauto'
+NFS_PROFILES = {
+    'default': dict(export_options=NFS_EXPORT_OPTIONS,
+                    mount_options=NFS_MOUNT_OPTIONS,
+                    nfsd_threads=None),
+    # large sequential reads of shared inputs/software, few writes
+    'read-mostly': dict(export_options=NFS_EXPORT_OPTIONS,
+                        mount_options=NFS_MOUNT_OPTIONS + ',noatime,'
+                        'rsize=1048576,wsize=1048576,actimeo=60',
+                        nfsd_threads=32),
+    # large streaming writes of intermediate output from all nodes
+    'scratch': dict(export_options=NFS_EXPORT_OPTIONS,
+                    mount_options=NFS_MOUNT_OPTIONS + ',noatime,'
+                    'rsize=1048576,wsize=1048576',
+                    nfsd_threads=64),
+    # many small files: favor many nfsd threads and cached lookups
+    'metadata-heavy': dict(export_options=NFS_EXPORT_OPTIONS,
+                           mount_options=NFS_MOUNT_OPTIONS + ',noatime,'
+                           'nodiratime,lookupcache=all,acregmin=10,'
+                           'acdirmin=30',
+                           nfsd_threads=128),
+}
+
 DEFAULT_SSH_PORT = 22
 
 AVAILABLE_SHELLS = {
@@ -234,6 +288,7 @@ EBS_VOLUME_SETTINGS = {
     'device': (str, False, None, None, None),
     'partition': (int, False, None, None, None),
     'mount_path': (str, True, None, None, None),
+    'node': (str, False, None, None, None),
 }
 
 PLUGIN_SETTINGS = {
@@ -276,4 +331,8 @@ CLUSTER_SETTINGS = {
     'force_spot_master': (bool, False, False, None, None),
     'disable_cloudinit': (bool, False, False, None, None),
     'dns_prefix': (bool, False, False, None, None),
+    'nfs_profile': (str, False, 'default', NFS_PROFILES.keys(), None),
+    'nfs_mount_options': (str, False, None, None, None),
+    'ephemeral_raid': (bool, False, False, None, None),
+    'warm_image': (bool, False, False, None, None),
 }
@@ -126,6 +126,17 @@ NODE_INSTANCE_TYPE = m1.small
 # Uncomment to disable installing/configuring a queueing system on the
 # cluster (SGE)
 #DISABLE_QUEUE=True
+# NFS tuning profile for /home and EBS volumes shared from the master
+# (options: %(nfs_profiles)s)
+#NFS_PROFILE = default
+# Extra NFS mount options appended to the profile's options (OPTIONAL)
+#NFS_MOUNT_OPTIONS = nconnect=8
+# Uncomment to stripe all ephemeral (instance-store) disks on each node into
+# a RAID0 array mounted on /scratch (requires mdadm on the AMI)
+#EPHEMERAL_RAID = True
+# Uncomment to launch nodes from a "warm" image created with the bakeimage
+# command for this template's plugin configuration (if one exists)
+#WARM_IMAGE = True
 # Uncomment to specify a different instance type for the master node (OPTIONAL)
 # (defaults to NODE_INSTANCE_TYPE if not specified)
 #MASTER_INSTANCE_TYPE = m1.small
@@ -354,6 +365,7 @@ NODE_INSTANCE_TYPE = m1.small
     'hvm_ami': static.BASE_AMI_HVM,
     'instance_types': ', '.join(static.INSTANCE_TYPES.keys()),
     'shells': ', '.join(static.AVAILABLE_SHELLS.keys()),
+    'nfs_profiles': ', '.join(sorted(static.NFS_PROFILES.keys())),
 }
 
 DASHES = '-' * 10
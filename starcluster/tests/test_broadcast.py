@@ -0,0 +1,55 @@
+# Copyright 2009-2013 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import tempfile
+
+from starcluster import utils
+
+
+def test_binomial_tree_rounds():
+    assert utils.get_binomial_tree_rounds('m', []) == []
+    rounds = utils.get_binomial_tree_rounds('m', ['a', 'b', 'c', 'd', 'e'])
+    assert rounds == [[('m', 'a')],
+                      [('m', 'b'), ('a', 'c')],
+                      [('m', 'd'), ('a', 'e')]]
+
+
+def test_binomial_tree_rounds_reach_all_targets():
+    for n in range(1, 70):
+        targets = range(n)
+        rounds = utils.get_binomial_tree_rounds(-1, targets)
+        seeded = set([-1])
+        for pairs in rounds:
+            receivers = [r for s, r in pairs]
+            assert all([s in seeded for s, r in pairs])
+            assert len(set([s for s, r in pairs])) == len(pairs)
+            seeded.update(receivers)
+        assert seeded == set([-1] + targets)
+        assert len(rounds) == len(bin(n)) - 2
+
+
+def test_get_file_md5():
+    data = 'starcluster' * 100000
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(data)
+        f.flush()
+        assert utils.get_file_md5(f.name) == hashlib.md5(data).hexdigest()
+        for size in [0, 5, 1024 * 1024, len(data), len(data) + 10]:
+            md5 = hashlib.md5(data[:size]).hexdigest()
+            assert utils.get_file_md5(f.name, size=size) == md5
+            assert utils.get_file_md5(f.name, size=size, blocksize=7) == md5
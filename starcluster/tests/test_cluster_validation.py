@@ -178,6 +178,45 @@ class TestClusterValidation(StarClusterTest):
             raise Exception("validation fails on valid cases: %s" %
                             str(passed))
 
+    def test_node_ebs_validation(self):
+        def vol(vol_id, device, mount_path, node=None):
+            return dict(volume_id=vol_id, device=device, partition=None,
+                        mount_path=mount_path, node=node)
+        cases = [
+            # one volume assigned to two nodes
+            {'volumes': {'v1': vol('vol-1', '/dev/sdz', '/scratch',
+                                   'node001'),
+                         'v2': vol('vol-1', '/dev/sdz', '/scratch',
+                                   'node002')}},
+            # node volume mounted on a path NFS-shared from the master
+            {'volumes': {'v1': vol('vol-1', '/dev/sdz', '/data'),
+                         'v2': vol('vol-2', '/dev/sdy', '/data',
+                                   'node001')}},
+            {'volumes': {'v1': vol('vol-1', '/dev/sdz', '/home',
+                                   'node001')}},
+            # two volumes on the same device of the same node
+            {'volumes': {'v1': vol('vol-1', '/dev/sdz', '/scratch1',
+                                   'node001'),
+                         'v2': vol('vol-2', '/dev/sdz', '/scratch2',
+                                   'node001')}},
+        ]
+        for case in cases:
+            case['cluster_size'] = 3
+        failed = self.__test_cases_from_cluster(cases,
+                                                'validate_ebs_settings')
+        if failed:
+            raise Exception(
+                'cluster allows invalid ebs settings (cases: %s)' % failed)
+        # the same device and mount path on different nodes
+        volumes = {'v1': vol('vol-1', '/dev/sdz', '/scratch', 'node001'),
+                   'v2': vol('vol-2', '/dev/sdz', '/scratch', 'node002'),
+                   'v3': vol('vol-3', '/dev/sdz', '/data')}
+        cluster = Cluster(cluster_size=3, volumes=volumes)
+        assert cluster.validator.validate_ebs_settings()
+        # unknown aliases only warn since the node may be added later
+        volumes['v2']['node'] = 'node099'
+        assert cluster.validator.validate_ebs_settings()
+
     def test_permission_validation(self):
         assert self.config.permissions.s3.ip_protocol == 'tcp'
         assert self.config.permissions.s3.cidr_ip == '0.0.0.0/0'
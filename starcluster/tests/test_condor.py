@@ -0,0 +1,27 @@
+# Copyright 2009-2013 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+from starcluster.plugins import condor
+
+
+def test_expand_config_vars():
+    cfg = "LOCAL_DIR = /var/lib/condor\nLOG = $(LOCAL_DIR)/logs\n"
+    cfg += "SPOOL=$(LOG)/spool\nRUN = $(MISSING)/run\n"
+    vals = condor.expand_config_vars(cfg, ['LOCAL_DIR', 'LOG', 'SPOOL',
+                                           'RUN', 'LOCK'])
+    assert vals == ['/var/lib/condor', '/var/lib/condor/logs',
+                    '/var/lib/condor/logs/spool', '/run', '']
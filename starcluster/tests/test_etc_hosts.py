@@ -0,0 +1,49 @@
+# Copyright 2009-2013 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+from starcluster import utils
+from starcluster import static
+
+BEGIN = static.ETC_HOSTS_BEGIN + '\n'
+END = static.ETC_HOSTS_END + '\n'
+
+
+def test_update_hosts_block_creates_block():
+    lines = ['127.0.0.1 localhost\n', '10.0.0.9 node001']
+    add = [('master', '10.0.0.1 master'), ('node001', '10.0.0.2 node001')]
+    new = utils.update_hosts_block(lines, add=add)
+    assert new == ['127.0.0.1 localhost\n', BEGIN, '10.0.0.1 master\n',
+                   '10.0.0.2 node001\n', END]
+
+
+def test_update_hosts_block_add_remove():
+    lines = ['127.0.0.1 localhost\n', BEGIN, '10.0.0.1 master\n',
+             '10.0.0.2 node001\n', '10.0.0.3 node002\n', END,
+             '# trailing comment\n']
+    add = [('node001', '10.0.0.4 node001'), ('node003', '10.0.0.5 node003')]
+    new = utils.update_hosts_block(lines, add=add, remove=['node002'])
+    assert new == ['127.0.0.1 localhost\n', '# trailing comment\n', BEGIN,
+                   '10.0.0.1 master\n', '10.0.0.4 node001\n',
+                   '10.0.0.5 node003\n', END]
+
+
+def test_update_hosts_block_replace():
+    lines = [BEGIN, '10.0.0.1 master\n', '10.0.0.2 node001\n', END]
+    new = utils.update_hosts_block(lines, add=[('master', '10.0.0.1 master')],
+                                   replace=True)
+    assert new == [BEGIN, '10.0.0.1 master\n', END]
+    assert utils.update_hosts_block(new, remove=['master']) == [BEGIN, END]
@@ -0,0 +1,81 @@
+# Copyright 2009-2013 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+from starcluster.plugins import hadoop
+
+
+def test_parse_decommission_status():
+    report = """\
+Configured Capacity: 1000 (1 KB)
+Datanodes available: 2 (2 total, 0 dead)
+
+Name: 10.0.0.5:50010
+Decommission Status : Decommission in progress
+Configured Capacity: 500 (500 B)
+
+Name: 10.0.0.6:50010
+Decommission Status : Decommissioned
+""".splitlines()
+    assert hadoop.parse_decommission_status(report) == {
+        '10.0.0.5': 'Decommission in progress',
+        '10.0.0.6': 'Decommissioned'}
+
+
+class FakeSSH(object):
+    def __init__(self, report=None):
+        self.cmds = []
+        self.report = report or []
+
+    def execute(self, cmd, **kwargs):
+        self.cmds.append(cmd)
+        if 'dfsadmin -report' in cmd:
+            return self.report
+        return []
+
+
+class FakeNode(object):
+    def __init__(self, alias, ip, report=None):
+        self.alias = alias
+        self.private_ip_address = ip
+        self.ssh = FakeSSH(report)
+
+
+def _get_nodes(num, report=None):
+    nodes = [FakeNode('master', '10.0.0.1', report)]
+    nodes += [FakeNode('node%.3d' % i, '10.0.0.%d' % (i + 1))
+              for i in range(1, num)]
+    return nodes
+
+
+def test_remove_below_replication():
+    plug = hadoop.Hadoop()
+    nodes = _get_nodes(3)
+    master = nodes[0]
+    plug.on_remove_nodes(nodes[2:], nodes, master, 'sgeadmin', 'bash', {})
+    assert not [c for c in master.ssh.cmds if 'dfsadmin -report' in c]
+    assert [c for c in nodes[2].ssh.cmds if 'datanode stop' in c]
+
+
+def test_remove_decommission_timeout():
+    report = ['Name: 10.0.0.5:50010',
+              'Decommission Status : Decommission in progress']
+    plug = hadoop.Hadoop(decommission_timeout=0)
+    nodes = _get_nodes(5, report=report)
+    master = nodes[0]
+    plug.on_remove_nodes(nodes[4:], nodes, master, 'sgeadmin', 'bash', {})
+    assert [c for c in master.ssh.cmds if 'dfsadmin -report' in c]
+    assert [c for c in nodes[4].ssh.cmds if 'datanode stop' in c]
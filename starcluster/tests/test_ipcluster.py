@@ -0,0 +1,56 @@
+# Copyright 2009-2013 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+from starcluster import utils
+from starcluster.plugins import ipcluster
+
+PROFILE_DIR = '/home/sgeadmin/.ipython/profile_default'
+
+
+class ControllerStarted(Exception):
+    pass
+
+
+class FakeSSH(object):
+    def __init__(self, old_registrations=0):
+        self.cmds = []
+        self.registrations = old_registrations
+
+    def execute(self, cmd, **kwargs):
+        self.cmds.append(cmd)
+        if cmd.startswith('rm -f') and 'log/ipcontroller-*.log' in cmd:
+            self.registrations = 0
+        elif cmd.startswith('ipcluster start'):
+            raise ControllerStarted()
+        elif 'finished registering engine' in cmd:
+            return [str(self.registrations)]
+        return []
+
+
+def test_old_controller_logs_removed():
+    master = utils.AttributeDict(num_processors=4, ssh=FakeSSH(3))
+    plug = ipcluster.IPCluster()
+    try:
+        plug._start_cluster(master, PROFILE_DIR)
+    except ControllerStarted:
+        pass
+    assert master.ssh.cmds[-1].startswith('ipcluster start')
+    assert master.ssh.registrations == 0
+    # engines registered with the new controller
+    master.ssh.registrations = 2
+    assert plug._wait_for_engines(master, PROFILE_DIR, 2) == 2
+    assert plug._wait_for_engines(master, PROFILE_DIR, 3, timeout=0) == 2
@@ -0,0 +1,123 @@
+# Copyright 2009-2013 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import subprocess
+
+from starcluster import node
+from starcluster import utils
+from starcluster import static
+
+
+def _render_raid_template():
+    return node.EPHEMERAL_RAID_TEMPLATE % dict(
+        device='/dev/md0', mount_path='/scratch',
+        metadata_uri=static.INSTANCE_METADATA_URI)
+
+
+def test_ephemeral_raid_template():
+    script = _render_raid_template()
+    proc = subprocess.Popen(['bash', '-n'], stdin=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+    err = proc.communicate(script)[1]
+    assert proc.returncode == 0, err
+    assert 'MD=/dev/md0' in script
+    assert 'MNT=/scratch' in script
+    assert '/proc/mdstat' in script
+    fstab = [l for l in script.splitlines() if '>> /etc/fstab' in l]
+    assert len(fstab) == 2
+    assert all(['nofail' in l for l in fstab])
+
+
+def test_ephemeral_raid_mdstat_lookup():
+    # the array came back as md127 after a reboot
+    mdstat = ("Personalities : [raid0]\n"
+              "md127 : active raid0 xvdc[1] xvdb[0]\n"
+              "      8388608 blocks super 1.2 512k chunks\n"
+              "\n"
+              "unused devices: <none>\n")
+    script = _render_raid_template()
+    start = script.index('for dev in $devs; do\n    md=')
+    end = script.index('done', start) + len('done')
+    lookup = 'devs="/dev/xvdb /dev/xvdc"\n%s\necho $MD\n' % script[start:end]
+    lookup = lookup.replace('/proc/mdstat', '/dev/stdin')
+    lookup = lookup.replace('mdadm --run', 'true')
+    proc = subprocess.Popen(['bash', '-c', lookup], stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE)
+    out = proc.communicate(mdstat)[0]
+    assert out.strip() == '/dev/md127'
+    proc = subprocess.Popen(['bash', '-c', 'MD=/dev/md0\n' + lookup],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    out = proc.communicate("unused devices: <none>\n")[0]
+    assert out.strip() == '/dev/md0'
+
+
+def test_parse_ephemeral_raid_output():
+    assert node.parse_ephemeral_raid_output([]) == []
+    assert node.parse_ephemeral_raid_output(['RAID0:']) == []
+    out = ['mdadm: array /dev/md0 started.',
+           'RAID0: /dev/xvdb /dev/xvdc']
+    assert node.parse_ephemeral_raid_output(out) == ['/dev/xvdb',
+                                                     '/dev/xvdc']
+    out = ['RAID0: /dev/xvdb', 'RAID0: /dev/xvdb /dev/xvdc', 'done']
+    assert node.parse_ephemeral_raid_output(out) == ['/dev/xvdb',
+                                                     '/dev/xvdc']
+
+
+class PushSSH(object):
+    def __init__(self):
+        self.cmds = []
+
+    def execute(self, cmd, **kwargs):
+        self.cmds.append(cmd)
+
+
+class PushNode(node.Node):
+    def __init__(self, alias):
+        self._alias = alias
+        self._push_ssh = PushSSH()
+
+    @property
+    def ssh(self):
+        return self._push_ssh
+
+
+def test_push_files_to_nodes_quoting():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        # fake tar and ssh that record the arguments they receive
+        for name in ['tar', 'ssh']:
+            shim = os.path.join(tmpdir, name)
+            with open(shim, 'w') as f:
+                f.write('#!/bin/sh\nfor a in "$@"; do echo "$a"; done >> '
+                        '%s/%s.args\n' % (tmpdir, name))
+            os.chmod(shim, 0755)
+        master = PushNode('master')
+        files = ["/etc/my file", "/etc/it's; rm -rf x"]
+        nodes = [utils.AttributeDict(private_ip_address='10.0.0.2')]
+        master.push_files_to_nodes(files, nodes)
+        env = dict(os.environ, PATH='%s:%s' % (tmpdir, os.environ['PATH']))
+        subprocess.check_call(['sh', '-c', master.ssh.cmds[-1]], env=env)
+        args = open(os.path.join(tmpdir, 'tar.args')).read().splitlines()
+        assert args[:5] == ['-C', '/', '-cpf', '-', 'etc/my file']
+        assert args[5] == "etc/it's; rm -rf x"
+        args = open(os.path.join(tmpdir, 'ssh.args')).read().splitlines()
+        assert '10.0.0.2' in args
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,89 @@
+# Copyright 2009-2013 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+from starcluster import exception
+from starcluster import clustersetup
+
+
+class Base(clustersetup.ClusterSetup):
+    pass
+
+
+class Legacy(clustersetup.ClusterSetup):
+    pass
+
+
+class NeedsBase(clustersetup.ClusterSetup):
+    requires = ['base']
+
+
+class NeedsLegacy(clustersetup.ClusterSetup):
+    requires = ['Legacy']
+
+
+class Independent(clustersetup.ClusterSetup):
+    requires = []
+
+
+class Circular(clustersetup.ClusterSetup):
+    requires = ['Circular2']
+
+
+class Circular2(clustersetup.ClusterSetup):
+    requires = ['Circular']
+
+
+def test_legacy_plugins_run_in_order():
+    plugs = [Base(), Legacy(), Legacy()]
+    deps = clustersetup.get_plugin_dependencies(plugs)
+    assert deps == [set(), set([0]), set([0, 1])]
+
+
+def test_declared_dependencies():
+    base = Base()
+    plugs = [base, Legacy(), NeedsBase(), NeedsBase(), Independent(),
+             NeedsLegacy()]
+    deps = clustersetup.get_plugin_dependencies(plugs,
+                                                aliases=dict(base=base))
+    assert deps == [set(), set([0]), set([0]), set([0]), set(), set([1])]
+
+
+def test_config_name_and_missing_dependencies():
+    legacy = Legacy()
+    legacy.__name__ = 'mylegacy'
+    needs = NeedsBase()
+    needs.requires = ['mylegacy', 'notloaded']
+    deps = clustersetup.get_plugin_dependencies([legacy, needs])
+    assert deps == [set(), set([0])]
+
+
+def test_reverse_dependencies():
+    base = Base()
+    plugs = [base, NeedsBase(), NeedsBase(), Legacy()]
+    deps = clustersetup.get_plugin_dependencies(
+        plugs, aliases=dict(base=base), reverse=True)
+    assert deps == [set([1, 2, 3]), set([3]), set([3]), set()]
+
+
+def test_circular_dependencies():
+    plugs = [Base(), Circular(), Circular2()]
+    try:
+        clustersetup.get_plugin_dependencies(plugs)
+    except exception.PluginError:
+        pass
+    else:
+        raise Exception("circular dependencies not detected")
@@ -0,0 +1,88 @@
+# Copyright 2009-2013 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+from starcluster import cluster
+from starcluster import clustersetup
+from starcluster import utils
+
+
+class Counter(clustersetup.ClusterSetup):
+    def __init__(self, setting=None):
+        self.runs = 0
+
+    def run(self, nodes, master, user, user_shell, volumes):
+        self.runs += 1
+
+
+class JournalCluster(cluster.Cluster):
+    recorded = None
+
+    @property
+    def master_node(self):
+        return self
+
+    def record_plugin_steps(self, entries):
+        self.recorded = entries
+
+
+def _get_nodes(*aliases):
+    return [utils.AttributeDict(id='i-%d' % i, alias=alias)
+            for i, alias in enumerate(aliases)]
+
+
+def test_plugin_journal():
+    cl = JournalCluster()
+    plug = Counter(setting='a')
+    args = [_get_nodes('master', 'node001'), None, 'sgeadmin', 'bash', {}]
+    cl._run_journaled_plugin(plug, 'counter', 'run', args, journal={})
+    assert plug.runs == 1
+    journal = dict([((i, step), digest)
+                    for i, step, digest in cl.recorded])
+    assert len(journal) == 2
+    cl._run_journaled_plugin(plug, 'counter', 'run', args, journal=journal)
+    assert plug.runs == 1
+    # new node
+    args[0] = _get_nodes('master', 'node001', 'node002')
+    cl._run_journaled_plugin(plug, 'counter', 'run', args, journal=journal)
+    assert plug.runs == 2
+    # changed plugin settings
+    args[0] = _get_nodes('master', 'node001')
+    other = Counter(setting='b')
+    cl._run_journaled_plugin(other, 'counter', 'run', args, journal=journal)
+    assert other.runs == 1
+    # journal disabled (force)
+    cl._run_journaled_plugin(plug, 'counter', 'run', args, journal=None)
+    assert plug.runs == 3
+
+
+class OldStylePlugin(object):
+    def __init__(self):
+        self.removed = []
+
+    def on_remove_node(self, node, nodes, master, user, user_shell, volumes):
+        self.removed.append(node.alias)
+
+
+def test_on_remove_node_fallback():
+    cl = cluster.Cluster()
+    plug = OldStylePlugin()
+    nodes = _get_nodes('master', 'node001', 'node002')
+    args = [nodes[1:], nodes, None, 'sgeadmin', 'bash', {}]
+    cl._run_plugin(plug, 'oldstyle', 'on_remove_nodes', args)
+    assert plug.removed == ['node001', 'node002']
+    # neither on_remove_nodes nor on_remove_node
+    cl._run_plugin(object(), 'empty', 'on_remove_nodes', args)
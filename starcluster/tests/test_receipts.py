@@ -0,0 +1,60 @@
+# Copyright 2009-2013 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+import shutil
+import tempfile
+
+from starcluster import static
+from starcluster import receipts
+
+
+class FakeGroup(object):
+    def __init__(self, id, tags):
+        self.id = id
+        self.tags = tags
+
+
+def _get_group(id='sg-12345678', **tags):
+    gtags = {static.VERSION_TAG: static.VERSION,
+             static.CORE_TAG: 'core-settings'}
+    gtags.update(tags)
+    return FakeGroup(id, gtags)
+
+
+def test_receipt_cache():
+    cache_dir = tempfile.mkdtemp()
+    try:
+        cache = receipts.ReceiptCache(cache_dir=cache_dir)
+        group = _get_group()
+        receipt = dict(plugins=[('mod.Klass', [], {'arg': 1})],
+                       volumes={'data': {'volume_id': 'vol-1234'}})
+        assert cache.get('mycluster', group) is None
+        cache.put('mycluster', group, receipt)
+        assert cache.get('mycluster', group) == receipt
+        # changing the group's settings tags invalidates the cache
+        changed = _get_group(**{static.CORE_TAG: 'new-settings'})
+        assert cache.get('mycluster', changed) is None
+        # a new group with the same tag invalidates the old receipt
+        newgroup = _get_group(id='sg-87654321')
+        assert cache.get('mycluster', newgroup) is None
+        cache.put('mycluster', newgroup, receipt)
+        assert cache.get('mycluster', newgroup) == receipt
+        assert cache.get('mycluster', group) is None
+        cache.remove('mycluster')
+        assert cache.get('mycluster', newgroup) is None
+    finally:
+        shutil.rmtree(cache_dir)
@@ -0,0 +1,63 @@
+# Copyright 2009-2013 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+from starcluster.plugins import sge
+
+
+class FakeSSH(object):
+    def __init__(self, output=None):
+        self.cmds = []
+        self.output = output or {}
+
+    def execute(self, cmd, **kwargs):
+        self.cmds.append(cmd)
+        return self.output.get(cmd, [])
+
+
+class FakeNode(object):
+    def __init__(self, alias, output=None):
+        self.alias = alias
+        self.num_processors = 2
+        self.ssh = FakeSSH(output)
+        self.unexported = []
+
+    def is_master(self):
+        return self.alias == 'master'
+
+    def stop_exporting_fs_to_nodes(self, nodes):
+        self.unexported.extend(nodes)
+
+
+def test_on_remove_nodes():
+    master = FakeNode('master', {
+        'qconf -sel': ['master', 'node001', 'node002'],
+        'qconf -sp orte': ['pe_name orte', 'slots 6']})
+    nodes = [master, FakeNode('node001'), FakeNode('node002'),
+             FakeNode('node003')]
+    plug = sge.SGEPlugin(disable_threads=True)
+    plug.on_remove_nodes(nodes[2:], nodes, master, 'sgeadmin', 'bash', {})
+    qconf = [c for c in master.ssh.cmds if '-dattr' in c]
+    assert qconf == [
+        'qconf -dattr hostgroup hostlist node002,node003 @allhosts && '
+        'qconf -purge queue slots all.q@node002 && '
+        'qconf -purge queue slots all.q@node003 && '
+        'qconf -dconf node002,node003 && qconf -de node002,node003']
+    # node003 was never an exec host so only node002's slots are removed
+    assert 'qconf -mattr pe slots 4 orte' in master.ssh.cmds
+    assert master.unexported == nodes[2:]
+    for node in nodes[2:]:
+        assert node.ssh.cmds == ['pkill -9 sge_execd']
@@ -0,0 +1,54 @@
+# Copyright 2009-2013 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+import StringIO
+
+from starcluster import sshutils
+
+
+class FakeSFTP(object):
+    def __init__(self):
+        self.lock = None
+        self.held = []
+
+    def listdir(self, path):
+        # RLock has no public owner check - a non-blocking acquire from
+        # another thread fails while the caller holds it
+        result = []
+        t = threading.Thread(
+            target=lambda: result.append(self.lock.acquire(False)))
+        t.start()
+        t.join()
+        self.held.append(not result[0])
+        return ['a', 'b']
+
+    def open(self, path, mode='r'):
+        return StringIO.StringIO('one\ntwo\n')
+
+
+def test_locked_sftp():
+    fake = FakeSFTP()
+    lock = fake.lock = threading.RLock()
+    sftp = sshutils.LockedSFTP(fake, lock)
+    assert sftp.listdir('/') == ['a', 'b']
+    assert fake.held == [True]
+    # lock is released between calls
+    assert lock.acquire(False)
+    lock.release()
+    f = sftp.open('/etc/hosts')
+    assert list(f) == ['one\n', 'two\n']
@@ -0,0 +1,29 @@
+# Copyright 2009-2013 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+from starcluster import utils
+
+
+def test_poll_interval():
+    # nothing known yet: back off linearly from the minimum
+    assert utils.get_poll_interval(0, 0) == 5
+    assert utils.get_poll_interval(0, 20) == 20
+    assert utils.get_poll_interval(0, 600) == 60
+    # poll often when almost done, rarely when far from done
+    assert utils.get_poll_interval(99, 600) == 5
+    assert utils.get_poll_interval(10, 600) == 60
+    assert utils.get_poll_interval(50, 100) == 25
@@ -157,17 +157,18 @@ class ThreadPool(workerpool.WorkerPool):
         workerpool.WorkerPool.shutdown(self)
         self.wait(numtasks=self.size())
 
-    def wait(self, numtasks=None, return_results=True):
+    def wait(self, numtasks=None, return_results=True, show_progress=True):
         pbar = self.progress_bar.reset()
         pbar.maxval = self.unfinished_tasks
         if numtasks is not None:
             pbar.maxval = max(numtasks, self.unfinished_tasks)
         while self.unfinished_tasks != 0:
             finished = pbar.maxval - self.unfinished_tasks
-            pbar.update(finished)
+            if show_progress:
+                pbar.update(finished)
             log.debug("unfinished_tasks = %d" % self.unfinished_tasks)
             time.sleep(1)
-        if pbar.maxval != 0:
+        if pbar.maxval != 0 and show_progress:
             pbar.finish()
         self.join()
         exc_queue = self._exception_queue
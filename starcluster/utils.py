@@ -23,6 +23,7 @@ import os
 import re
 import sys
 import zlib
+import hashlib
 import time
 import json
 import types
@@ -39,6 +40,7 @@ import iptools
 import iso8601
 import decorator
 
+from starcluster import static
 from starcluster import spinner
 from starcluster import exception
 from starcluster.logger import log
@@ -534,6 +536,142 @@ def chunk_list(ls, items=8):
         yield itms
 
 
+def print_rows(rows, fields, output='json'):
+    """
+    Print an iterable of dictionaries to stdout one row at a time and return
+    the number of rows printed.
+
+    output - 'json' prints one compact JSON object per line, 'tsv' prints a
+             header line of field names followed by tab-separated values
+
+    Only the keys listed in fields are printed. For TSV output lists are
+    joined with commas and dictionaries are printed as comma-separated
+    key=value pairs.
+    """
+    count = 0
+    if output == 'tsv':
+        print '\t'.join(fields)
+    for row in rows:
+        if output == 'tsv':
+            vals = []
+            for field in fields:
+                val = row.get(field)
+                if isinstance(val, dict):
+                    val = ','.join(['%s=%s' % i for i in sorted(val.items())])
+                elif isinstance(val, (list, tuple)):
+                    val = ','.join([str(v) for v in val])
+                elif val is None:
+                    val = ''
+                vals.append(unicode(val).replace('\t', ' '))
+            print u'\t'.join(vals).encode('utf-8')
+        else:
+            print json.dumps(dict([(f, row.get(f)) for f in fields]),
+                             sort_keys=True, separators=(',', ':'))
+        sys.stdout.flush()
+        count += 1
+    return count
+
+
+def update_hosts_block(lines, add=None, remove=None, replace=False):
+    """
+    Returns a new list of /etc/hosts lines with the StarCluster-managed block
+    (delimited by static.ETC_HOSTS_BEGIN and static.ETC_HOSTS_END) updated.
+    The block is created at the end of the file if it does not exist.
+
+    add - list of (alias, hosts_entry) pairs to add or update in the block
+    remove - list of aliases to remove from the block
+    replace - if True existing entries in the block are dropped first
+
+    Lines outside of the block that contain any of the given aliases (e.g.
+    entries appended by older versions of StarCluster) are also removed.
+    """
+    add = add or []
+    remove = set(remove or [])
+    aliases = remove.union([alias for alias, entry in add])
+    other = []
+    # alias order plus a dict instead of OrderedDict (not in python 2.6)
+    order = []
+    block = {}
+    in_block = False
+    for line in lines:
+        stripped = line.strip()
+        if stripped == static.ETC_HOSTS_BEGIN:
+            in_block = True
+            continue
+        elif stripped == static.ETC_HOSTS_END:
+            in_block = False
+            continue
+        names = stripped.split('#')[0].split()[1:]
+        if in_block:
+            if names and not replace:
+                if names[0] not in block:
+                    order.append(names[0])
+                block[names[0]] = stripped
+        elif not aliases.intersection(names):
+            other.append(line.rstrip('\n') + '\n')
+    order = [alias for alias in order if alias not in remove]
+    block = dict([(alias, block[alias]) for alias in order])
+    for alias, entry in add:
+        if alias not in block:
+            order.append(alias)
+        block[alias] = entry
+    lines = other + [static.ETC_HOSTS_BEGIN + '\n']
+    lines += [block[alias] + '\n' for alias in order]
+    lines.append(static.ETC_HOSTS_END + '\n')
+    return lines
+
+
+def get_file_md5(path, size=None, blocksize=1024 * 1024):
+    """
+    Returns the hex MD5 digest of the local file path
+
+    size - only checksum the first size bytes of the file
+    """
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        while size is None or size > 0:
+            nbytes = blocksize if size is None else min(blocksize, size)
+            chunk = f.read(nbytes)
+            if not chunk:
+                break
+            md5.update(chunk)
+            if size is not None:
+                size -= len(chunk)
+    return md5.hexdigest()
+
+
+def get_binomial_tree_rounds(source, targets):
+    """
+    Returns a list of rounds for relaying data from source to each item in
+    targets. Each round is a list of (sender, receiver) pairs in which every
+    item that already has the data sends it to one item that does not, so
+    that all targets are reached in ceil(log2(len(targets) + 1)) rounds.
+    """
+    seeded = [source]
+    remaining = list(targets)
+    rounds = []
+    while remaining:
+        pairs = zip(seeded, remaining)
+        remaining = remaining[len(pairs):]
+        seeded += [receiver for sender, receiver in pairs]
+        rounds.append(pairs)
+    return rounds
+
+
+def get_poll_interval(progress, elapsed, min_interval=5, max_interval=60):
+    """
+    Returns the number of seconds to wait before polling an operation that is
+    progress percent done after elapsed seconds. Polls often when the
+    operation is about to finish and backs off for long running operations.
+    """
+    if progress <= 0:
+        interval = elapsed
+    else:
+        remaining = elapsed * (100 - progress) / float(progress)
+        interval = remaining / 4
+    return max(min_interval, min(max_interval, interval))
+
+
 def generate_passwd(length):
     return "".join(random.sample(string.letters + string.digits, length))
 
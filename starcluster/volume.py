@@ -49,6 +49,8 @@ class VolumeCreator(cluster.Cluster):
         self._host_instance = host_instance
         self._instance = None
         self._volume = None
+        self._snapshot = None
+        self._new_volumes = []
         self._aws_block_device = device or '/dev/sdz'
         self._real_device = None
         self._image_id = image_id or static.BASE_AMI_32
@@ -113,9 +115,10 @@ class VolumeCreator(cluster.Cluster):
         return vol
 
     def _create_snapshot(self, volume):
-        snap = self.ec2.create_snapshot(volume, wait_for_snapshot=True)
+        snap = self.ec2.create_snapshot(volume)
         log.info("New snapshot id: %s" % snap.id)
         self._snapshot = snap
+        self.ec2.wait_for_snapshots([snap])
         return snap
 
     def _determine_device(self):
@@ -126,6 +129,20 @@ class VolumeCreator(cluster.Cluster):
                 self._aws_block_device = dev
                 return self._aws_block_device
 
+    def _determine_devices(self, count):
+        """
+        Returns count free devices on the host instance (from /dev/sdz down
+        to /dev/sdf, sda-sde being used for the root and ephemeral drives)
+        """
+        block_dev_map = self._instance.block_device_mapping
+        devices = ['/dev/sd%s' % char for char in string.lowercase[:4:-1]]
+        devices = [dev for dev in devices if not block_dev_map.get(dev)]
+        if len(devices) < count:
+            raise exception.ValidationError(
+                "host instance %s only has %d free devices for %d volumes" %
+                (self._instance.id, len(devices), count))
+        return devices[:count]
+
     def _get_volume_device(self, device=None):
         dev = device or self._aws_block_device
         inst = self._instance
@@ -210,21 +227,60 @@ class VolumeCreator(cluster.Cluster):
             log.error(e.msg)
             return False
 
-    def _repartition_volume(self):
+    def _repartition_volume(self, device=None):
+        device = device or self._real_device
         conn = self._instance.ssh
-        partmap = self._instance.get_partition_map()
-        part = self._real_device + '1'
+        partmap = self._instance.get_partition_map(device=device)
+        part = device + '1'
         start = partmap.get(part)[0]
         conn.execute('echo "%s,,L" | sfdisk -f -uS %s' %
-                     (start, self._real_device), silent=False)
+                     (start, device), silent=False)
         conn.execute('e2fsck -p -f %s' % part, silent=False)
 
-    def _format_volume(self):
-        log.info("Formatting volume...")
-        self._instance.ssh.execute('%s %s' %
-                                   (self._mkfs_cmd, self._real_device),
+    def _format_volume(self, device=None):
+        device = device or self._real_device
+        log.info("Formatting volume on %s..." % device)
+        self._instance.ssh.execute('%s %s' % (self._mkfs_cmd, device),
                                    silent=False)
 
+    def _resize_volume_fs(self, vol_id, device):
+        """
+        Grow the filesystem (and partition, if any) on device to fill the
+        (larger) volume it was restored to
+        """
+        host = self._instance
+        # execute rather than ssh.ls: batched resizes run this concurrently
+        # on the same host
+        devs = host.ssh.execute('ls -1d %s* 2>/dev/null' % device,
+                                ignore_exit_status=True)
+        if len(devs) == 1:
+            log.info("No partitions found, resizing entire device")
+        elif len(devs) == 2:
+            log.info("One partition found, resizing partition...")
+            self._repartition_volume(device)
+            device += '1'
+        else:
+            raise exception.InvalidOperation(
+                "EBS volume %s has more than 1 partition. "
+                "You must resize this volume manually" % vol_id)
+        if self._resizefs_cmd.split()[0] == "resize2fs":
+            log.info("Running e2fsck on %s" % device)
+            host.ssh.execute("e2fsck -y -f %s" % device)
+        log.info("Running %s on %s" % (self._resizefs_cmd, device))
+        host.ssh.execute(' '.join([self._resizefs_cmd, device]))
+
+    def _tag_volume(self, vol, name=None, tags=None):
+        if tags:
+            for tag in tags:
+                tagval = tags.get(tag)
+                tagmsg = "Adding volume tag: %s" % tag
+                if tagval:
+                    tagmsg += "=%s" % tagval
+                log.info(tagmsg)
+                vol.add_tag(tag, tagval)
+        if name:
+            vol.add_tag("Name", name)
+
     def _warn_about_volume_hosts(self):
         sg = self.ec2.get_group_or_none(static.VOLUME_GROUP)
         vol_hosts = []
@@ -285,16 +341,7 @@ class VolumeCreator(cluster.Cluster):
             self._validate_required_progs([self._mkfs_cmd.split()[0]])
             self._determine_device()
             vol = self._create_volume(volume_size, volume_zone)
-            if tags:
-                for tag in tags:
-                    tagval = tags.get(tag)
-                    tagmsg = "Adding volume tag: %s" % tag
-                    if tagval:
-                        tagmsg += "=%s" % tagval
-                    log.info(tagmsg)
-                    vol.add_tag(tag, tagval)
-            if name:
-                vol.add_tag("Name", name)
+            self._tag_volume(vol, name=name, tags=tags)
             self._attach_volume(self._volume, instance.id,
                                 self._aws_block_device)
             self._get_volume_device(self._aws_block_device)
@@ -310,12 +357,120 @@ class VolumeCreator(cluster.Cluster):
         finally:
             self._warn_about_volume_hosts()
 
+    def _run_batch(self, method, jobs):
+        """
+        Run method(*args) for each (volume, args) in jobs concurrently on the
+        host instance. Returns a dict mapping volume ids to None on success or
+        to the error message on failure.
+        """
+        def run_job(vol_id, args):
+            start = time.time()
+            try:
+                method(*args)
+                return vol_id, (None, time.time() - start)
+            except Exception, e:
+                log.debug("%s failed" % vol_id, exc_info=True)
+                return vol_id, (str(e) or e.__class__.__name__,
+                                time.time() - start)
+        for vol, args in jobs:
+            self.pool.simple_job(run_job, (vol.id, args), jobid=vol.id)
+        return dict(self.pool.wait(numtasks=len(jobs)))
+
+    def _log_batch_summary(self, rows, results):
+        """
+        rows is a list of (volume id, description) tuples
+        """
+        log.info("Summary:")
+        for vol_id, desc in rows:
+            error, secs = results.get(vol_id, ("not processed", 0))
+            status = "FAILED (%s)" % error if error else "OK"
+            log.info("%s: %s - %s (%0.1f mins)" %
+                     (vol_id, desc, status, secs / 60.0),
+                     extra=dict(__raw__=True))
+
+    def _shutdown_batch(self, vols):
+        host = self._instance
+        for vol in vols:
+            if self._detach_vol:
+                log.info("Detaching volume %s from instance %s" %
+                         (vol.id, host.id))
+                vol.detach()
+            else:
+                log.info("Leaving volume %s attached to instance %s" %
+                         (vol.id, host.id))
+        if self._shutdown:
+            log.info("Terminating host instance %s" % host.id)
+            host.terminate()
+        else:
+            log.info("Not terminating host instance %s" % host.id)
+
+    def _delete_volumes(self, vols):
+        """
+        Should only be used during clean-up in the case of an error
+        """
+        for vol in vols:
+            self._volume = vol
+            self._delete_new_volume()
+
+    @print_timing("Creating volumes")
+    def create_many(self, count, volume_size, volume_zone, name=None,
+                    tags=None):
+        """
+        Create count volumes of volume_size GB in volume_zone using a single
+        host instance. The volumes are created, attached at distinct devices
+        and formatted concurrently. If name is specified each volume is named
+        name-1, name-2, etc. Returns the list of volumes that were created
+        successfully.
+        """
+        vols = self._new_volumes = []
+        results = {}
+        try:
+            self.validate(volume_size, volume_zone, self._aws_block_device)
+            instance = self._request_instance(volume_zone)
+            self._validate_required_progs([self._mkfs_cmd.split()[0]])
+            devices = self._determine_devices(count)
+            for i in range(count):
+                vols.append(self.ec2.create_volume(volume_size, volume_zone))
+            log.info("New volume ids: %s" % ', '.join([v.id for v in vols]))
+            self.ec2.wait_for_volumes(vols, status='available')
+            for i, (vol, device) in enumerate(zip(vols, devices)):
+                vol_name = name and "%s-%d" % (name, i + 1)
+                self._tag_volume(vol, name=vol_name, tags=tags)
+                log.info("Attaching volume %s to instance %s on %s..." %
+                         (vol.id, instance.id, device))
+                vol.attach(instance.id, device)
+            self.ec2.wait_for_volumes(vols, state='attached')
+            jobs = [(vol, (self._get_volume_device(device),))
+                    for vol, device in zip(vols, devices)]
+            results = self._run_batch(self._format_volume, jobs)
+            failed = [v for v in vols if results[v.id][0]]
+            self._new_volumes = [v for v in vols if v not in failed]
+            self._delete_volumes(failed)
+            self._shutdown_batch(self._new_volumes)
+            return self._new_volumes
+        except Exception:
+            log.error("Failed to create new volumes", exc_info=True)
+            self._delete_volumes(self._new_volumes)
+            raise
+        finally:
+            self._log_batch_summary(
+                [(v.id, "%sGB in %s" % (volume_size, volume_zone))
+                 for v in vols], results)
+            self._warn_about_volume_hosts()
+
     def _validate_resize(self, vol, size):
         self._validate_size(size)
         if vol.size > size:
             log.warn("You are attempting to shrink an EBS volume. "
                      "Data loss may occur")
 
+    def _validate_resize_progs(self):
+        resizefs_exe = self._resizefs_cmd.split()[0]
+        required = [resizefs_exe]
+        if resizefs_exe == 'resize2fs':
+            required.append('e2fsck')
+        self._validate_required_progs(required)
+
     @print_timing("Resizing volume")
     def resize(self, vol, size, dest_zone=None):
         """
@@ -335,32 +490,13 @@ class VolumeCreator(cluster.Cluster):
                 self._validate_zone(dest_zone)
                 zone = dest_zone
             host = self._request_instance(zone)
-            resizefs_exe = self._resizefs_cmd.split()[0]
-            required = [resizefs_exe]
-            if resizefs_exe == 'resize2fs':
-                required.append('e2fsck')
-            self._validate_required_progs(required)
+            self._validate_resize_progs()
             self._determine_device()
             snap = self._create_snapshot(vol)
             new_vol = self._create_volume(size, zone, snap.id)
             self._attach_volume(new_vol, host.id, self._aws_block_device)
             device = self._get_volume_device()
-            devs = filter(lambda x: x.startswith(device), host.ssh.ls('/dev'))
-            if len(devs) == 1:
-                log.info("No partitions found, resizing entire device")
-            elif len(devs) == 2:
-                log.info("One partition found, resizing partition...")
-                self._repartition_volume()
-                device += '1'
-            else:
-                raise exception.InvalidOperation(
-                    "EBS volume %s has more than 1 partition. "
-                    "You must resize this volume manually" % vol.id)
-            if resizefs_exe == "resize2fs":
-                log.info("Running e2fsck on new volume")
-                host.ssh.execute("e2fsck -y -f %s" % device)
-            log.info("Running %s on new volume" % self._resizefs_cmd)
-            host.ssh.execute(' '.join([self._resizefs_cmd, device]))
+            self._resize_volume_fs(vol.id, device)
             self.shutdown()
             return new_vol.id
         except Exception:
@@ -374,3 +510,72 @@ class VolumeCreator(cluster.Cluster):
                 log_func("Deleting snapshot %s" % snap.id)
                 snap.delete()
             self._warn_about_volume_hosts()
+
+    @print_timing("Resizing volumes")
+    def resize_many(self, vols, size, dest_zone=None):
+        """
+        Resize each EBS volume in vols to size GB using one host instance per
+        zone. Snapshots of all volumes are taken concurrently and the new
+        volumes are restored, attached at distinct devices and resized
+        concurrently. Returns a dict mapping each original volume id to its
+        new volume id (None if resizing that volume failed).
+        """
+        self._validate_device(self._aws_block_device)
+        for vol in vols:
+            self._validate_resize(vol, size)
+        if dest_zone:
+            self._validate_zone(dest_zone)
+        zones = {}
+        for vol in vols:
+            zones.setdefault(dest_zone or vol.zone, []).append(vol)
+        new_vol_ids = {}
+        for zone in sorted(zones):
+            new_vol_ids.update(self._resize_in_zone(zones[zone], size, zone))
+        return new_vol_ids
+
+    def _resize_in_zone(self, vols, size, zone):
+        snaps = []
+        new_vols = self._new_volumes = []
+        results = {}
+        try:
+            host = self._request_instance(zone)
+            self._validate_resize_progs()
+            devices = self._determine_devices(len(vols))
+            for vol in vols:
+                snap = self.ec2.create_snapshot(vol)
+                log.info("New snapshot id: %s" % snap.id)
+                snaps.append(snap)
+            self.ec2.wait_for_snapshots(snaps)
+            for snap in snaps:
+                new_vols.append(self.ec2.create_volume(size, zone, snap.id))
+            log.info("New volume ids: %s" %
+                     ', '.join([v.id for v in new_vols]))
+            self.ec2.wait_for_volumes(new_vols, status='available')
+            for new_vol, device in zip(new_vols, devices):
+                log.info("Attaching volume %s to instance %s on %s..." %
+                         (new_vol.id, host.id, device))
+                new_vol.attach(host.id, device)
+            self.ec2.wait_for_volumes(new_vols, state='attached')
+            jobs = [(new_vol, (vol.id, self._get_volume_device(device)))
+                    for vol, new_vol, device in zip(vols, new_vols, devices)]
+            results = self._run_batch(self._resize_volume_fs, jobs)
+            failed = [v for v in new_vols if results[v.id][0]]
+            self._new_volumes = [v for v in new_vols if v not in failed]
+            self._delete_volumes(failed)
+            self._shutdown_batch(self._new_volumes)
+            return dict([(vol.id, new_vol.id if new_vol not in failed
+                          else None)
+                         for vol, new_vol in zip(vols, new_vols)])
+        except Exception:
+            log.error("Failed to resize volumes in %s" % zone, exc_info=True)
+            self._delete_volumes(self._new_volumes)
+            raise
+        finally:
+            for snap in snaps:
+                log.info("Deleting snapshot %s" % snap.id)
+                snap.delete()
+            self._log_batch_summary(
+                [(new_vol.id, "%s resized from %sGB to %sGB" %
+                  (vol.id, vol.size, size))
+                 for vol, new_vol in zip(vols, new_vols)], results)
+            self._warn_about_volume_hosts()